@@ -0,0 +1,35 @@
+import ast
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+WEBHOOK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webhook_cloud_function.py")
+
+
+@pytest.fixture
+def webhook():
+    """
+    Loads top-level definitions of the webhook by name. Importing the module needs LangChain, Vertex AI
+    and the Matching Engine helpers, and initializes Vertex AI, so only the given definitions are run,
+    with the modules they use and any stand-ins passed as keyword arguments.
+    """
+    with open(WEBHOOK_PATH) as f:
+        tree = ast.parse(f.read())
+
+    def load(*names, **namespace):
+        def defines(node):
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+                return node.name in names
+            return isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id in names for target in node.targets)
+
+        module = ast.Module(body=[node for node in tree.body if defines(node)], type_ignores=[])
+        scope = dict(asyncio=asyncio, threading=threading, time=time)
+        scope.update(namespace)
+        exec(compile(module, WEBHOOK_PATH, "exec"), scope)
+        return scope
+
+    return load
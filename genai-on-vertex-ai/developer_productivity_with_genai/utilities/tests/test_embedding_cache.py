@@ -0,0 +1,82 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+import pytest
+
+MODEL = "textembedding-gecko@003"
+
+
+class FakeEmbeddings:
+    """Embeds a text as [len(text), n], n counting the texts embedded so far."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), float(len(self.embedded))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def cached_embeddings(webhook):
+    scope = webhook("RETRIEVAL_QUERY", "RETRIEVAL_DOCUMENT", "EMBEDDING_MODEL", "EMBEDDING_CACHE_SIZE",
+                    "EMBEDDING_CACHE_LOOKUP_BATCH", "CachedEmbeddings", os=None, EMBEDDING_CACHE_PATH=None,
+                    Embeddings=object, List=list, hashlib=hashlib, sqlite3=sqlite3, array=array, OrderedDict=OrderedDict)
+    return scope["CachedEmbeddings"]
+
+
+def test_texts_are_embedded_once_per_task_type(cached_embeddings):
+    embeddings = FakeEmbeddings()
+    cache = cached_embeddings(embeddings, MODEL)
+    first = cache.embed_documents(["a", "bb", "a"])
+    assert cache.embed_documents(["bb", "a"]) == [first[1], first[0]]
+    cache.embed_query("a")
+    assert embeddings.embedded == ["a", "bb", "a"]
+    assert cache.stats()["misses"] == 3
+
+
+def test_unpinned_model_versions_are_rejected(cached_embeddings):
+    with pytest.raises(ValueError, match="pinned model version"):
+        cached_embeddings(FakeEmbeddings(), "textembedding-gecko")
+
+
+def test_embeddings_evicted_from_memory_are_read_from_disk(cached_embeddings, tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    embeddings = FakeEmbeddings()
+    cache = cached_embeddings(embeddings, MODEL, path=path, max_entries=1)
+    vectors = cache.embed_documents(["a", "bb"])
+    assert cache.embed_documents(["a"]) == vectors[:1]
+    # a new instance, e.g. after a restart, reads the embeddings written by the previous one
+    restarted = cached_embeddings(embeddings, MODEL, path=path)
+    assert restarted.embed_documents(["bb"]) == vectors[1:]
+    assert embeddings.embedded == ["a", "bb"]
+    assert cache.stats()["disk_hits"] == 1 and restarted.stats()["disk_hits"] == 1
+
+
+def test_threads_share_the_disk_tier(cached_embeddings, tmp_path):
+    embeddings = FakeEmbeddings()
+    cache = cached_embeddings(embeddings, MODEL, path=str(tmp_path / "embeddings.sqlite"), max_entries=1)
+    texts = [f"text {i}" for i in range(20)]
+    cache.embed_documents(texts)
+    results, errors = [], []
+
+    def lookup():
+        try:
+            results.append(cache.embed_documents(texts))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(embeddings.embedded) == len(texts)
+    assert all(result == results[0] for result in results)
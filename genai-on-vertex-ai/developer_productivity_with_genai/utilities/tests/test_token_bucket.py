@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class FakeClock:
+    """Stands in for `time` and `asyncio.sleep`, advancing only when slept on."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.now += seconds
+
+
+def test_requests_beyond_the_burst_wait_for_the_rate(webhook):
+    clock = FakeClock()
+    bucket = webhook("TokenBucket", time=clock)["TokenBucket"](requests_per_minute=120, capacity=2)
+    starts = []
+    for _ in range(5):
+        bucket.acquire()
+        starts.append(clock.now)
+    assert starts == [0.0, 0.0, 0.5, 1.0, 1.5]
+
+
+def test_coroutines_share_the_bucket_of_threads(webhook):
+    clock = FakeClock()
+    bucket = webhook("TokenBucket", time=clock, asyncio=SimpleNamespace(sleep=clock.async_sleep))["TokenBucket"](
+        requests_per_minute=60)
+    bucket.acquire()
+    asyncio.run(bucket.aacquire())
+    bucket.acquire()
+    assert clock.now == 2.0
+
+
+def test_limiters_are_shared_per_quota(webhook):
+    get_limiter = webhook("TokenBucket", "_limiters", "_limiters_lock", "get_limiter")["get_limiter"]
+    limiter = get_limiter(("project", "textembedding-gecko@003"), 100)
+    assert get_limiter(("project", "textembedding-gecko@003"), 100) is limiter
+    assert get_limiter(("project", "text-embedding-004"), 100) is not limiter
+    assert get_limiter(("project", "textembedding-gecko@003"), 100, capacity=10).capacity == 10
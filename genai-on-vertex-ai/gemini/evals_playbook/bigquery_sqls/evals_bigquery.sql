@@ -134,12 +134,13 @@ CREATE TABLE IF NOT EXISTS eval_run_details (
     -- output_response             STRING OPTIONS(description="The complete response generated by the model, including any structured data"),
     ground_truth                STRING OPTIONS(description="The expected/correct output for the given input"),
     metrics                     STRING OPTIONS(description="JSON string containing the metrics and their scores for this run"),
-    -- input_token_count           INT OPTIONS(description="Number of input tokens in this run"),
-    -- output_token_count          INT OPTIONS(description="Number of output tokens generated in this run"),
-    -- total_token_count           INT OPTIONS(description="Total number of tokens (input + output) in this run"),
+    input_token_count           INT64 OPTIONS(description="Number of input tokens of the model request"),
+    output_token_count          INT64 OPTIONS(description="Number of output tokens generated by the model"),
+    total_token_count           INT64 OPTIONS(description="Total number of tokens (input + output) of the model request"),
     -- num_retries                 INT OPTIONS(description="Number of retries attempted for this run"),
     -- avg_latency                 NUMERIC OPTIONS(description="Average latency for this run"),
     latencies                   ARRAY<NUMERIC> OPTIONS(description="Array of latencies for each request in this run"),
+    time_to_first_token         FLOAT64 OPTIONS(description="Seconds until the first token of the response was received"),
     create_datetime             DATETIME OPTIONS(description="Timestamp of when the run details were created"),
     update_datetime             DATETIME OPTIONS(description="Timestamp of when the run details were last updated"),
     tags                        ARRAY<STRING> OPTIONS(description="Tags associated with the run details for easy filtering and searching"),
@@ -151,6 +152,27 @@ OPTIONS(
     labels=[("tool", "vertexai-gemini-evals")]
 );
 
+-- eval_run_metrics
+CREATE TABLE IF NOT EXISTS eval_run_metrics (
+    run_id                      STRING OPTIONS(description="Foreign key referencing the eval_runs table"),
+    experiment_id               STRING OPTIONS(description="Foreign key referencing the eval_experiments table"),
+    task_id                     STRING OPTIONS(description="Foreign key referencing the eval_tasks table"),
+    metric_name                 STRING OPTIONS(description="Name of the summary metric (e.g., rouge_1/mean)"),
+    metric_value                FLOAT64 OPTIONS(description="Value of the summary metric"),
+    create_datetime             DATETIME OPTIONS(description="Timestamp of when the metric was created"),
+    update_datetime             DATETIME OPTIONS(description="Timestamp of when the metric was last updated")
+)
+OPTIONS(
+    description="Table storing the summary metrics of each evaluation run in long format, one row per metric",
+    labels=[("tool", "vertexai-gemini-evals")]
+);
+
+-- columns added after the first release, for datasets created with an earlier version of this script
+ALTER TABLE eval_run_details ADD COLUMN IF NOT EXISTS input_token_count INT64 OPTIONS(description="Number of input tokens of the model request");
+ALTER TABLE eval_run_details ADD COLUMN IF NOT EXISTS output_token_count INT64 OPTIONS(description="Number of output tokens generated by the model");
+ALTER TABLE eval_run_details ADD COLUMN IF NOT EXISTS total_token_count INT64 OPTIONS(description="Total number of tokens (input + output) of the model request");
+ALTER TABLE eval_run_details ADD COLUMN IF NOT EXISTS time_to_first_token FLOAT64 OPTIONS(description="Seconds until the first token of the response was received");
+
 ALTER TABLE eval_tasks ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME());
 ALTER TABLE eval_tasks ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME());
 ALTER TABLE eval_experiments ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME());
@@ -162,4 +184,6 @@ ALTER TABLE eval_datasets ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATE
 ALTER TABLE eval_runs ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME());
 ALTER TABLE eval_runs ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME());
 ALTER TABLE eval_run_details ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME());
-ALTER TABLE eval_run_details ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME());
\ No newline at end of file
+ALTER TABLE eval_run_details ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME());
+ALTER TABLE eval_run_metrics ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME());
+ALTER TABLE eval_run_metrics ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME());
\ No newline at end of file
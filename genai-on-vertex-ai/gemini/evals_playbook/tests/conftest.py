@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Keep the local caches of the code under test (~/.cache/evals_playbook) out of the real home directory.
+# Set before `utils` is imported, as the cache directory is resolved at import time
+os.environ["HOME"] = tempfile.mkdtemp(prefix="evals_playbook_tests_")
@@ -0,0 +1,63 @@
+import gc
+import threading
+import weakref
+
+import pytest
+
+from utils.storage_backends import BackgroundWriter, WriteStats, _close_writers_at_exit
+
+
+class RecordingBackend:
+    """Records upserts, optionally failing them."""
+
+    def __init__(self, fail=False):
+        self.upserts = []
+        self.fail = fail
+
+    def upsert(self, table_name, update_keys, rows):
+        if self.fail:
+            raise ValueError("write failed")
+        self.upserts.append((table_name, list(rows)))
+
+
+def test_rows_are_coalesced_and_written_on_flush():
+    backend = RecordingBackend()
+    writer = BackgroundWriter(backend, WriteStats(), flush_interval=60)
+    writer.submit("runs", ["run_id"], [{"run_id": "a", "metrics": "1"}])
+    writer.submit("runs", ["run_id"], [{"run_id": "a", "metrics": "2"}, {"run_id": "b", "metrics": "3"}])
+    writer.flush()
+    assert backend.upserts == [("runs", [{"run_id": "a", "metrics": "2"}, {"run_id": "b", "metrics": "3"}])]
+    assert writer.stats["rows_coalesced"] == 1
+    writer.close()
+
+
+def test_write_failures_are_raised_by_flush():
+    writer = BackgroundWriter(RecordingBackend(fail=True), WriteStats(), flush_interval=0)
+    writer.submit("runs", ["run_id"], [{"run_id": "a"}])
+    with pytest.raises(RuntimeError, match="write failed"):
+        writer.flush()
+    writer.close()
+
+
+def test_exit_hook_writes_queued_rows():
+    backend = RecordingBackend()
+    writer = BackgroundWriter(backend, WriteStats(), flush_interval=60)
+    writer.submit("runs", ["run_id"], [{"run_id": "a"}])
+    _close_writers_at_exit()
+    assert backend.upserts == [("runs", [{"run_id": "a"}])]
+    with pytest.raises(RuntimeError, match="closed"):
+        writer.submit("runs", ["run_id"], [{"run_id": "b"}])
+
+
+def test_idle_writer_is_released():
+    writer = BackgroundWriter(RecordingBackend(), WriteStats(), flush_interval=0)
+    writer.submit("runs", ["run_id"], [{"run_id": "a"}])
+    writer.flush()
+    thread = writer._thread
+    if thread is not None:
+        thread.join(timeout=5)
+    ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert ref() is None
+    assert not any(t.name == "evals-background-writer" and t.is_alive() for t in threading.enumerate())
@@ -0,0 +1,43 @@
+from vertexai.generative_models import GenerationResponse
+
+from utils.instrumentation import ModelTelemetry, merge_streamed_response
+
+
+def chunk(text, **fields):
+    return GenerationResponse.from_dict(
+        {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}], **fields})
+
+
+STREAM = [
+    chunk("Hel"),
+    chunk("lo", usage_metadata={"prompt_token_count": 3, "candidates_token_count": 2, "total_token_count": 5}),
+]
+
+
+class StreamingModel:
+    def generate_content(self, contents, stream=False):
+        return iter(STREAM) if stream else merge_streamed_response(STREAM)
+
+
+def test_streamed_chunks_are_merged():
+    response = merge_streamed_response(STREAM)
+    assert response.text == "Hello"
+    assert response.usage_metadata.total_token_count == 5
+
+
+def test_streamed_calls_are_recorded():
+    telemetry = ModelTelemetry()
+    model = telemetry.instrument(StreamingModel(), stream=True)
+    assert model.generate_content("prompt").text == "Hello"
+    row = telemetry.row_telemetry("prompt")
+    assert len(row["latencies"]) == 1
+    assert row["time_to_first_token"] is not None
+    assert (row["input_token_count"], row["output_token_count"], row["total_token_count"]) == (3, 2, 5)
+
+
+def test_rows_without_calls_have_the_same_columns():
+    telemetry = ModelTelemetry()
+    telemetry.instrument(StreamingModel()).generate_content("prompt")
+    missing = telemetry.row_telemetry("other prompt")
+    assert missing.keys() == telemetry.row_telemetry("prompt").keys()
+    assert missing["latencies"] == [] and missing["time_to_first_token"] is None
@@ -0,0 +1,9 @@
+import json
+import math
+
+from utils.json_utils import json_loads
+
+
+def test_json_loads_parses_non_finite_values():
+    parsed = json_loads(json.dumps({"score": float("nan"), "max": float("inf"), "n": 3}))
+    assert math.isnan(parsed["score"]) and parsed["max"] == float("inf") and parsed["n"] == 3
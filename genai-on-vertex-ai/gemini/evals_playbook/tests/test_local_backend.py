@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+from utils.storage_backends import LocalBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalBackend(str(tmp_path / "local"))
+
+
+def run(run_id, metrics, created, experiment_id="e1"):
+    return dict(run_id=run_id, experiment_id=experiment_id, task_id="t", metrics=metrics,
+                create_datetime=created, update_datetime=created, tags=["a", "b"])
+
+
+def test_upsert_updates_rows_matching_the_keys_and_keeps_create_datetime(backend):
+    keys = ["task_id", "experiment_id", "run_id"]
+    first, later = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 6, 1)
+    backend.upsert("eval_runs", keys, [run("r1", '{"m": 1}', first), run("r2", '{"m": 2}', first)])
+    backend.upsert("eval_runs", keys, [run("r1", '{"m": 3}', later)])
+
+    df = backend.select("eval_runs").set_index("run_id")
+    assert len(df) == 2
+    assert df.loc["r1", "metrics"] == '{"m": 3}'
+    assert df.loc["r1", "create_datetime"] == first
+    assert df.loc["r1", "update_datetime"] == later
+    assert df.loc["r1", "tags"] == ["a", "b"]
+
+
+def test_select_filters_and_limits_latest_first(backend):
+    keys = ["task_id", "experiment_id", "run_id"]
+    backend.upsert("eval_runs", keys, [run(f"r{i}", "{}", datetime.datetime(2024, 1, i + 1)) for i in range(5)])
+
+    assert list(backend.select("eval_runs", columns=["run_id"], limit=2)["run_id"]) == ["r4", "r3"]
+    assert list(backend.select("eval_runs", where_keys={"run_id": "r1"})["run_id"]) == ["r1"]
+    assert sorted(backend.select("eval_runs", in_filters={"run_id": ["r0", "r2", "x"]})["run_id"]) == ["r0", "r2"]
+    assert backend.select("eval_runs", in_filters={"run_id": []}).empty
+    with pytest.raises(ValueError, match="Unknown columns"):
+        backend.select("eval_runs", columns=["nope"])
+
+
+def test_iter_rows_streams_every_row(backend, monkeypatch):
+    monkeypatch.setattr("utils.storage_backends.LOCAL_READ_CHUNK_ROWS", 2)
+    keys = ["task_id", "experiment_id", "run_id"]
+    backend.upsert("eval_runs", keys, [run(f"r{i}", "{}", datetime.datetime(2024, 1, 1)) for i in range(5)])
+
+    chunks = list(backend.iter_rows("eval_runs", columns=["run_id"]))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert sorted(run_id for chunk in chunks for run_id in chunk["run_id"]) == [f"r{i}" for i in range(5)]
+
+
+def test_objects_are_written_created_once_and_read_back(backend):
+    uri = backend.write_object("prompts/a.txt", "hello world")
+    assert backend.read_object(uri) == b"hello world"
+    assert backend.read_object(f"{uri}#bytes=6-10") == b"world"
+    assert backend.create_object("prompts/b.txt", "first") is True
+    assert backend.create_object("prompts/b.txt", "second") is False
+    assert backend.read_object(backend.object_uri("prompts/b.txt")) == b"first"
+    with pytest.raises(ValueError):
+        backend.write_object("../escape.txt", "x")
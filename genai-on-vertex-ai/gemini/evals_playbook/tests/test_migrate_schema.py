@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+from utils import config as cfg
+from utils.migrate_schema import BACKUP_SUFFIX, MIGRATION_SUFFIX, migrate_table
+
+DATASET = "p.d"
+DDL = """
+CREATE TABLE IF NOT EXISTS eval_runs (
+    run_id STRING,
+    create_datetime DATETIME
+)
+PARTITION BY DATE(create_datetime);
+
+CREATE TABLE IF NOT EXISTS eval_run_details (
+    run_id STRING,
+    create_datetime DATETIME
+)
+PARTITION BY DATE(create_datetime);
+"""
+SCHEMA = [SimpleNamespace(name="run_id"), SimpleNamespace(name="create_datetime")]
+
+
+class FakeClient:
+    """Keeps the row count of each table, and runs the statements of the migration on them."""
+
+    def __init__(self, counts, partitioned=(), written_while_copying=0):
+        self.counts = dict(counts)
+        self.partitioned = set(partitioned)
+        self.written_while_copying = written_while_copying
+        self.statements = []
+
+    def get_table(self, table_id):
+        if table_id not in self.counts:
+            raise NotFound(table_id)
+        return SimpleNamespace(schema=SCHEMA, time_partitioning=object() if table_id in self.partitioned else None)
+
+    def query_and_wait(self, sql):
+        self.statements.append(sql)
+        if sql.startswith("SELECT COUNT(*)"):
+            return [{"n": self.counts[sql.split("`")[1]]}]
+        if sql.startswith("CREATE TABLE"):
+            self.counts[sql.split("`")[1]] = 0
+        elif sql.startswith("INSERT INTO"):
+            self.counts[sql.split("`")[1]] = self.counts[sql.split("`")[3]]
+        elif sql.startswith("ALTER TABLE") and " RENAME TO " in sql:
+            table_id = sql.split("`")[1]
+            if sql.endswith(BACKUP_SUFFIX):
+                # rows logged after the original table was counted, until it is renamed
+                self.counts[table_id] += self.written_while_copying
+            self.counts[f"{DATASET}.{sql.split(' RENAME TO ')[1]}"] = self.counts.pop(table_id)
+        return []
+
+
+def test_tables_are_copied_and_swapped():
+    client = FakeClient({f"{DATASET}.eval_run_details": 3})
+    migrate_table(client, DDL, DATASET, "eval_run_details")
+    assert client.counts == {f"{DATASET}.eval_run_details": 3, f"{DATASET}.eval_run_details{BACKUP_SUFFIX}": 3}
+
+
+def test_missing_and_partitioned_tables_are_skipped():
+    client = FakeClient({f"{DATASET}.eval_runs": 2}, partitioned=[f"{DATASET}.eval_runs"])
+    migrate_table(client, DDL, DATASET, "eval_runs")
+    migrate_table(client, DDL, DATASET, "eval_run_metrics")
+    assert client.statements == []
+
+
+def test_tables_written_while_copied_are_restored():
+    client = FakeClient({f"{DATASET}.eval_run_details": 3}, written_while_copying=1)
+    with pytest.raises(Exception, match="1 rows were written"):
+        migrate_table(client, DDL, DATASET, "eval_run_details")
+    assert client.counts[f"{DATASET}.eval_run_details"] == 4
+    assert f"{DATASET}.eval_run_details{BACKUP_SUFFIX}" not in client.counts
+    assert client.counts[f"{DATASET}.eval_run_details{MIGRATION_SUFFIX}"] == 3
+
+
+def test_runs_are_copied_with_the_create_datetime_of_their_details():
+    client = FakeClient({f"{DATASET}.{cfg.BQ_T_EVAL_RUNS}": 2, f"{DATASET}.{cfg.BQ_T_EVAL_RUN_DETAILS}": 5})
+    migrate_table(client, DDL, DATASET, cfg.BQ_T_EVAL_RUNS, dry_run=True)
+    client.statements = []
+    migrate_table(client, DDL, DATASET, cfg.BQ_T_EVAL_RUNS)
+    insert = next(sql for sql in client.statements if sql.startswith("INSERT INTO"))
+    assert "MIN(create_datetime) AS details_created" in insert
+    assert client.counts[f"{DATASET}.{cfg.BQ_T_EVAL_RUNS}"] == 2
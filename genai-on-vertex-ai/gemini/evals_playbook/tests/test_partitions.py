@@ -0,0 +1,63 @@
+import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from utils.storage_backends import BigQueryBackend
+
+
+def table(partitioned=True):
+    return SimpleNamespace(time_partitioning=SimpleNamespace(field="create_datetime") if partitioned else None,
+                           clustering_fields=["task_id", "experiment_id", "run_id"], schema=[])
+
+
+class FakeBigQueryBackend(BigQueryBackend):
+    """Answers the lookups of the create_datetime of runs from `runs`, counting the queries."""
+
+    def __init__(self, runs, partitioned=True, **kwargs):
+        super().__init__(**kwargs)
+        self.runs, self.partitioned, self.queries = runs, partitioned, 0
+
+    def get_table(self, table_name):
+        return table(self.partitioned)
+
+    def query(self, sql, query_parameters=None):
+        self.queries += 1
+        run_ids = query_parameters[0].values
+        return pd.DataFrame([dict(run_id=run_id, create_datetime=created)
+                             for run_id, created in self.runs.items() if run_id in run_ids],
+                            columns=["run_id", "create_datetime"])
+
+
+RUNS = {"r1": datetime.datetime(2024, 3, 1, 12), "r2": datetime.datetime(2024, 1, 1, 8)}
+
+
+def test_reads_of_runs_skip_partitions_before_the_runs_were_created():
+    backend = FakeBigQueryBackend(RUNS)
+    assert (backend.partition_filter("eval_run_details", alias="d", run_ids=["r1", "r2"])
+            == "d.create_datetime >= DATETIME '2024-01-01 08:00:00'")
+    assert backend.partition_filter("eval_run_metrics", run_ids=["r1"]) == "create_datetime >= DATETIME '2024-03-01 12:00:00'"
+    # the create_datetime of runs doesn't change, so it is only looked up once
+    assert backend.queries == 1
+
+
+@pytest.mark.parametrize("run_ids", [["r1", "unknown"], None])
+def test_reads_are_not_pruned_without_the_create_datetime_of_all_runs(run_ids):
+    assert FakeBigQueryBackend(RUNS).partition_filter("eval_run_details", run_ids=run_ids) is None
+
+
+def test_reads_not_filtered_on_runs_are_limited_to_the_partition_window():
+    backend = FakeBigQueryBackend(RUNS, partition_window_days=30)
+    assert backend.partition_filter("eval_run_details") == \
+        "create_datetime >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 30 DAY)"
+    assert FakeBigQueryBackend(RUNS, partitioned=False).partition_filter("eval_run_details", run_ids=["r1"]) is None
+
+
+def test_merges_skip_partitions_before_the_merged_rows():
+    backend = FakeBigQueryBackend(RUNS)
+    rows = [dict(run_id="r1", create_datetime=created) for created in RUNS.values()]
+    conditions, query_parameters = backend._merge_window(table(), rows)
+    assert conditions == ["target.create_datetime >= @merge_since"]
+    assert query_parameters[0].value == datetime.datetime(2024, 1, 1, 8)
+    assert backend._merge_window(table(partitioned=False), rows) == ([], [])
@@ -0,0 +1,104 @@
+import datetime
+
+import pandas as pd
+import pytest
+from vertexai.evaluation import EvalResult
+
+from utils.evals_playbook import Evals, LocalBackend, generate_responses
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FakeModel:
+    """Stands in for a `GenerativeModel`, failing for the prompts containing `fail_on`."""
+
+    def __init__(self, generation_config, fail_on=None):
+        self._model_name = "models/fake"
+        self._generation_config = generation_config
+        self._safety_settings = None
+        self.fail_on = fail_on
+
+    def generate_content(self, prompt, stream=False):
+        if self.fail_on and self.fail_on in prompt:
+            raise RuntimeError("model unavailable")
+        return FakeResponse(prompt.upper())
+
+
+def evaluate(model, prompt, dataset, experiment_run_id):
+    dataset = generate_responses(model, prompt.prompt_template, dataset)
+    dataset["exact/score"] = [float(response == reference) for response, reference
+                              in zip(dataset["response"], dataset["reference"])]
+    return EvalResult(summary_metrics={"exact/mean": dataset["exact/score"].mean()}, metrics_table=dataset)
+
+
+@pytest.fixture
+def evals(tmp_path):
+    evals = Evals(backend=LocalBackend(str(tmp_path / "local")))
+    now = datetime.datetime.now()
+    evals.log_task({"task_id": "t", "task_desc": "test task", "create_datetime": now, "update_datetime": now})
+    return evals
+
+
+DATASET = pd.DataFrame({"context": ["a", "b"], "reference": ["ECHO: A", "ECHO: X"], "dataset_row_id": ["r0", "r1"]})
+PROMPTS = [{"prompt_id": "echo", "prompt_template": "echo: {context}"},
+           {"prompt_id": "flaky", "prompt_template": "flaky: {context}"}]
+CONFIGS = [{"temperature": 0.0}, {"temperature": 0.5}]
+
+
+def test_generate_responses_raises_model_errors():
+    with pytest.raises(RuntimeError, match="model unavailable"):
+        generate_responses(FakeModel({}, fail_on="b"), "{context}", DATASET)
+
+
+def test_failed_runs_are_not_logged_and_are_retried_on_resume(evals):
+    results = evals.run_grid("t", PROMPTS, CONFIGS, DATASET, metrics=["exact"], evaluate_fn=evaluate,
+                             model_fn=lambda prompt, config: FakeModel(config, fail_on="flaky"))
+    status = results.set_index("prompt_id")["status"]
+    assert list(status["echo"]) == ["completed", "completed"]
+    assert list(status["flaky"]) == ["failed", "failed"]
+    assert "model unavailable" in results["error"].dropna().iloc[0]
+
+    resumed = evals.run_grid("t", PROMPTS, CONFIGS, DATASET, metrics=["exact"], evaluate_fn=evaluate,
+                             model_fn=lambda prompt, config: FakeModel(config))
+    status = resumed.set_index("prompt_id")["status"]
+    assert list(status["echo"]) == ["skipped", "skipped"]
+    assert list(status["flaky"]) == ["completed", "completed"]
+    assert list(resumed["run_id"]) == list(results["run_id"])
+
+    details = evals.backend.select("eval_run_details", columns=["run_id", "dataset_row_id", "output_text"])
+    assert len(details) == 8
+    assert set(details["dataset_row_id"]) == {"r0", "r1"}
+
+
+def test_rows_without_ids_pair_up_across_runs(evals):
+    dataset = DATASET.drop(columns="dataset_row_id")
+    results = evals.run_grid("t", PROMPTS[:1], CONFIGS, dataset, metrics=["exact"], evaluate_fn=evaluate,
+                             model_fn=lambda prompt, config: FakeModel(config))
+    run_ids = list(results["run_id"])
+    details = evals.backend.select("eval_run_details", columns=["run_id", "dataset_row_id"])
+    row_ids = details.groupby("run_id")["dataset_row_id"].apply(set)
+    assert len(row_ids[run_ids[0]]) == 2
+    assert row_ids[run_ids[0]] == row_ids[run_ids[1]]
+
+    stats = evals.get_run_statistics(run_ids, baseline_run_id=run_ids[0], n_resamples=100)
+    assert stats.set_index("run_id").loc[run_ids[1], "p_value"] == 1.0
+
+
+def test_rows_of_a_run_keep_its_create_datetime_when_logged_again(evals):
+    def run_grid():
+        return evals.run_grid("t", PROMPTS[:1], CONFIGS[:1], DATASET, metrics=["exact"], evaluate_fn=evaluate,
+                              model_fn=lambda prompt, config: FakeModel(config), resume=False)
+
+    run_id = run_grid()["run_id"].iloc[0]
+    created = evals.backend.select("eval_runs", columns=["create_datetime"])["create_datetime"].iloc[0]
+    run_grid()
+
+    for table in ("eval_runs", "eval_run_details", "eval_run_metrics"):
+        rows = evals.backend.select(table, columns=["run_id", "create_datetime"])
+        assert set(rows["run_id"]) == {run_id}
+        assert set(rows["create_datetime"]) == {created}, table
+    assert len(evals.backend.select("eval_run_details")) == len(DATASET)
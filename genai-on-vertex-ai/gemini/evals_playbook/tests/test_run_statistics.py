@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from utils.run_statistics import _p_values, metric_matrices, run_statistics
+
+
+def details(scores):
+    """`run_details` rows with the per-row metrics written the way `log_eval_run` writes them."""
+    return pd.DataFrame([
+        dict(run_id=run_id, dataset_row_id=row_id, metrics=json.dumps({"rouge_1/score": score}))
+        for run_id, run_scores in scores.items() for row_id, score in enumerate(run_scores)
+    ])
+
+
+def test_nan_row_score_is_parsed_as_missing():
+    _, run_ids, matrices = metric_matrices(details({"a": [0.5, float("nan"), 0.7], "b": [0.4, 0.6, 0.8]}))
+    matrix = matrices["rouge_1/score"]
+    assert run_ids == ["a", "b"]
+    assert np.isnan(matrix[1, 0])
+    assert matrix[2, 1] == 0.8
+
+
+def test_run_statistics_skips_nan_row_scores():
+    stats = run_statistics(details({"a": [0.5, float("nan"), 0.7, 0.9], "b": [0.4, 0.6, 0.8, 0.2]}),
+                           baseline_run_id="b", n_resamples=200)
+    a = stats.set_index("run_id").loc["a"]
+    assert a["n"] == 3
+    assert np.isclose(a["mean"], 0.7)
+    assert a["ci_low"] <= a["mean"] <= a["ci_high"]
+    assert 0 < a["p_value"] <= 1
+
+
+def test_p_values_ignore_resamples_without_a_mean():
+    means = np.array([[1.0, 0.0], [-1.0, 0.0], [np.nan, 0.0], [np.nan, 0.0]])
+    assert np.allclose(_p_values(means, baseline=1), [1.0, 1.0])
+    assert np.isnan(_p_values(np.full((3, 2), np.nan), baseline=1)[0])
@@ -59,7 +59,8 @@ def save_config(PROJECT_ID,
     BQ_T_PROMPTS,
     BQ_T_DATASETS,
     BQ_T_EVAL_RUN_DETAILS,
-    BQ_T_EVAL_RUNS): 
+    BQ_T_EVAL_RUNS,
+    BQ_T_EVAL_RUN_METRICS="eval_run_metrics"): 
     
     config = configparser.ConfigParser()
 
@@ -89,6 +90,7 @@ def save_config(PROJECT_ID,
     config['BIGQUERY']['BQ_T_DATASETS'] = BQ_T_DATASETS
     config['BIGQUERY']['BQ_T_EVAL_RUN_DETAILS'] = BQ_T_EVAL_RUN_DETAILS
     config['BIGQUERY']['BQ_T_EVAL_RUNS'] = BQ_T_EVAL_RUNS
+    config['BIGQUERY']['BQ_T_EVAL_RUN_METRICS'] = BQ_T_EVAL_RUN_METRICS
 
     with open(root_dir+'/config.ini', 'w') as configfile:  
         config.write(configfile)
@@ -111,7 +113,7 @@ def load_config():
         raise FileNotFoundError("config.ini not found in current or parent directories.")
         
     # Make variables global for modification
-    global PROJECT_ID,LOCATION,STAGING_BUCKET,STAGING_BUCKET_URI,BQ_DATASET_ID,BQ_LOCATION,BQ_TABLES_SQL_PATH,BQ_PREFIX,BQ_T_EVAL_TASKS,BQ_T_EXPERIMENTS,BQ_T_PROMPTS,BQ_T_DATASETS,BQ_T_EVAL_RUN_DETAILS,BQ_T_EVAL_RUNS
+    global PROJECT_ID,LOCATION,STAGING_BUCKET,STAGING_BUCKET_URI,BQ_DATASET_ID,BQ_LOCATION,BQ_TABLES_SQL_PATH,BQ_PREFIX,BQ_T_EVAL_TASKS,BQ_T_EXPERIMENTS,BQ_T_PROMPTS,BQ_T_DATASETS,BQ_T_EVAL_RUN_DETAILS,BQ_T_EVAL_RUNS,BQ_T_EVAL_RUN_METRICS
 
     
     PROJECT_ID = config['GCP']['PROJECT_ID']
@@ -128,5 +130,7 @@ def load_config():
     BQ_T_DATASETS = config['BIGQUERY']['BQ_T_DATASETS']
     BQ_T_EVAL_RUN_DETAILS = config['BIGQUERY']['BQ_T_EVAL_RUN_DETAILS']
     BQ_T_EVAL_RUNS = config['BIGQUERY']['BQ_T_EVAL_RUNS']
+    # Added after the first release, so older config.ini files may not have it
+    BQ_T_EVAL_RUN_METRICS = config['BIGQUERY'].get('BQ_T_EVAL_RUN_METRICS', 'eval_run_metrics')
 
 config_parameters = load_config()
\ No newline at end of file
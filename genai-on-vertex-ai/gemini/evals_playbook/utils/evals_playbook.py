@@ -19,31 +19,131 @@ import string
 import hashlib
 import uuid
 import json
+import math
 import re
+import time
 import datetime
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
 
 from utils import config as cfg
+from utils.instrumentation import TIME_DECIMALS, ModelTelemetry
+from utils.json_utils import json_loads
+from utils.run_statistics import N_RESAMPLES, run_statistics
+from utils.storage_backends import (
+    StorageBackend, BigQueryBackend, LocalBackend, BackgroundWriter, WriteStats, timed_upsert,
+    BULK_UPSERT_MIN_ROWS, GCS_UPLOAD_WORKERS, READ_STREAMS, LOCAL_CACHE_DIR,
+    write_to_gcs, gcs_self_link, parse_gcs_uri, split_byte_range, sql_literal,
+)
 from google.cloud import bigquery
 from google.cloud import aiplatform
-from google.cloud import storage
-from vertexai.evaluation import EvalResult
+from vertexai.evaluation import EvalResult, EvalTask, PromptTemplate
+from vertexai.generative_models import GenerativeModel
 
 from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.orm import declarative_base
 from sqlalchemy import create_engine, MetaData, Column, String, Table
+from sqlalchemy import ARRAY, Boolean, Date, DateTime, Float, Integer, Numeric
 from utils.config import PROJECT_ID, LOCATION, STAGING_BUCKET
 
 
+logger = logging.getLogger(__name__)
+
 BQ_TABLE_MAP = {
     "tasks":        {"table_name": cfg.BQ_T_EVAL_TASKS, "keys": ["task_id"]},
     "experiments":  {"table_name": cfg.BQ_T_EXPERIMENTS, "keys": ["task_id", "experiment_id"]},
     "prompts":      {"table_name": cfg.BQ_T_PROMPTS, "keys": ["prompt_id"]},
     "datasets":     {"table_name": cfg.BQ_T_DATASETS, "keys": ["dataset_id"]},
     "runs":         {"table_name": cfg.BQ_T_EVAL_RUNS, "keys": ["task_id", "experiment_id", "run_id"]},
-    "run_details":  {"table_name": cfg.BQ_T_EVAL_RUN_DETAILS, "keys": ["task_id", "experiment_id", "run_id", "dataset_row_id"]}
+    "run_details":  {"table_name": cfg.BQ_T_EVAL_RUN_DETAILS, "keys": ["task_id", "experiment_id", "run_id", "dataset_row_id"]},
+    "run_metrics":  {"table_name": cfg.BQ_T_EVAL_RUN_METRICS, "keys": ["task_id", "experiment_id", "run_id", "metric_name"]}
 }
 
+# Raised by the methods that need `run_metrics` on datasets created before the table existed
+RUN_METRICS_MISSING = (
+    "Table '{table}' doesn't exist in this dataset. Re-run bigquery_sqls/evals_bigquery_v2.sql to create it, "
+    "then call `Evals.backfill_run_metrics()` to populate it from the runs logged before.")
+
+# Responses generated concurrently for the rows of one combination of `run_grid`
+GENERATION_WORKERS = 8
+
+# `EvalTask.evaluate` logs to the global aiplatform experiment tracker, so concurrent evaluations could
+# attribute runs and metrics to the wrong experiment
+EVAL_TASK_LOCK = threading.Lock()
+
+# Prefix in the staging bucket for prompts stored by content hash, shared across tasks and runs
+CAS_PROMPTS_PREFIX = "prompts/sha256"
+
+# Rows of run details whose prompts are uploaded and merged together by `log_eval_run`. Chunks of at least
+# BULK_UPSERT_MIN_ROWS rows are merged through a staging table, which costs a few job round-trips (create,
+# load, MERGE, drop) per chunk, so chunks are 10x that threshold to amortize them. Smaller chunks redo less
+# work after an interruption; below BULK_UPSERT_MIN_ROWS each chunk is a single parameterized MERGE.
+LOG_CHUNK_ROWS = 10 * BULK_UPSERT_MIN_ROWS
+
+# Checkpoints of `log_eval_run`, listing the chunks of each run already written
+LOG_PROGRESS_DIR = os.path.join(LOCAL_CACHE_DIR, "log_progress")
+
+def parse_json(value):
+    """Parses a JSON string column, treating NULL and empty values as an empty object."""
+    if value is None or (isinstance(value, float) and pd.isna(value)) or value == "":
+        return {}
+    return json_loads(value)
+
+def metrics_to_rows(run_id, experiment_id, task_id, metrics, create_datetime=None):
+    """
+    Flattens a dict of summary metrics into `run_metrics` rows. Non-numeric and non-finite values are skipped.
+    The rows are created at `create_datetime`, which defaults to now.
+    """
+    now = datetime.datetime.now()
+    return [
+        dict(run_id=run_id, experiment_id=experiment_id, task_id=task_id,
+             metric_name=name, metric_value=float(value),
+             create_datetime=create_datetime or now, update_datetime=now)
+        for name, value in metrics.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+    ]
+
+def _parse_param(value):
+    """Parses a parameter value returned as a JSON string by the grid search queries."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    return json_loads(value)
+
+def _to_json(value):
+    """Encodes a parameter value as JSON, the way the grid search queries return it."""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    if value is None or pd.isna(value):
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    return json.dumps(value, default=str)
+
+def pareto_front_mask(values):
+    """
+    Returns a boolean mask of the rows of `values` (n_runs x n_objectives, larger is better) that are not
+    dominated by any other row. Each pass drops every row dominated by the current candidate at once, so
+    the cost grows with the number of runs times the size of the front rather than quadratically.
+    """
+    n = len(values)
+    candidates = np.arange(n)
+    remaining = values
+    i = 0
+    while i < len(remaining):
+        point = remaining[i]
+        keep = np.any(remaining > point, axis=1) | np.all(remaining == point, axis=1)
+        candidates = candidates[keep]
+        remaining = remaining[keep]
+        i = np.count_nonzero(keep[:i]) + 1
+    mask = np.zeros(n, dtype=bool)
+    mask[candidates] = True
+    return mask
+
 def get_table_name_keys(table_class):
     if table_class not in BQ_TABLE_MAP:
         raise ValueError(f"Invalid table class '{table_class}'. Supported {list(BQ_TABLE_MAP.keys())}")
@@ -68,6 +168,34 @@ def get_db_classes():
     Base.prepare()
     return Base
 
+# BigQuery column types mapped to the SQLAlchemy types used for the mapped classes
+SA_TYPE_MAP = {
+    "STRING": String, "JSON": String,
+    "BOOL": Boolean, "BOOLEAN": Boolean,
+    "DATE": Date, "DATETIME": DateTime, "TIMESTAMP": DateTime,
+    "INTEGER": Integer, "INT64": Integer,
+    "FLOAT": Float, "FLOAT64": Float,
+    "NUMERIC": Numeric, "BIGNUMERIC": Numeric,
+}
+
+def build_db_class(table_class, fields, base):
+    """Creates a mapped class for a table from its schema fields, without reflecting it over the network.
+
+    Args:
+        table_class: Key of the table in `BQ_TABLE_MAP`.
+        fields: A list of (name, field_type, mode) tuples as reported by BigQuery.
+        base: The declarative base the class is registered on.
+    """
+    table_name, update_keys = get_table_name_keys(table_class)
+    columns = []
+    for name, field_type, mode in fields:
+        col_type = SA_TYPE_MAP.get(field_type, String)()
+        if mode == "REPEATED":
+            col_type = ARRAY(col_type)
+        columns.append(Column(name, col_type, primary_key=name in update_keys))
+    table = Table(table_name, base.metadata, *columns, schema=cfg.BQ_DATASET_ID)
+    return type(table_name, (base,), {"__table__": table})
+
 def format_dt(dt: datetime.datetime):
     return dt.strftime("%m-%d-%Y_%H:%M:%S")
 
@@ -75,46 +203,311 @@ def clean_string(source_string):
     clean_spaces = re.sub(' ', '_', source_string)
     return re.sub('[^a-zA-Z0-9 _\n\.]', '', clean_spaces.lower())
 
-def write_to_gcs(gcs_path, data):
-    if not gcs_path.startswith("gs://"):
-        raise Exception(f"Invalid Cloud Storage path {gcs_path}. Pass a valid path starting with gs://")
-
-    # check if data is a file or a string
-    UPLOAD_AS_FILE = False
-    if os.path.exists(data):
-        UPLOAD_AS_FILE = True
-
-    bucket = gcs_path.split("/")[2]
-    object = "/".join(gcs_path.split("/")[3:])
-    
-    # Initialize the Cloud Storage client
-    storage_client = storage.Client()
-    
-    # Get the bucket object
-    bucket = storage_client.bucket(bucket)
-    blob = bucket.blob(object)
-    if UPLOAD_AS_FILE:
-        blob.upload_from_filename(data)
-    else:
-        blob.upload_from_string(data)
-    return blob.self_link
+def generate_uuid(text: str, deterministic=False):
+    """
+    Generate a uuid based on text.
 
-def generate_uuid(text: str):
-    """Generate a uuid based on text"""
+    Args:
+        text: The text the uuid is derived from.
+        deterministic: Derive the suffix from the text instead of drawing it at random, so that the same
+            text always gets the same id, e.g. to retry logging a run without creating a new one.
+    """
     hex_string = hashlib.md5(text.encode('UTF-8')).hexdigest()
-    random_id = "".join(random.choices(string.ascii_lowercase + string.digits, k=8))
-    return str(uuid.UUID(hex=hex_string)) + "-" + random_id
+    if deterministic:
+        suffix = hashlib.sha256(text.encode('UTF-8')).hexdigest()[:8]
+    else:
+        suffix = "".join(random.choices(string.ascii_lowercase + string.digits, k=8))
+    return str(uuid.UUID(hex=hex_string)) + "-" + suffix
+
+def log_chunk_key(*parts):
+    """A key of the content of a chunk of run details, stable across retries of the same log."""
+    content = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+def dataset_fingerprint(dataset):
+    """Returns a sha256 hex digest of the content of a DataFrame."""
+    return hashlib.sha256(dataset.to_json(orient="split", date_format="iso").encode("utf-8")).hexdigest()
+
+def dataset_columns(metrics_table):
+    """
+    Returns the columns of an `EvalResult` metrics table that come from the evaluation dataset, leaving out
+    the prompts, responses and metrics (`<metric>/score`, `<metric>/explanation`, ...), which differ by run.
+    """
+    generated = {"prompt", "completed_prompt", "response", "dataset_row_id"}
+    return metrics_table[[col for col in metrics_table.columns if col not in generated and "/" not in str(col)]]
+
+def grid_run_id(task_id, experiment_id, fingerprint):
+    """A run id that only depends on the task, the experiment and the dataset, so that a grid run can be resumed."""
+    hex_string = hashlib.md5(f"{task_id}|{experiment_id}|{fingerprint}".encode("utf-8")).hexdigest()
+    return str(uuid.UUID(hex=hex_string)) + "-" + fingerprint[:8]
+
+def vertex_experiment_run_name(run_id):
+    """
+    Returns a new Vertex AI experiment run name for a run, e.g. for `EvalTask.evaluate(experiment_run_name=...)`.
+    Experiment runs can't be created twice under the same name, while deterministic run ids such as
+    `grid_run_id` are reused by retries, so the run id gets a unique suffix.
+    """
+    return f"{run_id}-{uuid.uuid4().hex[:8]}"
+
+def config_experiment_id(prompt_id, generation_config):
+    """Names the experiment of a prompt and generation config, e.g. `prompt-p1-temperature-0.2`."""
+    config = "-".join(f"{k}-{v}" for k, v in sorted(generation_config.items()))
+    return f"prompt-{prompt_id}-{config}" if config else f"prompt-{prompt_id}"
+
+def generate_responses(model, prompt_template, dataset, max_workers=GENERATION_WORKERS):
+    """
+    Assembles the prompts of a dataset from a template, as `EvalTask` does, and generates their responses
+    concurrently. Returns a copy of the dataset with `prompt` and `response` columns, ready to be evaluated
+    by an `EvalTask` without a model. The first failed model call is raised, rather than scoring an empty
+    response, so that the run isn't logged and `run_grid` retries it when resumed.
+
+    Args:
+        model: A `GenerativeModel`, or a function from prompt to response text.
+        prompt_template: A template with `{variable}` placeholders filled from the dataset columns.
+        dataset: The evaluation dataset, as a DataFrame.
+        max_workers: Number of concurrent model calls.
+    """
+    template = PromptTemplate(prompt_template)
+    dataset = dataset.copy()
+    variables = list(template.variables)
+    dataset["prompt"] = [str(template.assemble(**{k: str(v) for k, v in row.items()}))
+                         for row in dataset[variables].to_dict(orient="records")]
+
+    def generate(prompt):
+        if hasattr(model, "generate_content"):
+            return model.generate_content(prompt).text
+        return model(prompt)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dataset["response"] = list(executor.map(generate, dataset["prompt"]))
+    return dataset
+
+
+class TokenBucket():
+    """A thread-safe token bucket limiting calls to `rate` per second, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def wrap(self, model):
+        """Rate limits the `generate_content` calls of a model, or the calls of a model function."""
+        if hasattr(model, "generate_content"):
+            generate_content = model.generate_content
+            def limited_generate_content(*args, **kwargs):
+                self.acquire()
+                return generate_content(*args, **kwargs)
+            model.generate_content = limited_generate_content
+            return model
+        if callable(model):
+            def limited_model(*args, **kwargs):
+                self.acquire()
+                return model(*args, **kwargs)
+            return limited_model
+        return model
+
+
+class TTLCache():
+    """A thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Drops all entries, or only those whose key matches `predicate`."""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
 
 
 class Evals():
-    def __init__(self):
-        Base = get_db_classes()
-        self.Task = Base.classes.eval_tasks
-        self.Experiment = Base.classes.eval_experiments
-        self.Prompt = Base.classes.eval_prompts
-        self.EvalDataset = Base.classes.eval_datasets
-        self.EvalRunDetail = Base.classes.eval_run_details
-        self.EvalRun = Base.classes.eval_runs
+    def __init__(self, schema_cache_ttl=600, result_cache_ttl=300, result_cache_size=256, backend=None,
+                 async_writes=False, flush_interval=1.0):
+        """
+        Args:
+            schema_cache_ttl: Seconds for which a table schema fetched from BigQuery is reused.
+            result_cache_ttl: Seconds for which rows read for immutable entities
+                (tasks, experiments, prompts and completed runs) are reused.
+            result_cache_size: Maximum number of cached reads.
+            backend: Where tables and prompts are stored. A `StorageBackend`, or "bigquery" (default)
+                for the BigQuery dataset and staging bucket, or "local" for a `LocalBackend` in the
+                local cache directory, which works offline.
+            async_writes: Queue writes to a background thread instead of blocking on each upsert. Writes
+                to a table are coalesced into batched upserts. Call `flush()`, or use `Evals` as a context
+                manager, before reading back what was logged; write failures are raised by `flush()`.
+            flush_interval: Seconds queued writes may wait to be coalesced, with `async_writes`.
+        """
+        if backend is None or backend == "bigquery":
+            backend = BigQueryBackend(schema_cache_ttl=schema_cache_ttl)
+        elif backend == "local":
+            backend = LocalBackend()
+        if not isinstance(backend, StorageBackend):
+            raise ValueError(f"Invalid backend {backend!r}. Supported ['bigquery', 'local'] or a `StorageBackend`")
+        self.backend = backend
+        self._prompt_index = None
+        self._prompt_index_lock = threading.Lock()
+        self._overhead_stats = dict.fromkeys([
+            "prompts_uploaded", "prompts_deduplicated",
+            "result_cache_hits", "result_cache_misses",
+        ], 0)
+        self._result_cache = TTLCache(maxsize=result_cache_size, ttl=result_cache_ttl)
+        self._write_stats = WriteStats()
+        self._writer = None
+        # None until checked, then re-checked while missing so that a table created later is picked up
+        self._run_metrics_exists = None
+        # log chunks queued to the background writer, checkpointed once they are flushed
+        self._unflushed_log_chunks = []
+        self._log_progress_lock = threading.Lock()
+        if async_writes:
+            self._writer = BackgroundWriter(self.backend, self._write_stats, flush_interval=flush_interval,
+                                            on_write=self._invalidate_table_results)
+
+        # mapped classes (Task, Experiment, ...) are created lazily on first use, see `_db_class`
+        self._db_base = declarative_base()
+        self._db_classes = {}
+        self._db_class_lock = threading.Lock()
+
+    Task = property(lambda self: self._db_class("tasks"))
+    Experiment = property(lambda self: self._db_class("experiments"))
+    Prompt = property(lambda self: self._db_class("prompts"))
+    EvalDataset = property(lambda self: self._db_class("datasets"))
+    EvalRunDetail = property(lambda self: self._db_class("run_details"))
+    EvalRun = property(lambda self: self._db_class("runs"))
+
+    def _db_class(self, table_class):
+        """Returns the mapped class for a table, creating it on first use.
+
+        The schema comes from the backend, which for BigQuery reads it from the
+        local schema cache when available, so creating `Evals` and its classes
+        needs no metadata calls.
+        """
+        with self._db_class_lock:
+            if table_class not in self._db_classes:
+                table_name = BQ_TABLE_MAP.get(table_class).get("table_name")
+                fields = self.backend.get_schema_fields(table_name)
+                self._db_classes[table_class] = build_db_class(table_class, fields, self._db_base)
+            return self._db_classes[table_class]
+
+    def refresh_schema_cache(self):
+        """Re-reads all table schemas from the backend into the local schema cache.
+
+        Mapped classes already created on this instance are kept; new `Evals`
+        instances pick up the refreshed schemas.
+        """
+        self.invalidate_schema_cache()
+        for table_class in BQ_TABLE_MAP:
+            self._get_table(table_class)
+
+    @property
+    def bq_client(self):
+        """BigQuery client of the backend."""
+        return self.backend.bq_client
+
+    @property
+    def storage_client(self):
+        """Cloud Storage client of the backend."""
+        return self.backend.storage_client
+
+    def _get_table(self, table_class):
+        """Returns the table metadata of a table class, with its `schema`."""
+        return self.backend.get_table(BQ_TABLE_MAP.get(table_class).get("table_name"))
+
+    def invalidate_schema_cache(self, table_class=None):
+        """Drops cached table metadata for one table class, or for all tables if none is given."""
+        table_name = BQ_TABLE_MAP.get(table_class).get("table_name") if table_class else None
+        self.backend.invalidate_schema_cache(table_name)
+
+    def flush(self):
+        """Blocks until all queued writes are applied. Raises if any of them failed. A no-op without `async_writes`."""
+        if self._writer:
+            chunks = self._take_unflushed_log_chunks()
+            self._writer.flush()
+            self._checkpoint_log_chunks(chunks)
+
+    def close(self):
+        """Applies all queued writes and stops the background writer."""
+        if self._writer:
+            chunks = self._take_unflushed_log_chunks()
+            self._writer.close()
+            self._writer = None
+            self._checkpoint_log_chunks(chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _invalidate_table_results(self, table_name):
+        """Drops cached reads of the table class stored in `table_name`."""
+        self._result_cache.invalidate(lambda key: BQ_TABLE_MAP[key[0]]["table_name"] == table_name)
+
+    def get_overhead_stats(self):
+        """Returns counters of clients created and metadata and query round-trips avoided by reuse and
+        caching, along with the latency and failures of writes."""
+        stats = {**self.backend.stats, **self._overhead_stats, **self._write_stats.as_dict()}
+        if self._writer:
+            stats.update(self._writer.stats)
+        stats["metadata_round_trips_avoided"] = stats.get("schema_cache_hits", 0)
+        stats["query_round_trips_avoided"] = stats["result_cache_hits"]
+        return stats
+
+    def get_query_stats(self, by_method=True):
+        """
+        Returns the job statistics of the queries run so far (bytes processed and billed, slot milliseconds,
+        cache hits, wall time and full scans), aggregated per `Evals` method, or one row per query with
+        `by_method=False`. Empty for backends that don't report job statistics.
+        """
+        telemetry = self.backend.telemetry
+        if telemetry is None:
+            return pd.DataFrame()
+        return telemetry.summary() if by_method else telemetry.to_frame()
+
+    def estimate_query_bytes(self, sql, query_parameters=None):
+        """Returns the bytes BigQuery estimates a query would process, from a dry run."""
+        if not self.backend.supports_sql:
+            raise ValueError("Query estimates need the BigQuery backend.")
+        return self.backend.dry_run(sql, query_parameters)
 
     def log_task(self, task):
         try:
@@ -125,7 +518,7 @@ class Evals():
                 raise Exception(f"Invalid task object. Expected: `dict`. Actual: {type(task)}")
             self._upsert("tasks", task)
         except Exception as e:
-            print(f"Failed to log task due to following error.")
+            logger.error("Failed to log task.")
             raise e
         
     def log_prompt(self, prompt):
@@ -137,28 +530,38 @@ class Evals():
                 raise Exception(f"Invalid task object. Expected: `dict`. Actual: {type(prompt)}")
             self._upsert("prompts", prompt)
         except Exception as e:
-            print(f"Failed to log prompt due to following error.")
+            logger.error("Failed to log prompt.")
             raise e
         
     def _get_all(self, table_class, limit_offset=20, as_dict=False):
-        client = bigquery.Client(project=cfg.PROJECT_ID)
         table_name = BQ_TABLE_MAP.get(table_class).get("table_name")
-        table_id = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}.{table_name}"
-        table = client.get_table(table_id)
-        cols = [schema.name for schema in table.schema]
-            
-        sql = f"""
-            SELECT {", ".join(cols)}
-            FROM `{table_id}`
-            ORDER BY create_datetime DESC
-            LIMIT {limit_offset}
-        """
-        df = client.query_and_wait(sql).to_dataframe()
+        df = self.backend.select(table_name, limit=limit_offset)
         if as_dict:
             return df.to_dict(orient='records')
         else:
             return df
 
+    def read_rows(self, table_class, where_keys=None, columns=None, output="pandas", max_streams=READ_STREAMS):
+        """
+        Streams a table in chunks with bounded memory. With BigQuery, the table is read through the
+        BigQuery Storage Read API, yielding one chunk per Arrow record batch. Only the selected columns
+        are read, and filters are applied server-side. Chunks from different streams are yielded in
+        arrival order.
+
+        Args:
+            table_class: The table class (e.g., "run_details").
+            where_keys: Optional dictionary of column values to filter on.
+            columns: Optional list of columns to read. Defaults to all columns.
+            output: "pandas" to yield DataFrames or "arrow" to yield `pyarrow.RecordBatch`es.
+            max_streams: Maximum number of streams read concurrently.
+
+        Yields:
+            A DataFrame or RecordBatch for each batch of rows.
+        """
+        table_name = BQ_TABLE_MAP.get(table_class).get("table_name")
+        return self.backend.iter_rows(table_name, columns=columns, where_keys=where_keys,
+                                      output=output, max_streams=max_streams)
+
     def get_all_tasks(self, limit_offset=20, as_dict=False):
         return self._get_all("tasks", limit_offset, as_dict)
 
@@ -175,29 +578,36 @@ class Evals():
         return self._get_all("run_details", limit_offset, as_dict)
 
 
+    def _is_cacheable(self, table_class, where_keys):
+        """Reads of tasks, experiments, prompts and of a specific (completed) run don't change once logged."""
+        if table_class in ("tasks", "experiments", "prompts"):
+            return True
+        return table_class == "runs" and "run_id" in where_keys
+
     def _get_one(self, table_class, where_keys, limit_offset=1, as_dict=False):
-        client = bigquery.Client(project=cfg.PROJECT_ID)
-        table_name = BQ_TABLE_MAP.get(table_class).get("table_name")
-        table_id = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}.{table_name}"
-        table = client.get_table(table_id)
-        cols = [schema.name for schema in table.schema]
-        
-        if where_keys:
-            where_clause = "WHERE "
-            where_clause += "AND ".join([f"{k} = '{v}'"for k,v in where_keys.items()])
-        sql = f"""
-            SELECT {", ".join(cols)}
-            FROM `{table_id}`
-            {where_clause}
-            ORDER BY create_datetime DESC
-            LIMIT {limit_offset}
-        """
-        df = client.query_and_wait(sql).to_dataframe()
+        cache_key = (table_class, tuple(sorted(where_keys.items())), limit_offset)
+        cacheable = self._is_cacheable(table_class, where_keys)
+        df = self._result_cache.get(cache_key) if cacheable else None
+        if df is not None:
+            self._overhead_stats["result_cache_hits"] += 1
+        else:
+            if cacheable:
+                self._overhead_stats["result_cache_misses"] += 1
+            table_name = BQ_TABLE_MAP.get(table_class).get("table_name")
+            df = self.backend.select(table_name, where_keys=where_keys, limit=limit_offset)
+            if cacheable:
+                self._result_cache.put(cache_key, df)
+        # callers reshape the frame, don't hand out the cached object itself
+        df = df.copy()
         if as_dict:
             return df.to_dict(orient='records')
         else:
             return df
 
+    def clear_result_cache(self):
+        """Drops all cached reads."""
+        self._result_cache.invalidate()
+
     def get_experiment(self, experiment_id, task_id: str="", as_dict=False):
         where_keys = {}
         if experiment_id:
@@ -232,15 +642,12 @@ class Evals():
             # get experiment
             exp_df = self.get_experiment(experiment_id=experiment_id)
             exp_df = exp_df[["experiment_id", "experiment_desc", "prompt_id", "model_endpoint", "model_name", "generation_config"]]
-            model_config_df_exp = pd.json_normalize(exp_df['generation_config'])
-            exp_df = pd.concat([exp_df.drop('generation_config', axis=1), model_config_df_exp], axis=1)
+            exp_df = self._expand_generation_config(exp_df)
             # get metrics
             metrics_df = self._get_one("runs", where_keys, limit_offset=limit_offset, as_dict=False)
             metrics_df = metrics_df[['experiment_id', 'run_id',  'metrics', 'task_id', 'create_datetime', 'update_datetime', 'tags']]
             metrics_df = pd.merge(exp_df, metrics_df, on='experiment_id', how='left')
-            metrics_df['metrics'] = metrics_df['metrics'].apply(eval)
-            metrics_df_exp = pd.json_normalize(metrics_df['metrics'])
-            metrics_df = pd.concat([metrics_df.drop('metrics', axis=1), metrics_df_exp], axis=1)
+            metrics_df = self._expand_metrics(metrics_df)
             if as_dict:
                 return metrics_df.T.to_dict(orient='records')
             else:
@@ -248,17 +655,65 @@ class Evals():
         else:
             raise Exception(f"experiment_id is required.")
 
-    def compare_eval_runs(self, experiment_run_ids, as_dict=False):
+    def compare_eval_runs(self, experiment_run_ids, as_dict=False, confidence_intervals=False, baseline_run_id=None,
+                          n_resamples=N_RESAMPLES, confidence=0.95):
+        """
+        Compares runs side by side: their experiment, prompt and summary metrics.
+
+        Args:
+            experiment_run_ids: List of experiment run IDs.
+            as_dict: Return a list of dicts instead of a DataFrame.
+            confidence_intervals: Also report, for each metric, the bootstrap confidence interval of the
+                mean per-row score (`<metric>/ci_low`, `<metric>/ci_high`) and the p-value of its paired
+                difference to the baseline run (`<metric>/p_value`), see `get_run_statistics`.
+            baseline_run_id: The run the others are compared to. Defaults to the first run.
+            n_resamples: Number of bootstrap resamples.
+            confidence: Confidence level of the intervals.
+        """
         if not experiment_run_ids:
             raise Exception(f"experiment_run_ids are required to compare runs")
 
         if isinstance(experiment_run_ids, str):
             experiment_run_ids = [experiment_run_ids]
-        if isinstance(experiment_run_ids, list):
-            experiment_run_ids = ", ".join([f"'{run}'" for run in experiment_run_ids])
+        experiment_run_ids = list(experiment_run_ids)
+
+        if not self.backend.supports_sql:
+            df = self._compare_eval_runs_frame(experiment_run_ids)
+        else:
+            df = self._compare_eval_runs_query(experiment_run_ids)
+
+        # format metrics
+        df = self._expand_metrics(df)
+        df = self._expand_generation_config(df)
+
+        if confidence_intervals:
+            stats = self.get_run_statistics(experiment_run_ids, baseline_run_id=baseline_run_id or experiment_run_ids[0],
+                                            n_resamples=n_resamples, confidence=confidence)
+            if len(stats):
+                wide = stats.pivot_table(index="run_id", columns="metric", values=["ci_low", "ci_high", "p_value"])
+                wide.columns = [f"{metric}/{stat}" for stat, metric in wide.columns]
+                df = df.merge(wide[sorted(wide.columns)], left_on="run_id", right_index=True, how="left")
+
+        if as_dict:
+            return df.T.to_dict(orient='records')
+        else:
+            return df.T
 
+    def _compare_eval_runs_query(self, experiment_run_ids):
         table_prefix = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}"
-        client = bigquery.Client(project=cfg.PROJECT_ID)
+        if self._has_run_metrics():
+            # the JSON metrics are only needed for runs logged before run_metrics existed
+            metrics_column = "IF(logged.run_id IS NULL, runs.metrics, NULL) AS metrics"
+            logged_join = f"""
+        LEFT JOIN (
+            SELECT DISTINCT run_id
+            FROM `{table_prefix}.{BQ_TABLE_MAP.get('run_metrics').get('table_name')}`
+            WHERE run_id IN UNNEST(@run_ids)
+        ) logged
+        ON
+            runs.run_id = logged.run_id"""
+        else:
+            metrics_column, logged_join = "runs.metrics", ""
 
         sql = f"""
         SELECT
@@ -271,10 +726,10 @@ class Evals():
             exp.generation_config,
             prompt.prompt_template,
             prompt.system_instruction,
-            runs.metrics,
+            {metrics_column},
             runs.create_datetime
         FROM 
-            `{table_prefix}.{BQ_TABLE_MAP.get('runs').get('table_name')}` runs
+            `{table_prefix}.{BQ_TABLE_MAP.get('runs').get('table_name')}` runs{logged_join}
         JOIN 
             `{table_prefix}.{BQ_TABLE_MAP.get('experiments').get('table_name')}` exp
         ON 
@@ -283,72 +738,382 @@ class Evals():
             `{table_prefix}.{BQ_TABLE_MAP.get('prompts').get('table_name')}` prompt
         ON 
             exp.prompt_id = prompt.prompt_id
-        WHERE runs.run_id IN ({experiment_run_ids})
+        WHERE runs.run_id IN UNNEST(@run_ids)
         ORDER BY runs.create_datetime DESC
         """
-        
-        df = client.query_and_wait(sql).to_dataframe()
+        return self.backend.query(sql, [bigquery.ArrayQueryParameter("run_ids", "STRING", experiment_run_ids)])
+
+    def _compare_eval_runs_frame(self, experiment_run_ids):
+        """Joins runs to their experiment and prompt in pandas, for backends that don't run SQL."""
+        runs = self.backend.select(BQ_TABLE_MAP["runs"]["table_name"],
+                                   columns=["task_id", "run_id", "experiment_id", "metrics", "create_datetime"],
+                                   in_filters={"run_id": experiment_run_ids})
+        exps = self.backend.select(BQ_TABLE_MAP["experiments"]["table_name"],
+                                   columns=["experiment_id", "experiment_desc", "model_endpoint", "model_name",
+                                            "generation_config", "prompt_id"],
+                                   in_filters={"experiment_id": runs["experiment_id"].dropna().unique().tolist()})
+        prompts = self.backend.select(BQ_TABLE_MAP["prompts"]["table_name"],
+                                      columns=["prompt_id", "prompt_template", "system_instruction"],
+                                      in_filters={"prompt_id": exps["prompt_id"].dropna().unique().tolist()})
+        df = runs.merge(exps, on="experiment_id").merge(prompts, on="prompt_id", how="left")
+        return df[["task_id", "run_id", "experiment_id", "experiment_desc", "model_endpoint", "model_name",
+                   "generation_config", "prompt_template", "system_instruction", "metrics", "create_datetime"]]
+
+    def get_run_statistics(self, experiment_run_ids, baseline_run_id=None, n_resamples=N_RESAMPLES, confidence=0.95, seed=0):
+        """
+        Computes bootstrap confidence intervals of the per-row metrics of runs, and the paired difference
+        of each run to a baseline run with its significance. Only the run ids, row ids and metrics of
+        `run_details` are read, and all runs are resampled together on the same dataset rows.
 
-        # format metrics
-        df['metrics'] = df['metrics'].apply(eval)
-        df['generation_config'] = df['generation_config'].apply(eval)
+        Args:
+            experiment_run_ids: List of experiment run IDs.
+            baseline_run_id: The run the others are compared to. Defaults to the best run of each metric.
+            n_resamples: Number of bootstrap resamples.
+            confidence: Confidence level of the intervals.
+            seed: Seed of the resampling, for reproducible intervals.
 
-        # print(f'df:  {df.columns}')
-        # print(f"generation_config:  {df['generation_config']}")
-        df_metrics_exp = pd.json_normalize(df['metrics'])
-        df_config_exp = pd.json_normalize(df['generation_config'])
+        Returns:
+            A DataFrame with one row per metric and run, see `run_statistics`.
+        """
+        details = self.backend.select(BQ_TABLE_MAP["run_details"]["table_name"],
+                                      columns=["run_id", "dataset_row_id", "metrics"],
+                                      in_filters={"run_id": list(experiment_run_ids)})
+        return run_statistics(details, baseline_run_id=baseline_run_id, n_resamples=n_resamples,
+                              confidence=confidence, seed=seed)
 
-        df = pd.concat([df.drop(['metrics', 'generation_config'], axis=1), df_metrics_exp, df_config_exp], axis=1)
-        
-        # print(f'df_config_exp:  {df_config_exp.columns}')
-        # print(f'df_metrics_exp:  {df_metrics_exp.columns}')
-        # print(f'df:  {df.columns}')
+    def get_run_metrics(self, experiment_run_ids):
+        """
+        Reads the summary metrics of runs from the long-format `run_metrics` table.
 
+        Args:
+            experiment_run_ids: List of experiment run IDs.
 
-        if as_dict:
-            return df.T.to_dict(orient='records')
+        Returns:
+            A DataFrame indexed by run_id with one numeric column per metric.
+        """
+        run_ids = list(experiment_run_ids)
+        if not run_ids or not self._has_run_metrics():
+            return pd.DataFrame(index=pd.Index([], name="run_id"))
+        df = self.backend.select(BQ_TABLE_MAP["run_metrics"]["table_name"],
+                                 columns=["run_id", "metric_name", "metric_value"],
+                                 in_filters={"run_id": run_ids})
+        wide = df.pivot_table(index="run_id", columns="metric_name", values="metric_value", aggfunc="last")
+        wide.columns.name = None
+        return wide
+
+    def _has_run_metrics(self):
+        """Whether the `run_metrics` table exists. Datasets created before it fall back to the JSON metrics of runs."""
+        if not self._run_metrics_exists:
+            exists = self.backend.has_table(BQ_TABLE_MAP["run_metrics"]["table_name"])
+            if not exists and self._run_metrics_exists is None:
+                logger.warning(RUN_METRICS_MISSING.format(table=BQ_TABLE_MAP["run_metrics"]["table_name"]))
+            self._run_metrics_exists = exists
+        return self._run_metrics_exists
+
+    def _require_run_metrics(self):
+        if not self._has_run_metrics():
+            raise Exception(RUN_METRICS_MISSING.format(table=BQ_TABLE_MAP["run_metrics"]["table_name"]))
+
+    def _expand_metrics(self, df):
+        """
+        Replaces the JSON `metrics` column of a frame of runs with one numeric column per metric.
+        Runs logged before `run_metrics` existed fall back to parsing their JSON metrics.
+        """
+        run_ids = df["run_id"].dropna().unique().tolist()
+        wide = self.get_run_metrics(run_ids)
+        legacy = df[df["run_id"].notna() & ~df["run_id"].isin(wide.index)].drop_duplicates("run_id")
+        if len(legacy):
+            legacy_wide = pd.DataFrame.from_records(
+                [parse_json(metrics) for metrics in legacy["metrics"]],
+                index=pd.Index(legacy["run_id"], name="run_id"))
+            wide = pd.concat([wide, legacy_wide])
+        return df.drop(columns="metrics").merge(wide, left_on="run_id", right_index=True, how="left")
+
+    def _expand_generation_config(self, df):
+        """Replaces the JSON `generation_config` column with one column per generation parameter."""
+        config_df = pd.DataFrame.from_records(
+            [parse_json(config) for config in df["generation_config"]], index=df.index)
+        return pd.concat([df.drop(columns="generation_config"), config_df], axis=1)
+
+    def backfill_run_metrics(self, experiment_run_ids=None):
+        """
+        Populates `run_metrics` from the JSON metrics of runs logged before the table existed.
+
+        Args:
+            experiment_run_ids: Optional list of run IDs to backfill. Defaults to all runs without metric rows.
+
+        Returns:
+            The number of metric rows written.
+        """
+        self._require_run_metrics()
+        if not self.backend.supports_sql:
+            in_filters = {"run_id": list(experiment_run_ids)} if experiment_run_ids else None
+            runs = self.backend.select(BQ_TABLE_MAP["runs"]["table_name"],
+                                       columns=["run_id", "experiment_id", "task_id", "metrics"], in_filters=in_filters)
+            logged = self.backend.select(BQ_TABLE_MAP["run_metrics"]["table_name"], columns=["run_id"], in_filters=in_filters)
+            runs = runs[~runs["run_id"].isin(logged["run_id"])]
         else:
-            return df.T
+            runs = self._backfill_run_metrics_query(experiment_run_ids)
+        rows = [
+            row
+            for run in runs.itertuples(index=False)
+            for row in metrics_to_rows(run.run_id, run.experiment_id, run.task_id, parse_json(run.metrics))
+        ]
+        if rows:
+            self._upsert("run_metrics", rows)
+        logger.info("Backfilled %d metrics for %d runs.", len(rows), len(runs))
+        return len(rows)
+
+    def _backfill_run_metrics_query(self, experiment_run_ids):
+        """Reads the runs without metric rows, joined in BigQuery so logged runs aren't downloaded."""
+        table_prefix = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}"
+        query_parameters = []
+        run_filter = ""
+        if experiment_run_ids:
+            run_filter = "AND runs.run_id IN UNNEST(@run_ids)"
+            query_parameters.append(bigquery.ArrayQueryParameter("run_ids", "STRING", list(experiment_run_ids)))
+        sql = f"""
+            SELECT runs.run_id, runs.experiment_id, runs.task_id, runs.metrics
+            FROM `{table_prefix}.{BQ_TABLE_MAP.get('runs').get('table_name')}` runs
+            LEFT JOIN (
+                SELECT DISTINCT run_id FROM `{table_prefix}.{BQ_TABLE_MAP.get('run_metrics').get('table_name')}`
+            ) logged
+            ON runs.run_id = logged.run_id
+            WHERE logged.run_id IS NULL {run_filter}
+        """
+        return self.backend.query(sql, query_parameters)
 
-    def grid_search(self, task_id, experiment_run_ids, opt_metrics, opt_params):
+    def _grid_source_sql(self, opt_params):
+        """
+        Returns the FROM clause joining run metrics to their experiment and prompt, and the SQL
+        expression of each parameter. Parameters that are not experiment or prompt columns are
+        read from the experiment's generation config.
+        """
+        table_prefix = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}"
+        exp_cols = {field.name for field in self._get_table("experiments").schema}
+        prompt_cols = {field.name for field in self._get_table("prompts").schema}
+        param_exprs = {}
+        for param in opt_params:
+            if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", param):
+                raise ValueError(f"Invalid parameter name '{param}'.")
+            if param in exp_cols:
+                param_exprs[param] = f"TO_JSON_STRING(exp.{param})"
+            elif param in prompt_cols:
+                param_exprs[param] = f"TO_JSON_STRING(prompt.{param})"
+            else:
+                param_exprs[param] = f"JSON_QUERY(exp.generation_config, '$.{param}')"
+        source_sql = f"""
+            `{table_prefix}.{BQ_TABLE_MAP.get('run_metrics').get('table_name')}` m
+            JOIN `{table_prefix}.{BQ_TABLE_MAP.get('experiments').get('table_name')}` exp
+                ON m.task_id = exp.task_id AND m.experiment_id = exp.experiment_id
+            LEFT JOIN `{table_prefix}.{BQ_TABLE_MAP.get('prompts').get('table_name')}` prompt
+                ON exp.prompt_id = prompt.prompt_id
+        """
+        return source_sql, param_exprs
+
+    def _grid_filter(self, task_id, experiment_run_ids):
+        """Returns the WHERE clause and query parameters restricting grid search to a task and, optionally, runs."""
+        where_clause = "WHERE m.task_id = @task_id"
+        query_parameters = [bigquery.ScalarQueryParameter("task_id", "STRING", task_id)]
+        if experiment_run_ids:
+            where_clause += " AND m.run_id IN UNNEST(@run_ids)"
+            query_parameters.append(bigquery.ArrayQueryParameter("run_ids", "STRING", list(experiment_run_ids)))
+        partition_filter = self.backend.partition_filter(BQ_TABLE_MAP["run_metrics"]["table_name"], alias="m",
+                                                         run_ids=experiment_run_ids)
+        if partition_filter:
+            where_clause += f" AND {partition_filter}"
+        return where_clause, query_parameters
+
+    def grid_search(self, task_id, experiment_run_ids, opt_metrics, opt_params, confidence_intervals=False,
+                    n_resamples=N_RESAMPLES, confidence=0.95):
         """
         Performs grid search on the evaluation results and returns the best parameter combinations for each metric.
+        The best run per metric is selected in BigQuery from the `run_metrics` table, so only one row per metric is
+        downloaded (backends that don't run SQL select it in pandas). Runs logged before `run_metrics` existed are included once `backfill_run_metrics()` has been run.
 
         Args:
             task_id: The specific task ID to filter the results.
-            experiment_run_ids: List of experiment run IDs to include in the grid search.
+            experiment_run_ids: List of experiment run IDs to include in the grid search. If empty, all runs of the task are included.
             opt_metrics: List of metrics to optimize (e.g., ["ROUGE_1", "BLEU"]).
             opt_params: List of parameters to consider in the grid search (e.g., ["prompt_template", "temperature"]).
+            confidence_intervals: Also report the bootstrap confidence interval of the best run's mean per-row
+                score (`metric_ci`), and the runs whose paired difference to it isn't significant at the
+                `confidence` level (`tied_run_ids`), i.e. configurations that may be just as good.
+            n_resamples: Number of bootstrap resamples.
+            confidence: Confidence level of the intervals and of the significance tests.
 
         Returns:
             A dictionary where keys are the optimization metrics and values are the corresponding best parameter combinations.
         """
+        self._require_run_metrics()
+        metric_names = {metric.lower() + "/mean": metric for metric in opt_metrics}
+        if not self.backend.supports_sql:
+            frame = self._grid_frame(task_id, experiment_run_ids, opt_params)
+            means = frame[frame["metric_name"].isin(list(metric_names))]
+            stds = frame[frame["metric_name"].str.endswith("/std")]
+            stds = stds.assign(metric_name=stds["metric_name"].str.replace(r"/std$", "/mean", regex=True))
+            df = (means.sort_values("metric_value", ascending=False, kind="stable")
+                  .drop_duplicates("metric_name")
+                  .merge(stds[["run_id", "experiment_id", "metric_name", "metric_value"]]
+                         .rename(columns={"metric_value": "metric_std"}),
+                         on=["run_id", "experiment_id", "metric_name"], how="left"))
+        else:
+            df = self._grid_search_query(task_id, experiment_run_ids, metric_names, opt_params)
 
-        # Get 
-        grid_df = (self.compare_eval_runs(experiment_run_ids)).T
-
-        # Filter the grid_df based on the task_id
-        filtered_df = grid_df[grid_df['task_id'] == task_id]
-
-        # Initialize a dictionary to store the best parameter combinations for each metric
         best_params = {}
+        for row in df.to_dict(orient="records"):
+            best_params[metric_names[row["metric_name"]]] = {
+                "params": {param: _parse_param(row[f"param_{param}"]) for param in opt_params},
+                "metric_mean": row["metric_value"],
+                "metric_std": row["metric_std"],
+            }
+            if confidence_intervals:
+                best_params[metric_names[row["metric_name"]]]["run_id"] = row["run_id"]
+        if confidence_intervals and best_params:
+            self._add_grid_confidence(task_id, experiment_run_ids, best_params, n_resamples, confidence)
+        missing = [metric for metric in opt_metrics if metric not in best_params]
+        if missing:
+            logger.info("No results found for metrics %s.", missing)
+        return best_params
+
+    def _add_grid_confidence(self, task_id, experiment_run_ids, best_params, n_resamples, confidence):
+        """Adds the confidence interval of each best run and the runs tied with it to the grid search results."""
+        run_ids = list(experiment_run_ids or [])
+        if not run_ids:
+            runs = self.backend.select(BQ_TABLE_MAP["runs"]["table_name"], columns=["run_id"], where_keys={"task_id": task_id})
+            run_ids = runs["run_id"].dropna().unique().tolist()
+        details = self.backend.select(BQ_TABLE_MAP["run_details"]["table_name"],
+                                      columns=["run_id", "dataset_row_id", "metrics"], in_filters={"run_id": run_ids})
+        stats_by_baseline = {}
+        for metric, best in best_params.items():
+            if best["run_id"] not in stats_by_baseline:
+                stats_by_baseline[best["run_id"]] = run_statistics(
+                    details, baseline_run_id=best["run_id"], n_resamples=n_resamples, confidence=confidence)
+            stats = stats_by_baseline[best["run_id"]]
+            stats = stats[stats["metric"] == metric.lower()]
+            best_stats = stats[stats["run_id"] == best["run_id"]]
+            if best_stats.empty:
+                best["metric_ci"], best["tied_run_ids"] = None, []
+                continue
+            best["metric_ci"] = (float(best_stats["ci_low"].iloc[0]), float(best_stats["ci_high"].iloc[0]))
+            tied = stats[(stats["run_id"] != best["run_id"]) & (stats["p_value"] >= 1 - confidence)]
+            best["tied_run_ids"] = tied["run_id"].tolist()
+
+    def _grid_search_query(self, task_id, experiment_run_ids, metric_names, opt_params):
+        """Selects the best run per metric in BigQuery, with its parameters and the matching std."""
+        source_sql, param_exprs = self._grid_source_sql(opt_params)
+        where_clause, query_parameters = self._grid_filter(task_id, experiment_run_ids)
+        query_parameters.append(bigquery.ArrayQueryParameter("metric_names", "STRING", list(metric_names)))
+
+        param_select = "".join(f",\n                {expr} AS `param_{param}`" for param, expr in param_exprs.items())
+        sql = f"""
+            WITH metrics AS (
+                SELECT m.*{param_select}
+                FROM {source_sql}
+                {where_clause}
+            )
+            SELECT
+                mean.*,
+                std.metric_value AS metric_std
+            FROM metrics mean
+            LEFT JOIN metrics std
+                ON std.run_id = mean.run_id
+                AND std.experiment_id = mean.experiment_id
+                AND std.metric_name = REGEXP_REPLACE(mean.metric_name, r'/mean$', '/std')
+            WHERE mean.metric_name IN UNNEST(@metric_names)
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY mean.metric_name ORDER BY mean.metric_value DESC) = 1
+        """
+        return self.backend.query(sql, query_parameters)
 
-        for metric in opt_metrics:
-            # Convert metric name to the corresponding column name in grid_df
-            metric_mean_col = metric.lower().replace("_", "_") + "/mean" 
-            metric_std_col = metric.lower().replace("_", "_") + "/std"
+    def _grid_frame(self, task_id, experiment_run_ids, opt_params):
+        """
+        Joins the run metrics of a task to the parameters of their experiment in pandas, for backends that
+        don't run SQL. Parameters are JSON encoded in `param_<name>` columns, as the BigQuery queries return them.
+        """
+        in_filters = {"run_id": list(experiment_run_ids)} if experiment_run_ids else None
+        frame = self.backend.select(BQ_TABLE_MAP["run_metrics"]["table_name"],
+                                    columns=["run_id", "experiment_id", "task_id", "metric_name", "metric_value"],
+                                    where_keys={"task_id": task_id}, in_filters=in_filters)
+        exps = self.backend.select(BQ_TABLE_MAP["experiments"]["table_name"],
+                                   where_keys={"task_id": task_id}).drop_duplicates("experiment_id")
+        prompts = self.backend.select(BQ_TABLE_MAP["prompts"]["table_name"],
+                                      in_filters={"prompt_id": exps["prompt_id"].dropna().unique().tolist()})
+        prompts = prompts.drop_duplicates("prompt_id").set_index("prompt_id")
+        params = pd.DataFrame({"experiment_id": exps["experiment_id"]})
+        for param in opt_params:
+            if param in exps.columns:
+                values = exps[param]
+            elif param in prompts.columns:
+                values = exps["prompt_id"].map(prompts[param])
+            else:
+                values = exps["generation_config"].map(lambda config: parse_json(config).get(param))
+            params[f"param_{param}"] = [_to_json(value) for value in values]
+        return frame.merge(params, on="experiment_id")
 
-            # Find the row with the highest value for the given metric
-            best_row = filtered_df.loc[filtered_df[metric_mean_col].idxmax()]
+    def pareto_front(self, task_id, experiment_run_ids, objectives, opt_params):
+        """
+        Returns the runs whose metrics are Pareto optimal across several objectives, e.g. quality against latency.
+        A run is Pareto optimal if no other run is at least as good on every objective and better on one.
 
-            # Extract the values of the optimization parameters and the std from the best row
-            best_params[metric] = {
-                "params": {param: best_row[param] for param in opt_params},
-                "metric_mean": best_row[metric_mean_col],
-                "metric_std": best_row[metric_std_col]
-            }
+        Args:
+            task_id: The specific task ID to filter the results.
+            experiment_run_ids: List of experiment run IDs to consider. If empty, all runs of the task are considered.
+            objectives: Dictionary of metric names in `run_metrics` (e.g., "rouge_1/mean") to "max" or "min".
+            opt_params: List of parameters to report for each run (e.g., ["prompt_template", "temperature"]).
 
-        return best_params  
+        Returns:
+            A DataFrame with one row per Pareto-optimal run, its parameters and its objective values,
+            sorted by the first objective.
+        """
+        if not objectives:
+            raise ValueError("At least one objective is required.")
+        for metric_name, direction in objectives.items():
+            if direction not in ("max", "min"):
+                raise ValueError(f"Invalid direction '{direction}' for '{metric_name}'. Supported ['max', 'min']")
+
+        self._require_run_metrics()
+        objective_cols = [f"objective_{i}" for i in range(len(objectives))]
+        if not self.backend.supports_sql:
+            frame = self._grid_frame(task_id, experiment_run_ids, opt_params)
+            frame = frame[frame["metric_name"].isin(list(objectives))]
+            wide = frame.pivot_table(index=["run_id", "experiment_id"], columns="metric_name",
+                                     values="metric_value", aggfunc="max")
+            wide = wide.reindex(columns=list(objectives))
+            wide.columns = objective_cols
+            params = frame.groupby(["run_id", "experiment_id"])[[f"param_{param}" for param in opt_params]].first()
+            df = wide.join(params).reset_index()
+        else:
+            df = self._pareto_front_query(task_id, experiment_run_ids, objectives, opt_params)
+
+        df = df.dropna(subset=objective_cols).reset_index(drop=True)
+        # orient every objective so that larger is better
+        signs = np.array([1.0 if direction == "max" else -1.0 for direction in objectives.values()])
+        mask = pareto_front_mask(df[objective_cols].to_numpy(dtype=float) * signs)
+        front = df[mask].rename(columns=dict(zip(objective_cols, objectives)))
+        front = front.rename(columns={f"param_{param}": param for param in opt_params})
+        for param in opt_params:
+            front[param] = front[param].map(_parse_param)
+        first_metric, first_direction = next(iter(objectives.items()))
+        return front.sort_values(first_metric, ascending=first_direction == "min").reset_index(drop=True)
+
+    def _pareto_front_query(self, task_id, experiment_run_ids, objectives, opt_params):
+        """Pivots the objectives into columns in BigQuery, one row per run with its parameters."""
+        source_sql, param_exprs = self._grid_source_sql(opt_params)
+        where_clause, query_parameters = self._grid_filter(task_id, experiment_run_ids)
+        objective_select = ""
+        for i, metric_name in enumerate(objectives):
+            objective_select += f",\n                MAX(IF(m.metric_name = @objective_{i}, m.metric_value, NULL)) AS objective_{i}"
+            query_parameters.append(bigquery.ScalarQueryParameter(f"objective_{i}", "STRING", metric_name))
+        param_select = "".join(f",\n                ANY_VALUE({expr}) AS `param_{param}`" for param, expr in param_exprs.items())
+        sql = f"""
+            SELECT
+                m.run_id,
+                m.experiment_id{param_select}{objective_select}
+            FROM {source_sql}
+            {where_clause}
+            GROUP BY m.run_id, m.experiment_id
+        """
+        return self.backend.query(sql, query_parameters)
 
     def get_eval_run_detail(self, experiment_run_id, task_id: str="", limit_offset=100, as_dict=False):
         where_keys = {}
@@ -367,8 +1132,25 @@ class Evals():
             return details_df
 
 
+    def iter_eval_run_detail(self, experiment_run_id, task_id: str="", columns=None, output="pandas"):
+        """
+        Streams all details of a run without a row limit. See `read_rows`.
+
+        Args:
+            experiment_run_id: The experiment run ID.
+            task_id: Optional task ID.
+            columns: Optional list of columns to read (e.g., ["dataset_row_id", "output_text", "metrics"]).
+            output: "pandas" to yield DataFrames or "arrow" to yield `pyarrow.RecordBatch`es.
+        """
+        if not experiment_run_id:
+            raise Exception(f"experiment_run_id is required is to get run detail.")
+        where_keys = {"run_id": experiment_run_id}
+        if task_id:
+            where_keys["task_id"] = task_id
+        return self.read_rows("run_details", where_keys, columns=columns, output=output)
+
     def _upsert(self, table_class, rows, debug=False):
-        """Inserts or updates rows in the specified BigQuery table.
+        """Inserts or updates rows in the specified table of the storage backend.
 
         Args:
             table_name: The name of the table.
@@ -381,69 +1163,20 @@ class Evals():
         if isinstance(rows, dict):
             rows = [rows]
 
+        # cached reads of this table may be stale once the rows are written
+        self._result_cache.invalidate(lambda key: key[0] == table_class)
+
         # Validate that update keys are present in all rows
-        all_keys = set().union(*(d.keys() for d in rows))
         for row in rows:
             for key in update_keys:
                 if key not in row:
                     raise ValueError(f"Update key '{key}' not found in row: {row}")
 
-        # Get BigQuery table schema
-        table_id = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}.{table_name}"
-        client = bigquery.Client(project=cfg.PROJECT_ID)
-        table = client.get_table(table_id)
-        schema = {schema.name:schema.field_type for schema in table.schema}
-
-        # Construct the MERGE query dynamically
-        merge_query = f"""
-            MERGE INTO `{table_id}` AS target
-            USING (
-                SELECT * FROM UNNEST(@rows)
-            ) AS source
-            ON {" AND ".join(f"target.{key} = source.{key}" for key in update_keys)}
-        """
-
-        if update_keys:
-            merge_query += f"""     WHEN MATCHED THEN
-                UPDATE SET {", ".join(f"target.{key} = source.{key}" for key in all_keys if key not in update_keys + ['create_datetime'])}
-        """
-
-        merge_query += f"""     WHEN NOT MATCHED THEN
-                INSERT({", ".join([key for key in all_keys])})
-                VALUES({", ".join(f"source.{key}" for key in all_keys)})
-        """
-
-        # Convert rows to BigQuery format 
-        rows_for_query = []
-        for row in rows:
-            row_for_query = []
-            for key, val in row.items():
-                field_type = schema.get(key)
-                if field_type == "BOOLEAN":
-                    field_type = "BOOL"
-                if (val is not None):
-                    if isinstance(val, datetime.datetime):
-                        val = val.isoformat()
-                    if isinstance(val, list):
-                        row_for_query.append(bigquery.ArrayQueryParameter(key, field_type, val))
-                    else:
-                        row_for_query.append(bigquery.ScalarQueryParameter(key, field_type, val))
-            rows_for_query.append(bigquery.StructQueryParameter("x", *row_for_query))  
-
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", rows_for_query)]
-        )
-
-        # -- DEBUGGING --
-        print("MERGE Query:")
-        print(merge_query)
-        print("\nRows:")
-        print(rows_for_query)
-        # -- END DEBUGGING --
+        if self._writer:
+            self._writer.submit(table_name, update_keys, rows)
+        else:
+            timed_upsert(self.backend, table_name, update_keys, rows, self._write_stats)
 
-        query_job = client.query(merge_query, job_config=job_config)
-        query_job.result()  # Wait for the MERGE to complete
-    
     def log_experiment(self,
                        task_id,
                        experiment_id,
@@ -453,14 +1186,15 @@ class Evals():
                        experiment_desc="",
                        is_streaming=False,
                        tags=[],
-                       metadata={}):
+                       metadata={},
+                       elapsed_time=0):
         # create experiment object
         experiment = self.Experiment(
             experiment_id=experiment_id,
             experiment_desc=experiment_desc,
             task_id=task_id,
             prompt_id = prompt.prompt_id,
-            elapsed_time = 0
+            elapsed_time = round(elapsed_time, TIME_DECIMALS)
         )
 
         # add model information
@@ -506,7 +1240,7 @@ class Evals():
                 raise Exception(f"Invalid task object. Expected: `dict`. Actual: {type(experiment)}")
             self._upsert("experiments", experiment)
         except Exception as e:
-            print(f"Failed to log experiment due to following error.")
+            logger.error("Failed to log experiment.")
             raise e
 
         return experiment
@@ -515,10 +1249,9 @@ class Evals():
         # Construct the full file path in the bucket
         fmt_prompt_id = clean_string(prompt_id)
         prefix = f'{task_id}/prompts/{experiment_id}'
-        gcs_file_path = f'gs://{STAGING_BUCKET}/{prefix}/template_{fmt_prompt_id}.txt'
-        # write to GCS
-        write_to_gcs(gcs_file_path, prompt_template)
-        print(f"Prompt template saved to {gcs_file_path} successfully!")
+        # write to the staging bucket (or the local object store)
+        uri = self.backend.write_object(f'{prefix}/template_{fmt_prompt_id}.txt', prompt_template)
+        print(f"Prompt template saved to {uri} successfully!")
         
     def save_prompt(self, text, run_path, blob_name):
         """
@@ -531,9 +1264,91 @@ class Evals():
             The URI of the created blob.
         """
         # Construct the full file path in the bucket
-        gcs_file_path = f'gs://{STAGING_BUCKET}/{run_path}/{blob_name}.txt'
-        blob_link = write_to_gcs(gcs_file_path, text)
-        return blob_link
+        return self.backend.write_object(f'{run_path}/{blob_name}.txt', text)
+
+    def save_prompts(self, prompts, run_path, prompt_storage="per_row", max_workers=GCS_UPLOAD_WORKERS,
+                     packed_name="prompts.jsonl"):
+        """
+        Saves the completed prompts of an eval run to the object store of the backend (the staging bucket) and returns their URIs.
+        Args:
+            prompts: A list of (dataset_row_id, text) tuples.
+            run_path: The path in the staging bucket to save the prompts under.
+            prompt_storage: `per_row` uploads one object per prompt concurrently.
+                `packed` writes all prompts of the run into a single `prompts.jsonl`
+                object, and each URI points at the byte range of its line.
+                `content_addressed` stores each distinct prompt once under its
+                SHA-256, so identical prompts across runs share one object.
+            max_workers: Maximum number of concurrent uploads for `per_row`.
+            packed_name: Name of the object written under `run_path` for `packed`.
+        Returns:
+            A list of URIs in the same order as `prompts`.
+        """
+        if prompt_storage == "per_row":
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(lambda prompt: self.save_prompt(prompt[1], run_path, prompt[0]), prompts))
+
+        if prompt_storage == "packed":
+            lines, ranges, offset = [], [], 0
+            for dataset_row_id, text in prompts:
+                line = (json.dumps({"dataset_row_id": dataset_row_id, "prompt": text}) + "\n").encode("utf-8")
+                lines.append(line)
+                ranges.append((offset, offset + len(line) - 1))
+                offset += len(line)
+            blob_link = self.backend.write_object(f'{run_path}/{packed_name}', b"".join(lines))
+            return [f"{blob_link}#bytes={start}-{end}" for start, end in ranges]
+
+        if prompt_storage == "content_addressed":
+            return self._save_prompts_by_hash([text for _, text in prompts], max_workers)
+
+        raise ValueError(f"Invalid prompt_storage '{prompt_storage}'. Supported ['per_row', 'packed', 'content_addressed']")
+
+    def _prompt_index_path(self):
+        return os.path.join(LOCAL_CACHE_DIR, f"prompt_index_{self.backend.object_store_id}.txt")
+
+    def _known_prompt_hashes(self):
+        """Hashes of prompts known to exist in the staging bucket, loaded from the local index on first use."""
+        if self._prompt_index is None:
+            self._prompt_index = set()
+            if os.path.exists(self._prompt_index_path()):
+                with open(self._prompt_index_path()) as f:
+                    self._prompt_index.update(line.strip() for line in f if line.strip())
+        return self._prompt_index
+
+    def _save_prompts_by_hash(self, texts, max_workers=GCS_UPLOAD_WORKERS):
+        """Uploads each distinct prompt once, keyed by its SHA-256, and returns a URI per text."""
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        object_names = {h: f"{CAS_PROMPTS_PREFIX}/{h[:2]}/{h}.txt" for h in hashes}
+
+        known = self._known_prompt_hashes()
+        missing = {h: text for h, text in zip(hashes, texts) if h not in known}
+        self._overhead_stats["prompts_deduplicated"] += len(hashes) - len(missing)
+
+        def upload(item):
+            h, text = item
+            return self.backend.create_object(object_names[h], text)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                uploaded = list(executor.map(upload, missing.items()))
+            self._overhead_stats["prompts_uploaded"] += sum(uploaded)
+            self._overhead_stats["prompts_deduplicated"] += len(uploaded) - sum(uploaded)
+
+            with self._prompt_index_lock:
+                known.update(missing)
+                os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+                with open(self._prompt_index_path(), "a") as f:
+                    f.writelines(f"{h}\n" for h in missing)
+
+        return [self.backend.object_uri(object_names[h]) for h in hashes]
+
+    def read_prompt(self, input_prompt_gcs_uri):
+        """
+        Reads back a prompt saved by `log_eval_run`, given its `input_prompt_gcs_uri`.
+        """
+        data = self.backend.read_object(input_prompt_gcs_uri)
+        if split_byte_range(input_prompt_gcs_uri)[1] is None:
+            return data.decode("utf-8")
+        return json.loads(data)["prompt"]
 
     def log_eval_run(self,
                      experiment_run_id: str,
@@ -541,7 +1356,28 @@ class Evals():
                      eval_result,
                      run_path,
                      tags=[],
-                     metadata={}):
+                     metadata={},
+                     prompt_storage="per_row",
+                     telemetry=None,
+                     chunk_rows=LOG_CHUNK_ROWS):
+        """
+        Logs the details, summary metrics and long-format metrics of an eval run.
+
+        Args:
+            experiment_run_id: The run id. Evaluating the same run again, e.g. to resume it, needs a new
+                experiment run name for the `EvalTask`, see `vertex_experiment_run_name`.
+            experiment: The experiment returned by `log_experiment`.
+            eval_result: The `EvalResult` of the run.
+            run_path: Path under which the completed prompts are saved.
+            tags: Tags of the run.
+            metadata: Metadata of the run.
+            prompt_storage: How completed prompts are saved, see `save_prompts`.
+            telemetry: Optional `ModelTelemetry` of the model evaluated. Its latencies, times to first
+                token and token counts are logged with each row, and their mean and p50/p95/p99 are
+                added to the summary metrics (e.g. `latency/p95`).
+            chunk_rows: Rows of run details uploaded and merged together, see `LOG_CHUNK_ROWS`. An
+                interrupted log resumes from the first chunk that wasn't written.
+        """
         # log run details
         if not isinstance(eval_result, EvalResult):
             raise Exception(f"Invalid eval_result object. Expected: `vertexai.evaluation.EvalResult` Actual: {type(eval_result)}")
@@ -552,40 +1388,73 @@ class Evals():
         
         # get run details from the Rapid Eval evaluation task
         detail_df = eval_result.metrics_table.to_dict(orient="records")
-        summary_dict = eval_result.summary_metrics
+        summary_dict = dict(eval_result.summary_metrics)
+        if telemetry is not None:
+            summary_dict.update(telemetry.summary_metrics())
         non_metric_keys = ['context', 'reference', 'instruction', 'dataset_row_id', 'completed_prompt', 'response']
         # report_df = eval_result.metrics_table
-        print(f'detail_df.keys: {detail_df[0].keys()}')
-
-        # prepare run details        
-        run_details = []
-        for row in detail_df:
-            row.get("prompt")
-            metrics = {k: row[k] for k in row if k not in non_metric_keys}
-            run_detail = dict(
-                run_id=experiment_run_id,
-                experiment_id=experiment.experiment_id,
-                task_id=experiment.task_id,
-                dataset_row_id=row.get("dataset_row_id"),
-                system_instruction=row.get("instruction"),
-                input_prompt_gcs_uri=self.save_prompt(row.get("prompt"), run_path, row.get("dataset_row_id")), 
-                output_text=row.get("response"),
-                ground_truth=row.get("reference"),
-                metrics=json.dumps(metrics),
-                # additional fields
-                latencies=[],
-                create_datetime=datetime.datetime.now(),
-                update_datetime=datetime.datetime.now(),
-                tags=tags,
-                metadata=json.dumps(metadata) if isinstance(metadata, dict) else None
-                )
-            run_details.append(run_detail)
-        
-        try:
-            self._upsert("run_details", run_details)
-        except Exception as e:
-            print(f"Failed to log run details due to following error.")
-            raise e
+        logger.debug("Run detail columns: %s", list(detail_df[0].keys()))
+
+        # rows without a dataset row id get one derived from the dataset and their position, so that logging
+        # the run again merges into the same rows, and the rows of runs on the same dataset pair up
+        if any(row.get("dataset_row_id") is None for row in detail_df):
+            fingerprint = dataset_fingerprint(dataset_columns(eval_result.metrics_table))
+            for i, row in enumerate(detail_df):
+                if row.get("dataset_row_id") is None:
+                    row["dataset_row_id"] = generate_uuid(f"{fingerprint}|{i}", deterministic=True)
+
+        # all rows of the run are created with the create_datetime of the run, which a run logged again keeps,
+        # so that reads of the run can skip older partitions and MERGEs match the rows written before
+        created = self._run_create_datetime(experiment_run_id) or datetime.datetime.now()
+
+        # upload the prompts and merge the details chunk by chunk, skipping chunks already written
+        # by an earlier, interrupted log of the same run
+        written = self._load_log_progress(experiment_run_id)
+        skipped = 0
+        for start in range(0, len(detail_df), chunk_rows):
+            chunk = detail_df[start:start + chunk_rows]
+            chunk_key = log_chunk_key(experiment_run_id, experiment.experiment_id, experiment.task_id,
+                                      prompt_storage, tags, metadata, chunk)
+            if chunk_key in written:
+                skipped += 1
+                continue
+
+            prompt_uris = self.save_prompts(
+                [(row.get("dataset_row_id"), row.get("prompt")) for row in chunk], run_path, prompt_storage,
+                packed_name=f"prompts-{chunk_key}.jsonl")
+
+            # prepare run details
+            run_details = []
+            for row, prompt_uri in zip(chunk, prompt_uris):
+                metrics = {k: row[k] for k in row if k not in non_metric_keys}
+                run_detail = dict(
+                    run_id=experiment_run_id,
+                    experiment_id=experiment.experiment_id,
+                    task_id=experiment.task_id,
+                    dataset_row_id=row.get("dataset_row_id"),
+                    system_instruction=row.get("instruction"),
+                    input_prompt_gcs_uri=prompt_uri,
+                    output_text=row.get("response"),
+                    ground_truth=row.get("reference"),
+                    metrics=json.dumps(metrics),
+                    # additional fields
+                    create_datetime=created,
+                    update_datetime=datetime.datetime.now(),
+                    tags=tags,
+                    metadata=json.dumps(metadata) if isinstance(metadata, dict) else None
+                    )
+                if telemetry is not None:
+                    run_detail.update(telemetry.row_telemetry(row.get("prompt")))
+                run_details.append(run_detail)
+
+            try:
+                self._upsert("run_details", run_details)
+            except Exception as e:
+                logger.error("Failed to log run details (rows %d to %d).", start, start + len(chunk) - 1)
+                raise e
+            self._log_chunk_written(experiment_run_id, chunk_key)
+        if skipped:
+            logger.info("Resumed logging run %s: %d chunk(s) of run details were already logged.", experiment_run_id, skipped)
 
         # prepare run summary metrics
         run_summary = dict(
@@ -595,7 +1464,7 @@ class Evals():
             # dataset_row_id = experiment.dataset_row_id, 
             metrics=json.dumps(summary_dict),
             # additional fields
-            create_datetime=datetime.datetime.now(),
+            create_datetime=created,
             update_datetime=datetime.datetime.now(),
             tags=tags,
             metadata=json.dumps(metadata) if isinstance(metadata, dict) else None
@@ -604,5 +1473,242 @@ class Evals():
         try:
             self._upsert("runs", run_summary)
         except Exception as e:
-            print(f"Failed to log run summary due to following error.")
-            raise e
\ No newline at end of file
+            logger.error("Failed to log run summary.")
+            raise e
+
+        # summary metrics in long format, so runs can be compared without parsing JSON
+        run_metrics = metrics_to_rows(experiment_run_id, experiment.experiment_id, experiment.task_id, summary_dict,
+                                      create_datetime=created)
+        if run_metrics:
+            try:
+                self._upsert("run_metrics", run_metrics)
+            except Exception as e:
+                logger.error("Failed to log run metrics.")
+                raise e
+
+        # the run is fully logged, so a later log of it starts over
+        self._log_chunk_written(experiment_run_id, None)
+
+    def _run_create_datetime(self, run_id):
+        """The create_datetime of a run logged before, i.e. of the earliest of its rows, or None."""
+        tables = [BQ_TABLE_MAP[table_class]["table_name"] for table_class in ("runs", "run_details")]
+        if self.backend.supports_sql:
+            table_prefix = f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}"
+            sql = " UNION ALL ".join(
+                f"SELECT MIN(create_datetime) AS create_datetime FROM `{table_prefix}.{table}` WHERE run_id = @run_id"
+                for table in tables)
+            created = self.backend.query(sql, [bigquery.ScalarQueryParameter("run_id", "STRING", run_id)])["create_datetime"]
+        else:
+            created = pd.concat([self.backend.select(table, columns=["create_datetime"], where_keys={"run_id": run_id})["create_datetime"]
+                                 for table in tables])
+        created = pd.to_datetime(created).dropna()
+        return created.min().to_pydatetime() if len(created) else None
+
+    def _log_progress_path(self, run_id):
+        name = re.sub(r"[^\w.-]", "_", f"{self.backend.object_store_id}_{run_id}")
+        return os.path.join(LOG_PROGRESS_DIR, f"{name}.txt")
+
+    def _load_log_progress(self, run_id):
+        """Keys of the chunks of run details of a run already written, from its checkpoint."""
+        path = self._log_progress_path(run_id)
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def _log_chunk_written(self, run_id, chunk_key):
+        """
+        Checkpoints a chunk once its rows are written, or drops the checkpoint of the run when `chunk_key`
+        is None. With `async_writes`, this happens at the `flush()` that writes the queued rows.
+        """
+        if self._writer:
+            with self._log_progress_lock:
+                self._unflushed_log_chunks.append((run_id, chunk_key))
+        else:
+            self._checkpoint_log_chunks([(run_id, chunk_key)])
+
+    def _take_unflushed_log_chunks(self):
+        with self._log_progress_lock:
+            chunks, self._unflushed_log_chunks = self._unflushed_log_chunks, []
+        return chunks
+
+    def _checkpoint_log_chunks(self, chunks):
+        with self._log_progress_lock:
+            os.makedirs(LOG_PROGRESS_DIR, exist_ok=True)
+            for run_id, chunk_key in chunks:
+                if chunk_key is None:
+                    self._clear_log_progress(run_id)
+                    continue
+                with open(self._log_progress_path(run_id), "a") as f:
+                    f.write(f"{chunk_key}\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def _clear_log_progress(self, run_id):
+        try:
+            os.remove(self._log_progress_path(run_id))
+        except FileNotFoundError:
+            pass
+
+    def _logged_run_ids(self, task_id, run_ids):
+        """Returns the run ids, among `run_ids`, whose run summary is already logged."""
+        if not run_ids:
+            return set()
+        df = self.backend.select(BQ_TABLE_MAP["runs"]["table_name"], columns=["run_id"], where_keys={"task_id": task_id},
+                                 in_filters={"run_id": list(run_ids)})
+        return set(df["run_id"])
+
+    def _grid_prompt(self, prompt, system_instruction, tags):
+        if isinstance(prompt, self.Prompt):
+            return prompt
+        if not isinstance(prompt, dict) or "prompt_id" not in prompt or "prompt_template" not in prompt:
+            raise ValueError(f"Invalid prompt {prompt!r}. Expected a `Prompt` or a dict with `prompt_id` and `prompt_template`.")
+        return self.Prompt(**{
+            "prompt_type": "single-turn",
+            "is_multimodal": False,
+            "system_instruction": system_instruction,
+            "create_datetime": datetime.datetime.now(),
+            "update_datetime": datetime.datetime.now(),
+            "tags": tags,
+            **prompt,
+        })
+
+    def run_grid(self,
+                 task_id,
+                 prompts,
+                 configs,
+                 dataset,
+                 metrics,
+                 model_name=None,
+                 metric_config=None,
+                 system_instruction=None,
+                 safety_settings=None,
+                 model_fn=None,
+                 evaluate_fn=None,
+                 max_workers=4,
+                 requests_per_second=None,
+                 resume=True,
+                 stream=False,
+                 tags=[],
+                 metadata={},
+                 prompt_storage="per_row"):
+        """
+        Evaluates every combination of prompt and generation config concurrently, logging each experiment
+        and run as soon as its evaluation completes. The latency and token usage of the model calls are
+        logged with each run, see `ModelTelemetry`.
+
+        Run ids are derived from the task, the experiment and the content of the dataset, so calling
+        `run_grid` again after an interruption skips the runs that were already logged. The Vertex AI
+        experiment run of each evaluation gets a unique name, see `vertex_experiment_run_name`, so that
+        runs which were evaluated but failed to log can be evaluated again.
+
+        Args:
+            task_id: The task the experiments belong to. It should already be logged.
+            prompts: `Prompt`s, or dicts with at least `prompt_id` and `prompt_template`.
+            configs: Generation config dicts, e.g. `[{"temperature": 0.0}, {"temperature": 0.2}]`.
+            dataset: The evaluation dataset, as a DataFrame.
+            metrics: The metrics passed to `EvalTask`.
+            model_name: The Gemini model to evaluate, with the default `model_fn`.
+            metric_config: The metric config logged with each experiment. Defaults to `metrics`.
+            system_instruction: System instruction of the model, and of prompts given as dicts.
+            safety_settings: Safety settings of the model, with the default `model_fn`.
+            model_fn: Optional `model_fn(prompt, generation_config)` building the model of a combination.
+                Defaults to a `GenerativeModel`. The model must expose `_model_name`, `_generation_config`
+                and `_safety_settings` like a `GenerativeModel` does, for `log_experiment`.
+            evaluate_fn: Optional `evaluate_fn(model, prompt, dataset, experiment_run_id)` returning an
+                `EvalResult`. Defaults to generating the responses with `generate_responses` and evaluating
+                them with an `EvalTask`. `EvalTask` relies on the global experiment tracker, so the default
+                evaluations run one at a time while responses are generated concurrently.
+            max_workers: Number of combinations evaluated concurrently.
+            requests_per_second: Optional limit on the model calls of all combinations together.
+            resume: Skip the combinations whose run is already logged.
+            stream: Stream model responses to measure the time to first token, see `ModelTelemetry`.
+            tags: Tags logged with the prompts, experiments and runs.
+            metadata: Metadata logged with the experiments and runs.
+            prompt_storage: How completed prompts are saved, see `save_prompts`.
+
+        Returns:
+            A DataFrame with one row per combination: its experiment and run ids, and whether it was
+            completed, skipped or failed.
+        """
+        limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        prompts = [self._grid_prompt(prompt, system_instruction, tags) for prompt in prompts]
+        for prompt in {prompt.prompt_id: prompt for prompt in prompts}.values():
+            self.log_prompt(prompt)
+
+        if model_fn is None:
+            def model_fn(prompt, generation_config):
+                return GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                    system_instruction=prompt.system_instruction or system_instruction,
+                )
+        if evaluate_fn is None:
+            def evaluate_fn(model, prompt, dataset, experiment_run_id):
+                # responses are generated concurrently, only the evaluations are run one at a time
+                dataset = generate_responses(model, prompt.prompt_template, dataset)
+                with EVAL_TASK_LOCK:
+                    eval_task = EvalTask(dataset=dataset, metrics=metrics,
+                                         experiment=re.sub("[^0-9a-zA-Z]", "-", experiment_id_of[experiment_run_id].lower()))
+                    return eval_task.evaluate(experiment_run_name=vertex_experiment_run_name(experiment_run_id))
+
+        fingerprint = dataset_fingerprint(dataset)
+        combinations = []
+        experiment_id_of = {}
+        for prompt, generation_config in itertools.product(prompts, configs):
+            experiment_id = config_experiment_id(prompt.prompt_id, generation_config)
+            run_id = grid_run_id(task_id, experiment_id, fingerprint)
+            experiment_id_of[run_id] = experiment_id
+            combinations.append((prompt, generation_config, experiment_id, run_id))
+        logged_run_ids = self._logged_run_ids(task_id, list(experiment_id_of)) if resume else set()
+
+        def run(prompt, generation_config, experiment_id, run_id):
+            start = time.monotonic()
+            model = model_fn(prompt, generation_config)
+            telemetry = ModelTelemetry()
+            if hasattr(model, "generate_content"):
+                model = telemetry.instrument(model, stream=stream)
+            # wait for the rate limiter outside of the measured latency
+            if limiter:
+                model = limiter.wrap(model)
+            eval_result = evaluate_fn(model, prompt, dataset.copy(), run_id)
+            elapsed = time.monotonic() - start
+            experiment = self.log_experiment(
+                task_id=task_id,
+                experiment_id=experiment_id,
+                experiment_desc=f"Prompt {prompt.prompt_id} with generation config {json.dumps(generation_config)}",
+                prompt=prompt,
+                model=model,
+                metric_config=metric_config if metric_config is not None else metrics,
+                tags=tags,
+                metadata=metadata,
+                elapsed_time=elapsed,
+            )
+            run_path = f"{task_id}/prompts/{re.sub('[^0-9a-zA-Z]', '-', experiment_id.lower())}/{run_id}"
+            self.log_eval_run(experiment_run_id=run_id, experiment=experiment, eval_result=eval_result,
+                              run_path=run_path, tags=tags, metadata=metadata, prompt_storage=prompt_storage,
+                              telemetry=telemetry)
+            return elapsed
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for prompt, generation_config, experiment_id, run_id in combinations:
+                result = dict(prompt_id=prompt.prompt_id, generation_config=json.dumps(generation_config),
+                              experiment_id=experiment_id, run_id=run_id, status="skipped",
+                              elapsed_seconds=None, error=None)
+                results.append(result)
+                if run_id not in logged_run_ids:
+                    futures[executor.submit(run, prompt, generation_config, experiment_id, run_id)] = result
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    result["elapsed_seconds"] = future.result()
+                    result["status"] = "completed"
+                except Exception as e:
+                    logger.error("Run %s of experiment %s failed", result["run_id"], result["experiment_id"], exc_info=True)
+                    result["status"] = "failed"
+                    result["error"] = repr(e)
+        self.flush()
+        return pd.DataFrame(results)
@@ -0,0 +1,155 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+# Seconds are rounded to microseconds, as the latency and elapsed time columns are NUMERIC, which
+# hold at most 9 decimal digits
+TIME_DECIMALS = 6
+
+# Percentiles of the per-request latency and time to first token added to the run summary metrics
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def prompt_key(contents):
+    """Identifies a model request by its contents, so that it can be matched to the dataset row it was made for."""
+    return hashlib.sha256(str(contents).encode("utf-8")).hexdigest()
+
+
+def _usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, None
+    return (getattr(usage, "prompt_token_count", None),
+            getattr(usage, "candidates_token_count", None),
+            getattr(usage, "total_token_count", None))
+
+
+def merge_streamed_response(chunks):
+    """
+    Merges the chunks of a streamed `GenerationResponse` into a single response, through the public dict
+    form of the responses. The text of each candidate is concatenated, while the finish reason, safety
+    ratings and usage metadata are those of the last chunk, which carries the totals of the stream.
+    """
+    texts = {}
+    for chunk in chunks:
+        for i, candidate in enumerate(chunk.to_dict().get("candidates", [])):
+            parts = candidate.get("content", {}).get("parts", [])
+            texts[i] = texts.get(i, "") + "".join(part.get("text", "") for part in parts)
+    merged = chunks[-1].to_dict()
+    for i, candidate in enumerate(merged.get("candidates", [])):
+        candidate.setdefault("content", {"role": "model"})["parts"] = [{"text": texts.get(i, "")}]
+    return type(chunks[-1]).from_dict(merged)
+
+
+def latency_summary(name, values):
+    """Summarizes latencies as `{name}/mean` and `{name}/p50` style metrics. Returns {} without values."""
+    values = np.asarray([v for v in values if v is not None], dtype=float)
+    if not len(values):
+        return {}
+    summary = {f"{name}/mean": float(values.mean())}
+    for percentile, value in zip(LATENCY_PERCENTILES, np.percentile(values, LATENCY_PERCENTILES)):
+        summary[f"{name}/p{percentile}"] = float(value)
+    return summary
+
+
+class ModelTelemetry():
+    """
+    Records the latency, time to first token and token usage of each `generate_content` call of a model.
+
+    `instrument()` wraps the `generate_content` method of a model instance, so the model can still be
+    passed to `EvalTask.evaluate`. Calls are recorded per prompt and matched to the rows of the eval
+    result by `log_eval_run`. Retried requests all count towards the latencies of their row, while the
+    time to first token and the token counts are those of the last attempt.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, model, stream=False):
+        """
+        Wraps `model.generate_content` to record each call.
+
+        Args:
+            model: A `GenerativeModel`, or any model instance with a `generate_content` method.
+            stream: Request responses as streams to measure the time to first token. The chunks are
+                merged back into a single response for the caller by `merge_streamed_response`. Without
+                streaming, the time to first token is the latency of the request.
+
+        Returns:
+            The model.
+        """
+        generate_content = model.generate_content
+
+        def instrumented_generate_content(contents, *args, **kwargs):
+            start = time.perf_counter()
+            if stream and not kwargs.get("stream"):
+                response, first_token = self._generate_streamed(generate_content, contents, start, *args, **kwargs)
+            else:
+                response = generate_content(contents, *args, **kwargs)
+                first_token = time.perf_counter() - start
+            self.record(contents, time.perf_counter() - start, first_token, *_usage(response))
+            return response
+
+        model.generate_content = instrumented_generate_content
+        return model
+
+    @staticmethod
+    def _generate_streamed(generate_content, contents, start, *args, **kwargs):
+        chunks, first_token = [], None
+        for chunk in generate_content(contents, *args, stream=True, **kwargs):
+            if not chunks:
+                first_token = time.perf_counter() - start
+            chunks.append(chunk)
+        return merge_streamed_response(chunks), first_token
+
+    def record(self, contents, latency, time_to_first_token=None, input_tokens=None, output_tokens=None, total_tokens=None):
+        """Records a call made for `contents`, for models that aren't instrumented through `instrument()`."""
+        with self._lock:
+            calls = self._calls.setdefault(prompt_key(contents), [])
+            calls.append(dict(latency=latency, time_to_first_token=time_to_first_token, input_token_count=input_tokens,
+                              output_token_count=output_tokens, total_token_count=total_tokens))
+
+    def row_telemetry(self, contents):
+        """
+        Returns the `run_details` columns for the request made for `contents`. Without a recorded request
+        the latencies are empty and the other columns None, so every row has the same columns.
+        """
+        with self._lock:
+            calls = list(self._calls.get(prompt_key(contents), []))
+        last = calls[-1] if calls else dict.fromkeys(
+            ("time_to_first_token", "input_token_count", "output_token_count", "total_token_count"))
+        return dict(latencies=[round(call["latency"], TIME_DECIMALS) for call in calls],
+                    time_to_first_token=last["time_to_first_token"],
+                    input_token_count=last["input_token_count"],
+                    output_token_count=last["output_token_count"],
+                    total_token_count=last["total_token_count"])
+
+    def summary_metrics(self):
+        """Returns the latency percentiles and mean token counts of all recorded requests."""
+        with self._lock:
+            calls = [call for calls in self._calls.values() for call in calls]
+        summary = {}
+        summary.update(latency_summary("latency", [call["latency"] for call in calls]))
+        summary.update(latency_summary("time_to_first_token", [call["time_to_first_token"] for call in calls]))
+        for column in ("input_token_count", "output_token_count", "total_token_count"):
+            counts = [call[column] for call in calls if call[column] is not None]
+            if counts:
+                summary[f"{column}/mean"] = float(np.mean(counts))
+        return summary
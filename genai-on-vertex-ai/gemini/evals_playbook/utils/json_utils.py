@@ -0,0 +1,30 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parsing of the JSON columns of the evals tables."""
+
+import json
+
+try:
+    import orjson
+
+    def json_loads(value):
+        """Parses JSON with orjson, falling back to the standard library for values orjson rejects."""
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            # orjson rejects the NaN and Infinity that json.dumps writes for non-finite metrics and scores
+            return json.loads(value)
+except ImportError:
+    json_loads = json.loads
@@ -0,0 +1,172 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Migrates the tables of an evals dataset created with `evals_bigquery.sql` to the partitioned and
+clustered tables of `evals_bigquery_v2.sql`.
+
+BigQuery can't partition an existing table, so each table is copied: the v2 table is created under a
+temporary name, the rows are copied over, the row counts are compared, and the tables are swapped by
+renaming. The original table is kept as `<table>_v1_backup` unless `--drop-backup` is passed. Tables
+that are already partitioned are skipped, so the migration can be re-run after a failure.
+
+All the rows of a run logged with the v2 schema share the `create_datetime` of the run, which reads of
+the run prune partitions with. Runs logged before were created after their details, so the runs are
+copied with the `create_datetime` of their earliest row of details instead.
+
+Run from the evals_playbook directory:
+
+    python -m utils.migrate_schema --dry-run
+    python -m utils.migrate_schema
+"""
+
+import os
+import re
+import argparse
+
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+
+from utils import config as cfg
+
+V2_SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bigquery_sqls", "evals_bigquery_v2.sql")
+
+# Tables that are partitioned and clustered in the v2 schema
+PARTITIONED_TABLES = [cfg.BQ_T_EVAL_RUNS, cfg.BQ_T_EVAL_RUN_DETAILS, cfg.BQ_T_EVAL_RUN_METRICS]
+
+MIGRATION_SUFFIX = "_v2_migration"
+BACKUP_SUFFIX = "_v1_backup"
+
+
+def create_table_ddl(sql, table_name, new_name):
+    """Returns the `CREATE TABLE` statement of a table in a DDL script, creating it as `new_name`."""
+    match = re.search(rf"CREATE TABLE IF NOT EXISTS {table_name} \(.*?\);", sql, re.S)
+    if not match:
+        raise ValueError(f"Table '{table_name}' is not defined in {V2_SQL_PATH}.")
+    statement = match.group(0).rstrip(";")
+    return statement.replace(f"CREATE TABLE IF NOT EXISTS {table_name} (", f"CREATE TABLE `{new_name}` (", 1)
+
+
+def migration_statements(client, sql, dataset_id, table_name):
+    """Returns the statements migrating a table, or None if it is missing or already partitioned."""
+    table_id = f"{dataset_id}.{table_name}"
+    try:
+        table = client.get_table(table_id)
+    except NotFound:
+        # e.g. `eval_run_metrics` in datasets created before it was added
+        print(f"{table_id} doesn't exist, skipping.")
+        return None
+    if table.time_partitioning is not None:
+        print(f"{table_id} is already partitioned, skipping.")
+        return None
+    migration_id = f"{table_id}{MIGRATION_SUFFIX}"
+    columns = ", ".join(field.name for field in table.schema)
+    source = f"SELECT {columns} FROM `{table_id}`"
+    if table_name == cfg.BQ_T_EVAL_RUNS:
+        source = runs_source(client, dataset_id, table_name, table.schema) or source
+    return [
+        f"DROP TABLE IF EXISTS `{migration_id}`",
+        create_table_ddl(sql, table_name, migration_id),
+        f"ALTER TABLE `{migration_id}` ALTER COLUMN create_datetime SET DEFAULT (CURRENT_DATETIME())",
+        f"ALTER TABLE `{migration_id}` ALTER COLUMN update_datetime SET DEFAULT (CURRENT_DATETIME())",
+        f"INSERT INTO `{migration_id}` ({columns}) {source}",
+    ]
+
+
+def runs_source(client, dataset_id, table_name, schema):
+    """Returns the query copying the runs created at their earliest row of details, or None without details."""
+    details_id = f"{dataset_id}.{cfg.BQ_T_EVAL_RUN_DETAILS}"
+    try:
+        client.get_table(details_id)
+    except NotFound:
+        return None
+    created = "LEAST(IFNULL(create_datetime, details_created), IFNULL(details_created, create_datetime)) AS create_datetime"
+    select = ", ".join(created if field.name == "create_datetime" else field.name for field in schema)
+    return f"""SELECT {select} FROM `{dataset_id}.{table_name}`
+        LEFT JOIN (SELECT run_id, MIN(create_datetime) AS details_created FROM `{details_id}` GROUP BY run_id) USING (run_id)"""
+
+
+def row_count(client, table_id):
+    return next(iter(client.query_and_wait(f"SELECT COUNT(*) AS n FROM `{table_id}`")))["n"]
+
+
+def migrate_table(client, sql, dataset_id, table_name, dry_run=False, drop_backup=False):
+    """
+    Copies a table into a partitioned table and swaps them, keeping the original as a backup.
+
+    BigQuery has no table locks, so stop logging runs while migrating. Rows written to the original
+    table after it has been copied are detected once it is renamed to the backup, which then fails
+    further writes: the original table is renamed back and the migration raises, so no rows are lost
+    and the migration can be run again.
+    """
+    table_id = f"{dataset_id}.{table_name}"
+    statements = migration_statements(client, sql, dataset_id, table_name)
+    if statements is None:
+        return
+    migration_id = f"{table_id}{MIGRATION_SUFFIX}"
+    backup_name = f"{table_name}{BACKUP_SUFFIX}"
+    if dry_run:
+        print(f"-- {table_id}")
+        print(";\n".join(statements + [
+            f"ALTER TABLE `{table_id}` RENAME TO {backup_name}",
+            f"ALTER TABLE `{migration_id}` RENAME TO {table_name}",
+        ]) + ";\n")
+        return
+
+    try:
+        client.get_table(f"{dataset_id}.{backup_name}")
+        raise Exception(f"Backup table {dataset_id}.{backup_name} already exists, drop or rename it before migrating {table_id}.")
+    except NotFound:
+        pass
+
+    print(f"Copying {table_id} to {migration_id} ...")
+    for statement in statements:
+        client.query_and_wait(statement)
+    copied, original = row_count(client, migration_id), row_count(client, table_id)
+    if copied != original:
+        raise Exception(f"Copied {copied} rows of {table_id} but it has {original}, leaving {migration_id} in place for inspection.")
+
+    client.query_and_wait(f"ALTER TABLE `{table_id}` RENAME TO {backup_name}")
+    # count again now that the original can't be written to, to catch rows written since it was copied
+    final = row_count(client, f"{dataset_id}.{backup_name}")
+    if final != copied:
+        client.query_and_wait(f"ALTER TABLE `{dataset_id}.{backup_name}` RENAME TO {table_name}")
+        raise Exception(f"{final - copied} rows were written to {table_id} while it was copied, "
+                        f"stop logging runs and migrate it again.")
+    client.query_and_wait(f"ALTER TABLE `{migration_id}` RENAME TO {table_name}")
+    print(f"Migrated {original} rows of {table_id}, the original table is kept as {backup_name}.")
+    if drop_backup:
+        client.delete_table(f"{dataset_id}.{backup_name}")
+        print(f"Dropped {dataset_id}.{backup_name}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate an evals dataset to the partitioned and clustered v2 schema.")
+    parser.add_argument("--project", default=cfg.PROJECT_ID, help="Project of the dataset. Defaults to config.ini.")
+    parser.add_argument("--dataset", default=cfg.BQ_DATASET_ID, help="The evals dataset. Defaults to config.ini.")
+    parser.add_argument("--tables", nargs="+", default=PARTITIONED_TABLES, help="Tables to migrate.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the statements without running them.")
+    parser.add_argument("--drop-backup", action="store_true", help="Drop the original tables once migrated.")
+    args = parser.parse_args()
+
+    with open(V2_SQL_PATH) as f:
+        sql = f.read()
+    client = bigquery.Client(project=args.project)
+    dataset_id = f"{args.project}.{args.dataset}"
+    for table_name in args.tables:
+        migrate_table(client, sql, dataset_id, table_name, dry_run=args.dry_run, drop_backup=args.drop_backup)
+
+
+if __name__ == "__main__":
+    main()
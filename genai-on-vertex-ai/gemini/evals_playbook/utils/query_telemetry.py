@@ -0,0 +1,153 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Job statistics of the BigQuery queries run by `Evals`, aggregated per `Evals` method."""
+
+import re
+import sys
+import threading
+from collections import deque
+
+import pandas as pd
+
+# Number of queries whose statistics are kept for `QueryTelemetry.records`
+MAX_QUERY_RECORDS = 1000
+
+# Sorting a table by create_datetime to take the latest rows reads every row of the table,
+# the LIMIT is only applied after the scan
+LATEST_ROWS_PATTERN = re.compile(r"ORDER\s+BY\s+create_datetime\s+DESC\s+LIMIT", re.I)
+
+# A filter on the partitioning column, which lets BigQuery skip older partitions
+PARTITION_FILTER_PATTERN = re.compile(r"create_datetime\s*>=", re.I)
+
+# Fraction of a table's bytes a query has to process to count as a full scan
+FULL_SCAN_RATIO = 0.9
+
+
+# Modules whose frames are never reported as the calling method
+_INTERNAL_MODULES = (__name__, f"{__package__}.storage_backends")
+
+
+def calling_method():
+    """
+    Returns the qualified name of the public method, in this package, that led to the current call
+    (e.g. `Evals.compare_eval_runs`). Private helpers and nested functions are skipped. Returns None
+    when called outside of such a method, e.g. from the background writer thread.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        qualname = getattr(code, "co_qualname", code.co_name)
+        if (frame.f_globals.get("__package__") == __package__
+                and frame.f_globals.get("__name__") not in _INTERNAL_MODULES
+                and "<locals>" not in qualname
+                and not code.co_name.startswith("_")):
+            return qualname
+        frame = frame.f_back
+    return None
+
+
+class QueryTelemetry():
+    """
+    Records the statistics of BigQuery jobs: bytes processed and billed, slot milliseconds, cache
+    hits and wall time. Each query is attributed to the `Evals` method that ran it, so that
+    `summary()` shows which notebook actions are expensive. Queries that scan whole tables to
+    take their latest rows are flagged as full scans.
+    """
+
+    COLUMNS = ["method", "statement", "wall_seconds", "bytes_processed", "bytes_billed", "slot_millis",
+               "cache_hit", "estimated_bytes", "full_scan", "job_id", "sql"]
+
+    def __init__(self, max_records=MAX_QUERY_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, method, sql, wall_seconds, job=None, estimated_bytes=None, table_bytes=None):
+        """
+        Records a finished query.
+
+        Args:
+            method: The `Evals` method (or backend operation) the query was run for.
+            sql: The query text.
+            wall_seconds: Wall time of the query, including downloading its results.
+            job: The `QueryJob`, or the `RowIterator` returned by `query_and_wait`. Statistics it
+                doesn't report are recorded as None.
+            estimated_bytes: Bytes estimated by a dry run of the query, if one was made.
+            table_bytes: Size of the tables the query reads, if known, to detect full scans.
+        """
+        bytes_processed = getattr(job, "total_bytes_processed", None)
+        full_scan = bool(LATEST_ROWS_PATTERN.search(sql)) and not PARTITION_FILTER_PATTERN.search(sql)
+        if table_bytes and bytes_processed is not None:
+            full_scan = full_scan or bytes_processed >= FULL_SCAN_RATIO * table_bytes
+        record = dict(
+            method=method,
+            statement=sql.split(None, 1)[0].upper() if sql.strip() else None,
+            wall_seconds=wall_seconds,
+            bytes_processed=bytes_processed,
+            bytes_billed=getattr(job, "total_bytes_billed", None),
+            slot_millis=getattr(job, "slot_millis", None),
+            cache_hit=getattr(job, "cache_hit", None),
+            estimated_bytes=estimated_bytes,
+            full_scan=full_scan,
+            job_id=getattr(job, "job_id", None),
+            sql=sql,
+        )
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def to_frame(self):
+        """Returns the recorded queries, oldest first."""
+        with self._lock:
+            return pd.DataFrame(list(self.records), columns=self.COLUMNS)
+
+    def summary(self):
+        """
+        Returns aggregates per method: number of queries, wall time, bytes, slot time, cache hits and full scans.
+        Statistics a job didn't report are left out of the sums rather than counted as 0, a sum is NaN when
+        no query of the method reported it, and `queries_without_stats` counts the queries missing any of
+        bytes processed, bytes billed or slot time.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return pd.DataFrame(columns=["method", "queries", "wall_seconds", "mean_wall_seconds", "bytes_processed",
+                                         "bytes_billed", "slot_millis", "estimated_bytes", "cache_hits", "full_scans",
+                                         "queries_without_stats"])
+        df["method"] = df["method"].fillna("(unknown)")
+        df["cache_hit"] = df["cache_hit"].fillna(False).astype(bool)
+        stat_columns = ["bytes_processed", "bytes_billed", "slot_millis", "estimated_bytes"]
+        df[stat_columns] = df[stat_columns].apply(pd.to_numeric)
+        df["without_stats"] = df[["bytes_processed", "bytes_billed", "slot_millis"]].isna().any(axis=1)
+        known_sum = lambda values: values.sum(min_count=1)
+        summary = df.groupby("method").agg(
+            queries=("sql", "size"),
+            wall_seconds=("wall_seconds", "sum"),
+            mean_wall_seconds=("wall_seconds", "mean"),
+            bytes_processed=("bytes_processed", known_sum),
+            bytes_billed=("bytes_billed", known_sum),
+            slot_millis=("slot_millis", known_sum),
+            estimated_bytes=("estimated_bytes", known_sum),
+            cache_hits=("cache_hit", "sum"),
+            full_scans=("full_scan", "sum"),
+            queries_without_stats=("without_stats", "sum"),
+        )
+        return summary.sort_values("bytes_processed", ascending=False).reset_index()
+
+    def expensive(self, n=10):
+        """Returns the `n` recorded queries that processed the most bytes."""
+        return self.to_frame().sort_values("bytes_processed", ascending=False, na_position="last").head(n)
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
@@ -0,0 +1,174 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bootstrap confidence intervals and paired significance tests for the per-row metrics of eval runs.
+
+Per-row metrics are arranged as one (dataset rows x runs) matrix per metric. Resampling is done with
+multinomial weights shared by all runs, so a single matrix product computes the resampled means of
+every run at once, and differences between runs are paired on the same dataset rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.json_utils import json_loads
+
+# Number of bootstrap resamples
+N_RESAMPLES = 2000
+
+# Resamples computed per matrix product, to bound the memory of the weight matrix
+RESAMPLE_CHUNK = 500
+
+# Suffix of the per-row score of a metric in the metrics table of an `EvalResult`
+ROW_METRIC_SUFFIX = "/score"
+
+
+def metric_matrices(details):
+    """
+    Arranges per-row metrics in columnar form.
+
+    Args:
+        details: A DataFrame of `run_details` rows with `run_id`, `dataset_row_id` and the JSON `metrics`.
+
+    Returns:
+        The dataset row ids, the run ids, and a dict of metric name (e.g. `rouge_1/score`) to a float
+        matrix of shape (rows, runs), with NaN where a run has no score for a row.
+    """
+    if details.empty:
+        return [], [], {}
+    parsed = [json_loads(m) if isinstance(m, (str, bytes)) else (m or {}) for m in details["metrics"].tolist()]
+    scores = pd.DataFrame.from_records(parsed, index=details.index)
+    scores = scores[[col for col in scores.columns if str(col).endswith(ROW_METRIC_SUFFIX)]]
+    scores = scores.apply(pd.to_numeric, errors="coerce")
+    keys = details[["dataset_row_id", "run_id"]]
+    row_ids = pd.Index(keys["dataset_row_id"].unique())
+    run_ids = pd.Index(keys["run_id"].unique())
+    rows, runs = row_ids.get_indexer(keys["dataset_row_id"]), run_ids.get_indexer(keys["run_id"])
+    matrices = {}
+    for metric in scores.columns:
+        matrix = np.full((len(row_ids), len(run_ids)), np.nan)
+        matrix[rows, runs] = scores[metric].to_numpy(dtype=float)
+        matrices[metric] = matrix
+    return list(row_ids), list(run_ids), matrices
+
+
+def _resampled_means(matrix, n_resamples, seed):
+    """Returns the means of each column of `matrix` over bootstrap resamples of its rows, shape (n_resamples, columns)."""
+    n_rows = matrix.shape[0]
+    present = ~np.isnan(matrix)
+    values = np.where(present, matrix, 0.0)
+    present = present.astype(float)
+    rng = np.random.default_rng(seed)
+    means = []
+    for start in range(0, n_resamples, RESAMPLE_CHUNK):
+        size = min(RESAMPLE_CHUNK, n_resamples - start)
+        # how many times each row is drawn in each resample, counted in one bincount over all resamples
+        draws = rng.integers(0, n_rows, size=(size, n_rows)) + (np.arange(size) * n_rows)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=size * n_rows).reshape(size, n_rows).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means.append((weights @ values) / (weights @ present))
+    return np.vstack(means)
+
+
+def _column_means(matrix):
+    counts = (~np.isnan(matrix)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.nansum(matrix, axis=0) / counts, np.nan)
+
+
+def _intervals(means, confidence):
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid="ignore"):
+        return np.nanquantile(means, [alpha, 1 - alpha], axis=0)
+
+
+def _p_values(means, baseline):
+    """Two-sided p-values of resampled mean differences being zero, over the resamples with a finite mean."""
+    finite = np.isfinite(means)
+    # NaN compares as neither <= 0 nor >= 0, so counting over all resamples would bias p-values towards 0
+    n = finite.sum(axis=0)
+    below, above = (finite & (means <= 0)).sum(axis=0), (finite & (means >= 0)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p_value = np.where(n > 0, np.minimum(1.0, 2 * np.minimum(below, above) / n), np.nan)
+    p_value[baseline] = 1.0
+    return p_value
+
+
+def bootstrap_ci(matrix, n_resamples=N_RESAMPLES, confidence=0.95, seed=0):
+    """
+    Bootstrap confidence intervals of the mean of each column of a (rows x runs) matrix, ignoring NaNs.
+
+    Returns:
+        Arrays of the mean, lower and upper bound of each column.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    low, high = _intervals(_resampled_means(matrix, n_resamples, seed), confidence)
+    return _column_means(matrix), low, high
+
+
+def paired_bootstrap(matrix, baseline, n_resamples=N_RESAMPLES, confidence=0.95, seed=0):
+    """
+    Paired bootstrap of the difference between each column of a (rows x runs) matrix and the baseline
+    column, on the rows both have a score for.
+
+    Returns:
+        Arrays of the mean difference, its lower and upper bound, and the two-sided p-value of the
+        difference being zero, for each column. The baseline column compares to itself as 0 with p=1.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    diffs = matrix - matrix[:, [baseline]]
+    means = _resampled_means(diffs, n_resamples, seed)
+    low, high = _intervals(means, confidence)
+    return _column_means(diffs), low, high, _p_values(means, baseline)
+
+
+def run_statistics(details, baseline_run_id=None, n_resamples=N_RESAMPLES, confidence=0.95, seed=0):
+    """
+    Computes, for every metric and run, the bootstrap confidence interval of the mean per-row score and
+    its paired difference to a baseline run.
+
+    Args:
+        details: A DataFrame of `run_details` rows with `run_id`, `dataset_row_id` and `metrics`.
+        baseline_run_id: The run the others are compared to. Defaults to the best run of each metric.
+        n_resamples: Number of bootstrap resamples.
+        confidence: Confidence level of the intervals.
+        seed: Seed of the resampling, for reproducible intervals.
+
+    Returns:
+        A DataFrame with one row per metric and run: `n` rows scored, `mean`, `ci_low`, `ci_high`, the
+        `baseline_run_id`, and the `diff`, `diff_ci_low`, `diff_ci_high` and `p_value` against it.
+    """
+    _, run_ids, matrices = metric_matrices(details)
+    frames = []
+    for metric, matrix in matrices.items():
+        mean = _column_means(matrix)
+        if baseline_run_id is not None and baseline_run_id in run_ids:
+            baseline = run_ids.index(baseline_run_id)
+        else:
+            baseline = int(np.nanargmax(mean)) if not np.isnan(mean).all() else 0
+        diffs = matrix - matrix[:, [baseline]]
+        # the scores and their differences are resampled together, with the same weights
+        means = _resampled_means(np.hstack([matrix, diffs]), n_resamples, seed)
+        low, high = _intervals(means[:, :len(run_ids)], confidence)
+        diff_low, diff_high = _intervals(means[:, len(run_ids):], confidence)
+        diff, p_value = _column_means(diffs), _p_values(means[:, len(run_ids):], baseline)
+        frames.append(pd.DataFrame(dict(
+            metric=metric[:-len(ROW_METRIC_SUFFIX)], run_id=run_ids, n=(~np.isnan(matrix)).sum(axis=0),
+            mean=mean, ci_low=low, ci_high=high, baseline_run_id=run_ids[baseline],
+            diff=diff, diff_ci_low=diff_low, diff_ci_high=diff_high, p_value=p_value)))
+    if not frames:
+        return pd.DataFrame(columns=["metric", "run_id", "n", "mean", "ci_low", "ci_high", "baseline_run_id",
+                                     "diff", "diff_ci_low", "diff_ci_high", "p_value"])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,1147 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Storage backends for `Evals`: BigQuery and Cloud Storage, or an embedded SQLite database and local files."""
+
+import os
+import re
+import atexit
+import json
+import uuid
+import queue
+import shutil
+import sqlite3
+import hashlib
+import decimal
+import logging
+import datetime
+import threading
+import time
+import weakref
+import pathlib
+import urllib.parse
+from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+from utils import config as cfg
+from utils.query_telemetry import QueryTelemetry, calling_method
+from google.cloud import bigquery
+from google.cloud import storage
+from google.cloud import bigquery_storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+logger = logging.getLogger(__name__)
+
+# Batches with at least this many rows are upserted through a staging table instead of query parameters
+BULK_UPSERT_MIN_ROWS = 500
+# Rows per load job when filling the staging table
+BULK_LOAD_CHUNK_ROWS = 50000
+# Concurrent uploads (and pooled HTTP connections) used to save prompts to Cloud Storage
+GCS_UPLOAD_WORKERS = 16
+# Streams read concurrently by default when scanning a table through the BigQuery Storage Read API
+READ_STREAMS = 4
+# Rows per chunk when scanning a table of the local backend
+LOCAL_READ_CHUNK_ROWS = 10000
+# Local cache of content hashes already known to exist in the staging bucket and of table schemas
+LOCAL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "evals_playbook")
+# Table definitions, used by the local backend to create its schema
+DEFAULT_SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bigquery_sqls", "evals_bigquery.sql")
+
+# A column as reported in a table schema, mirroring `bigquery.SchemaField`
+SchemaField = namedtuple("SchemaField", ["name", "field_type", "mode"])
+LocalTable = namedtuple("LocalTable", ["table_id", "schema"])
+
+
+def write_to_gcs(gcs_path, data, storage_client=None):
+    if not gcs_path.startswith("gs://"):
+        raise Exception(f"Invalid Cloud Storage path {gcs_path}. Pass a valid path starting with gs://")
+
+    # check if data is a file or a string
+    UPLOAD_AS_FILE = False
+    if os.path.exists(data):
+        UPLOAD_AS_FILE = True
+
+    bucket = gcs_path.split("/")[2]
+    object = "/".join(gcs_path.split("/")[3:])
+
+    # Initialize the Cloud Storage client, unless a shared one is passed
+    if storage_client is None:
+        storage_client = storage.Client()
+
+    # Get the bucket object
+    bucket = storage_client.bucket(bucket)
+    blob = bucket.blob(object)
+    # retry transient errors, uploads are idempotent overwrites of the same object
+    if UPLOAD_AS_FILE:
+        blob.upload_from_filename(data, retry=DEFAULT_RETRY)
+    else:
+        blob.upload_from_string(data, retry=DEFAULT_RETRY)
+    return blob.self_link
+
+def gcs_self_link(bucket, object):
+    """Returns the JSON API self link of an object, as `blob.self_link` would after an upload."""
+    return f"https://www.googleapis.com/storage/v1/b/{bucket}/o/{urllib.parse.quote(object, safe='')}"
+
+def split_byte_range(uri):
+    """Splits a URI ending in `#bytes=start-end`, as written for packed prompts, into (uri, (start, end))."""
+    uri, _, fragment = uri.partition("#")
+    byte_range = None
+    if fragment.startswith("bytes="):
+        start, end = fragment[len("bytes="):].split("-")
+        byte_range = (int(start), int(end))
+    return uri, byte_range
+
+def parse_gcs_uri(uri):
+    """Splits a gs:// URI or a blob self link into (bucket, object, byte_range).
+
+    `byte_range` is a `(start, end)` tuple of inclusive offsets for URIs ending
+    in `#bytes=start-end`, as written for packed prompts, and None otherwise.
+    """
+    uri, byte_range = split_byte_range(uri)
+    if uri.startswith("gs://"):
+        bucket, _, object = uri[len("gs://"):].partition("/")
+    else:
+        # https://www.googleapis.com/storage/v1/b/{bucket}/o/{url-encoded object}
+        path = urllib.parse.urlparse(uri).path
+        bucket, _, object = path.split("/b/", 1)[1].partition("/o/")
+        object = urllib.parse.unquote(object)
+    return bucket, object, byte_range
+
+def sql_literal(value):
+    """Formats a value as a GoogleSQL literal, for APIs such as row restrictions that don't take query parameters."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime.datetime):
+        return f"DATETIME '{value.isoformat(sep=' ')}'"
+    escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+def query_parameter_type(field_type):
+    """Maps a type reported in a BigQuery schema to the type name expected by query parameters."""
+    return {"BOOLEAN": "BOOL", "INTEGER": "INT64", "FLOAT": "FLOAT64"}.get(field_type, field_type)
+
+def parse_table_schemas(sql):
+    """Parses the `CREATE TABLE` statements of a DDL script into {table_name: [SchemaField, ...]}.
+
+    Types are reported the way BigQuery reports them for an existing table,
+    e.g. `ARRAY<STRING>` as a REPEATED STRING and `BOOL` as BOOLEAN.
+    """
+    sql = re.sub(r"--[^\n]*", "", sql)
+    type_names = {"BOOL": "BOOLEAN", "INT": "INTEGER", "INT64": "INTEGER", "FLOAT64": "FLOAT"}
+    tables = {}
+    for match in re.finditer(r"CREATE TABLE IF NOT EXISTS\s+(\w+)\s*\((.*?)\)\s*"
+                             r"(?:PARTITION BY[^\n]*\s*)?(?:CLUSTER BY[^\n]*\s*)?OPTIONS\s*\(", sql, re.S):
+        fields = []
+        for line in match.group(2).splitlines():
+            column = re.match(r"\s*(\w+)\s+(ARRAY<(\w+)>|\w+)", line)
+            if not column:
+                continue
+            name, field_type, item_type = column.groups()
+            mode = "REPEATED" if item_type else "NULLABLE"
+            field_type = (item_type or field_type).upper()
+            fields.append(SchemaField(name, type_names.get(field_type, field_type), mode))
+        tables[match.group(1)] = fields
+    return tables
+
+
+class StorageBackend(ABC):
+    """Where `Evals` keeps its tables and the prompts of eval runs.
+
+    Tables are addressed by name, as in `BQ_TABLE_MAP`, and objects by a path
+    relative to the backend's object store (the staging bucket for BigQuery).
+    """
+
+    # Whether `query` can run the BigQuery SQL used for analytics, otherwise `Evals` falls back to pandas
+    supports_sql = False
+
+    def __init__(self):
+        self.stats = {}
+        # `QueryTelemetry` of the backend's queries, for backends that report job statistics
+        self.telemetry = None
+
+    @abstractmethod
+    def get_table(self, table_name):
+        """Returns table metadata with a `schema` listing the fields (name, field_type, mode) of the table."""
+
+    def get_schema_fields(self, table_name):
+        """Returns the fields of a table as [name, field_type, mode] lists."""
+        return [[field.name, field.field_type, field.mode] for field in self.get_table(table_name).schema]
+
+    def invalidate_schema_cache(self, table_name=None):
+        """Drops cached table metadata for one table, or for all tables if none is given."""
+
+    def has_table(self, table_name):
+        """Whether a table exists, e.g. one added to the DDL after the dataset was created."""
+        try:
+            self.get_table(table_name)
+        except (NotFound, ValueError):
+            return False
+        return True
+
+    def partition_filter(self, table_name, alias=None, run_ids=None):
+        """Returns a SQL condition pruning the partitions of a table that a read of `run_ids` may skip, or None."""
+        return None
+
+    def _check_columns(self, table_name, columns):
+        field_names = [field.name for field in self.get_table(table_name).schema]
+        unknown = [col for col in columns if col not in field_names]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} for table '{table_name}'.")
+        return field_names
+
+    @abstractmethod
+    def select(self, table_name, columns=None, where_keys=None, in_filters=None, limit=None):
+        """Reads rows, latest first.
+
+        Args:
+            table_name: The name of the table.
+            columns: Optional list of columns to read. Defaults to all columns.
+            where_keys: Optional dictionary of column values to filter on.
+            in_filters: Optional dictionary of columns to lists of accepted values.
+            limit: Optional maximum number of rows.
+
+        Returns:
+            A DataFrame with the selected columns.
+        """
+
+    @abstractmethod
+    def iter_rows(self, table_name, columns=None, where_keys=None, output="pandas", max_streams=READ_STREAMS):
+        """Streams a table in chunks, yielding DataFrames or `pyarrow.RecordBatch`es."""
+
+    @abstractmethod
+    def upsert(self, table_name, update_keys, rows):
+        """Inserts rows, or updates the rows matching their update keys. `create_datetime` is never updated."""
+
+    @abstractmethod
+    def write_object(self, path, data):
+        """Writes (or overwrites) an object from a string, bytes or the path of a local file, and returns its URI."""
+
+    @abstractmethod
+    def create_object(self, path, data):
+        """Writes an object only if it doesn't exist yet. Returns whether it was created."""
+
+    @abstractmethod
+    def object_uri(self, path):
+        """Returns the URI an object written to `path` is read back from."""
+
+    @abstractmethod
+    def read_object(self, uri):
+        """Reads an object, or only the byte range given by a `#bytes=start-end` suffix of the URI."""
+
+    @property
+    @abstractmethod
+    def object_store_id(self):
+        """Identifies the object store, e.g. to key local indexes of objects known to exist in it."""
+
+    def query(self, sql, query_parameters=None):
+        """Runs a SQL query and returns the result as a DataFrame."""
+        raise NotImplementedError(f"{type(self).__name__} doesn't run BigQuery SQL.")
+
+
+class BigQueryBackend(StorageBackend):
+    """Keeps tables in the BigQuery dataset and prompts in the staging bucket configured in `config.ini`."""
+
+    supports_sql = True
+
+    def __init__(self, schema_cache_ttl=600, bucket=None, dry_run_estimates=False, telemetry=None,
+                 partition_window_days=None):
+        """
+        Args:
+            schema_cache_ttl: Seconds for which a table schema fetched from BigQuery is reused.
+            bucket: The bucket prompts are saved to. Defaults to the staging bucket.
+            dry_run_estimates: Dry-run every query before running it, to record the bytes BigQuery
+                estimated next to the bytes actually processed.
+            telemetry: The `QueryTelemetry` job statistics are recorded in. Defaults to a new one.
+            partition_window_days: Reads that aren't filtered on runs only read rows created in the last
+                `partition_window_days` days from tables partitioned on `create_datetime` (see
+                `evals_bigquery_v2.sql`), so that they skip older partitions. Defaults to reading all
+                partitions. Reads of given runs always skip the partitions from before the runs were
+                created, see `partition_filter`.
+        """
+        super().__init__()
+        self.partition_window_days = partition_window_days
+        self.dry_run_estimates = dry_run_estimates
+        self.telemetry = telemetry or QueryTelemetry()
+        self.bucket = bucket or cfg.STAGING_BUCKET
+        self.schema_cache_ttl = schema_cache_ttl
+        # shared clients and table metadata, reused across calls
+        self._bq_client = None
+        self._storage_client = None
+        self._bq_storage_client = None
+        self._client_lock = threading.Lock()
+        self._table_cache = {}
+        self._schema_cache = None
+        # create_datetime of runs, which is kept when a run is logged again
+        self._run_created = {}
+        self.stats = dict.fromkeys([
+            "bq_clients_created", "bq_client_reuses",
+            "storage_clients_created", "storage_client_reuses",
+            "schema_cache_hits", "schema_cache_misses",
+        ], 0)
+
+    @property
+    def bq_client(self):
+        """BigQuery client shared by all calls on this backend."""
+        with self._client_lock:
+            if self._bq_client is None:
+                self._bq_client = bigquery.Client(project=cfg.PROJECT_ID)
+                self.stats["bq_clients_created"] += 1
+            else:
+                self.stats["bq_client_reuses"] += 1
+            return self._bq_client
+
+    @property
+    def storage_client(self):
+        """Cloud Storage client shared by all uploads on this backend."""
+        with self._client_lock:
+            if self._storage_client is None:
+                self._storage_client = storage.Client(project=cfg.PROJECT_ID)
+                # size the connection pool for concurrent uploads so connections are reused, not reopened
+                adapter = requests.adapters.HTTPAdapter(pool_connections=GCS_UPLOAD_WORKERS, pool_maxsize=GCS_UPLOAD_WORKERS)
+                self._storage_client._http.mount("https://", adapter)
+                self.stats["storage_clients_created"] += 1
+            else:
+                self.stats["storage_client_reuses"] += 1
+            return self._storage_client
+
+    @property
+    def bq_storage_client(self):
+        """BigQuery Storage Read API client shared by all streaming reads on this backend."""
+        with self._client_lock:
+            if self._bq_storage_client is None:
+                self._bq_storage_client = bigquery_storage.BigQueryReadClient()
+            return self._bq_storage_client
+
+    def table_id(self, table_name):
+        return f"{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}.{table_name}"
+
+    def _schema_cache_path(self):
+        return os.path.join(LOCAL_CACHE_DIR, f"schema_{cfg.PROJECT_ID}.{cfg.BQ_DATASET_ID}.json")
+
+    def _load_schema_cache(self):
+        """Table schemas cached on disk, keyed by table id, with the table ETag they were read at."""
+        if self._schema_cache is None:
+            self._schema_cache = {}
+            if os.path.exists(self._schema_cache_path()):
+                with open(self._schema_cache_path()) as f:
+                    self._schema_cache = json.load(f)
+        return self._schema_cache
+
+    def _update_schema_cache(self, table):
+        """Records the schema of a freshly fetched table if its ETag differs from the cached one."""
+        cache = self._load_schema_cache()
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        if cache.get(table_id, {}).get("etag") == table.etag:
+            return
+        cache[table_id] = {
+            "etag": table.etag,
+            "fields": [[field.name, field.field_type, field.mode] for field in table.schema],
+        }
+        os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{self._schema_cache_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, self._schema_cache_path())
+
+    def get_schema_fields(self, table_name):
+        """Returns the fields of a table from the local schema cache, fetching the table metadata only if it's cold."""
+        cached = self._load_schema_cache().get(self.table_id(table_name))
+        if cached:
+            return cached["fields"]
+        return super().get_schema_fields(table_name)
+
+    def get_table(self, table_name):
+        """Returns the `bigquery.Table`, fetching its metadata at most once per TTL."""
+        table_id = self.table_id(table_name)
+        cached = self._table_cache.get(table_id)
+        if cached and time.monotonic() - cached[0] < self.schema_cache_ttl:
+            self.stats["schema_cache_hits"] += 1
+            return cached[1]
+        self.stats["schema_cache_misses"] += 1
+        table = self.bq_client.get_table(table_id)
+        self._table_cache[table_id] = (time.monotonic(), table)
+        self._update_schema_cache(table)
+        return table
+
+    def invalidate_schema_cache(self, table_name=None):
+        if table_name is None:
+            self._table_cache.clear()
+        else:
+            self._table_cache.pop(self.table_id(table_name), None)
+
+    def dry_run(self, sql, query_parameters=None):
+        """Returns the number of bytes BigQuery estimates a query would process, without running it."""
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [], dry_run=True, use_query_cache=False)
+        return self.bq_client.query(sql, job_config=job_config).total_bytes_processed
+
+    def _table_bytes(self, sql):
+        """Total size of the tables a query reads, from the cached table metadata only. None if any is unknown."""
+        total = 0
+        for table_id in set(re.findall(r"`([\w.-]+)`", sql)):
+            cached = self._table_cache.get(table_id)
+            if cached is None or cached[1].num_bytes is None:
+                return None
+            total += cached[1].num_bytes
+        return total or None
+
+    def _run_query(self, sql, query_parameters=None, operation="query", to_dataframe=True):
+        """Runs a query, recording its job statistics in `telemetry`."""
+        estimated_bytes = self.dry_run(sql, query_parameters) if self.dry_run_estimates else None
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+        start = time.monotonic()
+        if to_dataframe:
+            job = self.bq_client.query_and_wait(sql, job_config=job_config)
+            result = job.to_dataframe()
+        else:
+            job = self.bq_client.query(sql, job_config=job_config)
+            result = job.result()
+        record = self.telemetry.record(calling_method() or operation, sql, time.monotonic() - start, job=job,
+                                       estimated_bytes=estimated_bytes, table_bytes=self._table_bytes(sql))
+        if record["full_scan"]:
+            logger.debug("Query for %s scanned its whole table (%s bytes)", record["method"], record["bytes_processed"])
+        return result
+
+    def query(self, sql, query_parameters=None):
+        return self._run_query(sql, query_parameters)
+
+    @staticmethod
+    def _partitioned_on_create_datetime(table):
+        return table.time_partitioning is not None and table.time_partitioning.field == "create_datetime"
+
+    def partition_filter(self, table_name, alias=None, run_ids=None):
+        """
+        Returns a condition skipping the partitions that can't hold rows of `run_ids`, as all the rows
+        of a run are created with the `create_datetime` of the run (see `Evals.log_eval_run`). The
+        create_datetime of the runs is looked up in the runs table, which is clustered on `run_id`, and
+        cached. Reads of runs that aren't in the runs table, e.g. whose log was interrupted, aren't
+        pruned. Reads that aren't filtered on runs are limited to `partition_window_days`, if given.
+        """
+        if not self._partitioned_on_create_datetime(self.get_table(table_name)):
+            return None
+        column = f"{alias}.create_datetime" if alias else "create_datetime"
+        run_ids = [run_id for run_id in run_ids or [] if run_id is not None]
+        if run_ids:
+            if table_name == cfg.BQ_T_EVAL_RUNS:
+                return None
+            since = self._runs_created_since(run_ids)
+            return f"{column} >= {sql_literal(since)}" if since is not None else None
+        if not self.partition_window_days:
+            return None
+        return f"{column} >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL {int(self.partition_window_days)} DAY)"
+
+    def _runs_created_since(self, run_ids):
+        """The earliest create_datetime of the runs, or None if any of them isn't in the runs table."""
+        missing = sorted(set(run_ids) - set(self._run_created))
+        if missing:
+            sql = f"""
+                SELECT run_id, MIN(create_datetime) AS create_datetime
+                FROM `{self.table_id(cfg.BQ_T_EVAL_RUNS)}`
+                WHERE run_id IN UNNEST(@run_ids)
+                GROUP BY run_id
+            """
+            created = self.query(sql, [bigquery.ArrayQueryParameter("run_ids", "STRING", missing)])
+            for row in created.itertuples():
+                if not pd.isna(row.create_datetime):
+                    self._run_created[row.run_id] = pd.Timestamp(row.create_datetime).to_pydatetime()
+        if any(run_id not in self._run_created for run_id in run_ids):
+            return None
+        return min(self._run_created[run_id] for run_id in run_ids)
+
+    @staticmethod
+    def _filtered_run_ids(where_keys=None, in_filters=None):
+        """The run ids a read is filtered on."""
+        run_ids = list((in_filters or {}).get("run_id", []))
+        if (where_keys or {}).get("run_id") is not None:
+            run_ids.append(where_keys["run_id"])
+        return run_ids
+
+    def _merge_window(self, table, rows):
+        """
+        Returns a condition restricting the target of a MERGE to the partitions from the oldest merged
+        row on, with its query parameter, or no condition if the table isn't partitioned on
+        `create_datetime`. A row logged again keeps the `create_datetime` it was first written with (see
+        `Evals.log_eval_run`), so it is in the partitions of the merged rows.
+        """
+        created = [row.get("create_datetime") for row in rows]
+        if (not self._partitioned_on_create_datetime(table)
+                or not created or any(value is None for value in created)):
+            return [], []
+        since = min(pd.Timestamp(value) for value in created).to_pydatetime().replace(tzinfo=None)
+        return (["target.create_datetime >= @merge_since"],
+                [bigquery.ScalarQueryParameter("merge_since", "DATETIME", since)])
+
+    def _cluster_filters(self, table, update_keys, rows):
+        """
+        Returns conditions restricting the target of a MERGE to the values of its clustering columns in
+        the merged rows, and to the partitions of `_merge_window`, with their query parameters. BigQuery
+        only prunes the blocks of a MERGE target on constant filters, and the cluster conditions don't
+        change which rows match since the update keys are compared for equality anyway.
+        """
+        field_types = {field.name: field.field_type for field in table.schema}
+        conditions, query_parameters = self._merge_window(table, rows)
+        for column in table.clustering_fields or []:
+            if column not in update_keys:
+                continue
+            values = sorted({row[column] for row in rows if row.get(column) is not None})
+            conditions.append(f"target.{column} IN UNNEST(@cluster_{column})")
+            query_parameters.append(bigquery.ArrayQueryParameter(
+                f"cluster_{column}", query_parameter_type(field_types[column]), values))
+        return conditions, query_parameters
+
+    def select(self, table_name, columns=None, where_keys=None, in_filters=None, limit=None):
+        table = self.get_table(table_name)
+        field_types = {field.name: field.field_type for field in table.schema}
+        self._check_columns(table_name, list(columns or []) + list(where_keys or {}) + list(in_filters or {}))
+        columns = columns or list(field_types)
+
+        # Filter values are passed as query parameters, so the query text only
+        # depends on which keys are filtered on and BigQuery can reuse it
+        conditions, query_parameters = [], []
+        for k, v in (where_keys or {}).items():
+            conditions.append(f"{k} = @{k}")
+            query_parameters.append(bigquery.ScalarQueryParameter(k, query_parameter_type(field_types[k]), v))
+        for k, values in (in_filters or {}).items():
+            conditions.append(f"{k} IN UNNEST(@{k}_values)")
+            query_parameters.append(bigquery.ArrayQueryParameter(f"{k}_values", query_parameter_type(field_types[k]), list(values)))
+        partition_filter = self.partition_filter(table_name, run_ids=self._filtered_run_ids(where_keys, in_filters))
+        if partition_filter:
+            conditions.append(partition_filter)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit_clause = ""
+        if limit is not None:
+            limit_clause = "LIMIT @limit_offset"
+            query_parameters.append(bigquery.ScalarQueryParameter("limit_offset", "INT64", limit))
+        sql = f"""
+            SELECT {", ".join(columns)}
+            FROM `{self.table_id(table_name)}`
+            {where_clause}
+            ORDER BY create_datetime DESC
+            {limit_clause}
+        """
+        return self.query(sql, query_parameters)
+
+    def iter_rows(self, table_name, columns=None, where_keys=None, output="pandas", max_streams=READ_STREAMS):
+        """
+        Streams a table through the BigQuery Storage Read API, yielding one chunk per Arrow record batch.
+        Only the selected columns are read, and filters are applied by BigQuery, so full tables can be
+        scanned with bounded memory. Chunks from different streams are yielded in arrival order.
+        """
+        if output not in ("pandas", "arrow"):
+            raise ValueError(f"Invalid output '{output}'. Supported ['pandas', 'arrow']")
+        table = self.get_table(table_name)
+        field_names = self._check_columns(table_name, list(columns or []) + list(where_keys or {}))
+        columns = columns or field_names
+
+        # the Storage Read API doesn't take query parameters, so values are escaped as literals
+        conditions = [f"{k} = {sql_literal(v)}" for k, v in (where_keys or {}).items()]
+        partition_filter = self.partition_filter(table_name, run_ids=self._filtered_run_ids(where_keys))
+        if partition_filter:
+            conditions.append(partition_filter)
+        row_restriction = " AND ".join(conditions)
+        requested_session = bigquery_storage.types.ReadSession(
+            table=f"projects/{table.project}/datasets/{table.dataset_id}/tables/{table.table_id}",
+            data_format=bigquery_storage.types.DataFormat.ARROW,
+            read_options=bigquery_storage.types.ReadSession.TableReadOptions(
+                selected_fields=list(columns), row_restriction=row_restriction),
+        )
+        client = self.bq_storage_client
+        session = client.create_read_session(
+            parent=f"projects/{cfg.PROJECT_ID}", read_session=requested_session, max_stream_count=max_streams)
+
+        def read_stream(stream):
+            for page in client.read_rows(stream.name).rows(session).pages:
+                if output == "arrow":
+                    yield from page.to_arrow().to_batches()
+                else:
+                    yield page.to_dataframe()
+
+        if len(session.streams) <= 1:
+            for stream in session.streams:
+                yield from read_stream(stream)
+            return
+
+        # read streams concurrently, handing chunks over through a bounded queue to cap memory use
+        chunks = queue.Queue(maxsize=2 * len(session.streams))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # gives up once the consumer has stopped, so workers never block on a full queue
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(stream):
+            try:
+                for chunk in read_stream(stream):
+                    if not put(chunk):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+            for stream in session.streams:
+                executor.submit(worker, stream)
+            try:
+                remaining = len(session.streams)
+                while remaining:
+                    chunk = chunks.get()
+                    if chunk is done:
+                        remaining -= 1
+                    elif isinstance(chunk, Exception):
+                        raise chunk
+                    else:
+                        yield chunk
+            finally:
+                stop.set()
+
+    def upsert(self, table_name, update_keys, rows):
+        """Merges rows into the table with a MERGE statement, matching on the update keys."""
+        all_keys = set().union(*(d.keys() for d in rows))
+
+        # Get BigQuery table schema
+        table_id = self.table_id(table_name)
+        client = self.bq_client
+        table = self.get_table(table_name)
+        schema = {schema.name:schema.field_type for schema in table.schema}
+
+        if len(rows) >= BULK_UPSERT_MIN_ROWS:
+            return self._bulk_upsert(client, table, update_keys, all_keys, rows)
+
+        # Construct the MERGE query dynamically
+        cluster_conditions, cluster_parameters = self._cluster_filters(table, update_keys, rows)
+        merge_query = self._merge_query(table_id, "SELECT * FROM UNNEST(@rows)", update_keys, all_keys, cluster_conditions)
+
+        # Convert rows to BigQuery format
+        rows_for_query = []
+        for row in rows:
+            row_for_query = []
+            for key, val in row.items():
+                field_type = schema.get(key)
+                if field_type == "BOOLEAN":
+                    field_type = "BOOL"
+                if (val is not None):
+                    if isinstance(val, datetime.datetime):
+                        val = val.isoformat()
+                    if isinstance(val, list):
+                        row_for_query.append(bigquery.ArrayQueryParameter(key, field_type, val))
+                    else:
+                        row_for_query.append(bigquery.ScalarQueryParameter(key, field_type, val))
+            rows_for_query.append(bigquery.StructQueryParameter("x", *row_for_query))
+
+        logger.debug("MERGE of %d rows into %s:\n%s", len(rows), table_id, merge_query)
+
+        # waits for the MERGE to complete
+        self._run_query(merge_query, [bigquery.ArrayQueryParameter("rows", "STRUCT", rows_for_query)] + cluster_parameters,
+                        operation="upsert", to_dataframe=False)
+
+    def _merge_query(self, table_id, source_query, update_keys, all_keys, target_conditions=()):
+        """Builds a MERGE of the rows returned by `source_query` into the table, matching on the update keys.
+        `target_conditions` further restrict the target rows that can match, to prune the blocks scanned."""
+        conditions = [f"target.{key} = source.{key}" for key in update_keys] + list(target_conditions)
+        merge_query = f"""
+            MERGE INTO `{table_id}` AS target
+            USING (
+                {source_query}
+            ) AS source
+            ON {" AND ".join(conditions)}
+        """
+
+        if update_keys:
+            merge_query += f"""     WHEN MATCHED THEN
+                UPDATE SET {", ".join(f"target.{key} = source.{key}" for key in all_keys if key not in update_keys + ['create_datetime'])}
+        """
+
+        merge_query += f"""     WHEN NOT MATCHED THEN
+                INSERT({", ".join([key for key in all_keys])})
+                VALUES({", ".join(f"source.{key}" for key in all_keys)})
+        """
+        return merge_query
+
+    def _bulk_upsert(self, client, table, update_keys, all_keys, rows):
+        """Upserts a large batch of rows through a temporary staging table.
+
+        Rows are streamed into the staging table as newline-delimited JSON load jobs
+        of at most `BULK_LOAD_CHUNK_ROWS` rows each, then merged into the target
+        table with a single set-based MERGE. This avoids the size limits and the
+        serialization cost of passing every row as a query parameter.
+
+        Args:
+            client: The BigQuery client.
+            table: The target `bigquery.Table`.
+            update_keys: A list of keys to use for updating existing rows.
+            all_keys: The columns present in the rows.
+            rows: A list of dictionaries where each dictionary represents a row.
+        """
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        staging_id = f"{table.project}.{table.dataset_id}._staging_{table.table_id}_{uuid.uuid4().hex[:12]}"
+
+        staging_table = bigquery.Table(staging_id, schema=table.schema)
+        # Expire the staging table in case the cleanup below never runs
+        staging_table.expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+        client.create_table(staging_table)
+
+        try:
+            job_config = bigquery.LoadJobConfig(
+                schema=table.schema,
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            )
+            for start in range(0, len(rows), BULK_LOAD_CHUNK_ROWS):
+                chunk = [
+                    {key: val.isoformat() if isinstance(val, datetime.datetime) else val
+                     for key, val in row.items() if val is not None}
+                    for row in rows[start:start + BULK_LOAD_CHUNK_ROWS]
+                ]
+                client.load_table_from_json(chunk, staging_id, job_config=job_config).result()
+
+            source_query = f"SELECT {', '.join(all_keys)} FROM `{staging_id}`"
+            cluster_conditions, cluster_parameters = self._cluster_filters(table, update_keys, rows)
+            merge_query = self._merge_query(table_id, source_query, update_keys, all_keys, cluster_conditions)
+            logger.info("Bulk MERGE of %d rows from staging table %s", len(rows), staging_id)
+
+            # waits for the MERGE to complete
+            self._run_query(merge_query, cluster_parameters, operation="upsert", to_dataframe=False)
+        finally:
+            client.delete_table(staging_id, not_found_ok=True)
+
+    @property
+    def object_store_id(self):
+        return self.bucket
+
+    def write_object(self, path, data):
+        return write_to_gcs(f"gs://{self.bucket}/{path}", data, storage_client=self.storage_client)
+
+    def create_object(self, path, data):
+        blob = self.storage_client.bucket(self.bucket).blob(path)
+        # the caller's index of existing objects may be cold, check the bucket before sending the data
+        if blob.exists():
+            return False
+        try:
+            # only create the object if no other writer got there first
+            blob.upload_from_string(data, if_generation_match=0, retry=DEFAULT_RETRY)
+        except PreconditionFailed:
+            return False
+        return True
+
+    def object_uri(self, path):
+        return gcs_self_link(self.bucket, path)
+
+    def read_object(self, uri):
+        bucket, object, byte_range = parse_gcs_uri(uri)
+        blob = self.storage_client.bucket(bucket).blob(object)
+        if byte_range is None:
+            return blob.download_as_bytes()
+        return blob.download_as_bytes(start=byte_range[0], end=byte_range[1])
+
+
+class LocalBackend(StorageBackend):
+    """Keeps tables in an embedded SQLite database and prompts on the local filesystem.
+
+    The schema is created from the BigQuery DDL in `bigquery_sqls/evals_bigquery.sql`, and upserts
+    follow the same semantics as the BigQuery MERGE. Needs no cloud project or credentials, which makes
+    it suited to offline iteration, CI and benchmarking the `Evals` code paths on a laptop.
+    """
+
+    SQLITE_TYPES = {"STRING": "TEXT", "INTEGER": "INTEGER", "BOOLEAN": "INTEGER",
+                    "FLOAT": "REAL", "NUMERIC": "REAL", "BIGNUMERIC": "REAL"}
+
+    def __init__(self, root_dir=os.path.join(LOCAL_CACHE_DIR, "local"), sql_path=DEFAULT_SQL_PATH):
+        """
+        Args:
+            root_dir: Directory holding the database (`evals.db`) and the saved objects (`objects/`).
+            sql_path: DDL script the table schemas are read from.
+        """
+        super().__init__()
+        self.root_dir = os.path.abspath(root_dir)
+        self.objects_dir = os.path.join(self.root_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.db_path = os.path.join(self.root_dir, "evals.db")
+        with open(sql_path) as f:
+            self._tables = parse_table_schemas(f.read())
+        self._lock = threading.RLock()
+        self._indexed = set()
+        self._conn = self._connect()
+        with self._lock, self._conn:
+            for table_name, fields in self._tables.items():
+                self._conn.execute(self._create_table_sql(table_name, fields))
+                # columns added to the schema since the database was created
+                existing = {row[1] for row in self._conn.execute(f'PRAGMA table_info("{table_name}")')}
+                for field in fields:
+                    if field.name not in existing:
+                        self._conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN {self._column_sql(field)}')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _column_sql(self, field):
+        sqlite_type = "TEXT" if field.mode == "REPEATED" else self.SQLITE_TYPES.get(field.field_type, "TEXT")
+        # the BigQuery tables default these to CURRENT_DATETIME()
+        default = " DEFAULT CURRENT_TIMESTAMP" if field.name in ("create_datetime", "update_datetime") else ""
+        return f'"{field.name}" {sqlite_type}{default}'
+
+    def _create_table_sql(self, table_name, fields):
+        columns = ", ".join(self._column_sql(field) for field in fields)
+        return f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns})'
+
+    def get_table(self, table_name):
+        if table_name not in self._tables:
+            raise ValueError(f"Table '{table_name}' is not defined in the schema.")
+        return LocalTable(table_name, self._tables[table_name])
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (list, tuple, dict)):
+            return json.dumps(value, default=str)
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(sep=" ")
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return value
+
+    def _decode(self, table_name, df):
+        """Converts columns stored as text back to the types `BigQueryBackend` returns."""
+        for field in self.get_table(table_name).schema:
+            if field.name not in df.columns:
+                continue
+            if field.mode == "REPEATED":
+                df[field.name] = df[field.name].map(lambda v: json.loads(v) if isinstance(v, str) else v)
+            elif field.field_type in ("DATETIME", "TIMESTAMP"):
+                df[field.name] = pd.to_datetime(df[field.name], format="ISO8601")
+            elif field.field_type == "BOOLEAN":
+                df[field.name] = df[field.name].map(lambda v: None if v is None or pd.isna(v) else bool(v))
+        return df
+
+    def _select_sql(self, table_name, columns=None, where_keys=None, in_filters=None, limit=None):
+        field_names = self._check_columns(table_name, list(columns or []) + list(where_keys or {}) + list(in_filters or {}))
+        columns = columns or field_names
+        conditions, params = [], []
+        for k, v in (where_keys or {}).items():
+            conditions.append(f'"{k}" = ?')
+            params.append(self._encode(v))
+        for k, values in (in_filters or {}).items():
+            values = list(values)
+            conditions.append(f'"{k}" IN ({", ".join("?" * len(values))})' if values else "0")
+            params.extend(self._encode(v) for v in values)
+        quoted_columns = ", ".join(f'"{col}"' for col in columns)
+        sql = f'SELECT {quoted_columns} FROM "{table_name}"'
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += " ORDER BY create_datetime DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return sql, params
+
+    def select(self, table_name, columns=None, where_keys=None, in_filters=None, limit=None):
+        sql, params = self._select_sql(table_name, columns, where_keys, in_filters, limit)
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        return self._decode(table_name, df)
+
+    def iter_rows(self, table_name, columns=None, where_keys=None, output="pandas", max_streams=READ_STREAMS):
+        """Streams a table in chunks of `LOCAL_READ_CHUNK_ROWS` rows. `max_streams` is ignored."""
+        if output not in ("pandas", "arrow"):
+            raise ValueError(f"Invalid output '{output}'. Supported ['pandas', 'arrow']")
+        sql, params = self._select_sql(table_name, columns, where_keys)
+        # a separate connection, so a long scan doesn't hold up writes on the shared one
+        conn = self._connect()
+        try:
+            for df in pd.read_sql_query(sql, conn, params=params, chunksize=LOCAL_READ_CHUNK_ROWS):
+                df = self._decode(table_name, df)
+                if output == "arrow":
+                    import pyarrow
+                    yield pyarrow.RecordBatch.from_pandas(df, preserve_index=False)
+                else:
+                    yield df
+        finally:
+            conn.close()
+
+    def upsert(self, table_name, update_keys, rows):
+        """Inserts rows with `INSERT ... ON CONFLICT DO UPDATE` on a unique index over the update keys."""
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        self._check_columns(table_name, columns)
+        update_cols = [col for col in columns if col not in update_keys + ["create_datetime"]]
+        quoted_keys = ", ".join(f'"{key}"' for key in update_keys)
+        sql = f'''
+            INSERT INTO "{table_name}" ({", ".join(f'"{col}"' for col in columns)})
+            VALUES ({", ".join("?" * len(columns))})
+            ON CONFLICT({quoted_keys}) DO {"UPDATE SET " + ", ".join(f'"{col}" = excluded."{col}"' for col in update_cols) if update_cols else "NOTHING"}
+        '''
+        values = [[self._encode(row.get(col)) for col in columns] for row in rows]
+        with self._lock, self._conn:
+            if table_name not in self._indexed:
+                self._conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table_name}" ON "{table_name}" ({quoted_keys})')
+                self._indexed.add(table_name)
+            self._conn.executemany(sql, values)
+
+    @property
+    def object_store_id(self):
+        return "local_" + hashlib.sha1(self.root_dir.encode("utf-8")).hexdigest()[:12]
+
+    def _object_path(self, path):
+        full_path = os.path.abspath(os.path.join(self.objects_dir, path))
+        if not full_path.startswith(self.objects_dir + os.sep):
+            raise ValueError(f"Invalid object path {path}.")
+        return full_path
+
+    def _write_tmp(self, full_path, data):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        if isinstance(data, str) and os.path.exists(data):
+            shutil.copyfile(data, tmp_path)
+        else:
+            with open(tmp_path, "wb") as f:
+                f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        return tmp_path
+
+    def write_object(self, path, data):
+        full_path = self._object_path(path)
+        os.replace(self._write_tmp(full_path, data), full_path)
+        return self.object_uri(path)
+
+    def create_object(self, path, data):
+        full_path = self._object_path(path)
+        tmp_path = self._write_tmp(full_path, data)
+        try:
+            # linking fails if the object exists, so concurrent writers can't overwrite each other
+            os.link(tmp_path, full_path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def object_uri(self, path):
+        return pathlib.Path(self._object_path(path)).as_uri()
+
+    def read_object(self, uri):
+        uri, byte_range = split_byte_range(uri)
+        with open(urllib.parse.unquote(urllib.parse.urlparse(uri).path), "rb") as f:
+            if byte_range is None:
+                return f.read()
+            f.seek(byte_range[0])
+            return f.read(byte_range[1] - byte_range[0] + 1)
+
+
+class WriteStats():
+    """Thread-safe counters of the writes made through `timed_upsert`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.rows_written = 0
+        self.write_failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, rows, latency=None):
+        """Counts a write of `rows` rows, or a failed write if no latency is given."""
+        with self._lock:
+            if latency is None:
+                self.write_failures += 1
+                return
+            self.writes += 1
+            self.rows_written += rows
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "writes": self.writes,
+                "rows_written": self.rows_written,
+                "write_failures": self.write_failures,
+                "avg_write_latency_seconds": self.total_latency / self.writes if self.writes else None,
+                "max_write_latency_seconds": self.max_latency,
+            }
+
+
+def timed_upsert(backend, table_name, update_keys, rows, write_stats):
+    """Upserts rows through the backend, logging the latency or failure of the write and counting it in `write_stats`."""
+    start = time.monotonic()
+    try:
+        backend.upsert(table_name, update_keys, rows)
+    except Exception:
+        write_stats.record(len(rows))
+        logger.error("Upsert of %d rows into %s failed", len(rows), table_name, exc_info=True,
+                     extra={"table": table_name, "rows": len(rows)})
+        raise
+    latency = time.monotonic() - start
+    write_stats.record(len(rows), latency)
+    logger.info("Upserted %d rows into %s in %.3fs", len(rows), table_name, latency,
+                extra={"table": table_name, "rows": len(rows), "latency_seconds": latency})
+
+
+# Background writers not closed yet, written by `_close_writers_at_exit`. Weak references, so that the
+# hook doesn't keep writers that are no longer used alive
+_open_writers = weakref.WeakSet()
+
+
+def _close_writers_at_exit():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception:
+            logger.exception("Failed to write rows queued by the background writer before exiting.")
+
+
+atexit.register(_close_writers_at_exit)
+
+
+class BackgroundWriter():
+    """
+    Applies upserts on a background thread, so that logging doesn't block the caller on the write.
+
+    Rows queued for a table are coalesced until the next write: consecutive rows with the same columns
+    go out as a single batched upsert, and a row queued again before it was written is only sent once.
+    Writes to the same table are applied in the order they were queued. Failures are logged and raised
+    by the next `flush()`. Rows still queued when the interpreter exits are written by an `atexit` hook,
+    which logs any failure, so a script that never calls `close()` doesn't lose them silently.
+
+    The writer thread only runs while rows are queued, and the exit hook only keeps a weak reference,
+    so an idle writer that is no longer used is released.
+    """
+
+    def __init__(self, backend, write_stats, flush_interval=1.0, max_pending_rows=BULK_LOAD_CHUNK_ROWS, on_write=None):
+        """
+        Args:
+            backend: The `StorageBackend` rows are written to.
+            write_stats: `WriteStats` the writes are counted in.
+            flush_interval: Seconds rows may wait to be coalesced with later rows before they are written.
+            max_pending_rows: Number of queued rows at which writes start right away, and beyond which
+                callers wait for the writer to catch up.
+            on_write: Optional callback called with the table name after each write to a table.
+        """
+        self.backend = backend
+        self.write_stats = write_stats
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.on_write = on_write
+        # table name -> list of [update_keys, columns, OrderedDict(key values -> row)] in queue order
+        self._pending = OrderedDict()
+        self._pending_rows = 0
+        self._busy = False
+        self._flush_requested = False
+        self._closed = False
+        self._errors = []
+        self._cond = threading.Condition()
+        self.stats = dict.fromkeys(["writes_queued", "rows_queued", "rows_coalesced", "batches_written"], 0)
+        self._thread = None
+        _open_writers.add(self)
+
+    def submit(self, table_name, update_keys, rows):
+        """Queues rows to be upserted into a table."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The background writer is closed.")
+            # apply backpressure rather than buffering without bound
+            self._cond.wait_for(lambda: self._pending_rows < self.max_pending_rows)
+            groups = self._pending.setdefault(table_name, [])
+            for row in rows:
+                columns = frozenset(row)
+                if not groups or groups[-1][0] != update_keys or groups[-1][1] != columns:
+                    groups.append([update_keys, columns, OrderedDict()])
+                batch = groups[-1][2]
+                key = tuple(row[k] for k in update_keys)
+                if key in batch:
+                    # a MERGE never updates create_datetime, so keep the one of the first write
+                    if "create_datetime" in batch[key]:
+                        row = {**row, "create_datetime": batch[key]["create_datetime"]}
+                    self.stats["rows_coalesced"] += 1
+                else:
+                    self._pending_rows += 1
+                batch[key] = row
+            self.stats["writes_queued"] += 1
+            self.stats["rows_queued"] += len(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="evals-background-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    # stop once idle, so that the thread doesn't keep an unused writer alive
+                    self._thread = None
+                    return
+                # give later writes a chance to join the batch
+                self._cond.wait_for(
+                    lambda: self._flush_requested or self._closed or self._pending_rows >= self.max_pending_rows,
+                    timeout=self.flush_interval)
+                pending, self._pending, self._pending_rows = self._pending, OrderedDict(), 0
+                self._busy = True
+                self._flush_requested = False
+                self._cond.notify_all()
+
+            for table_name, groups in pending.items():
+                for update_keys, _, batch in groups:
+                    try:
+                        timed_upsert(self.backend, table_name, update_keys, list(batch.values()), self.write_stats)
+                        self.stats["batches_written"] += 1
+                    except Exception as e:
+                        with self._cond:
+                            self._errors.append(e)
+                if self.on_write:
+                    self.on_write(table_name)
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Blocks until every queued row is written, and raises if any write failed since the last flush."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            done = self._cond.wait_for(lambda: not self._pending and not self._busy, timeout=timeout)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise RuntimeError(f"{len(errors)} background writes failed, the first with: {errors[0]!r}") from errors[0]
+        if not done:
+            raise TimeoutError(f"Background writes didn't complete within {timeout} seconds.")
+
+    def close(self):
+        """Writes every queued row and stops the writer thread."""
+        _open_writers.discard(self)
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                thread = self._thread
+                self._cond.notify_all()
+            if thread is not None:
+                thread.join()
@@ -0,0 +1,67 @@
+"""
+Measures the import time of the needlehaystack CLI and checks that no provider SDK is loaded at startup.
+
+Runs `python -X importtime -c "import needlehaystack.run"` in fresh interpreters and reports the median
+cumulative import time of the package, the slowest imports, and any SDK module that was imported eagerly.
+Exits with status 1 if an SDK module was loaded.
+
+Usage, from the needle_in_a_haystack directory:
+    python benchmarks/import_time.py [--repeat 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported once a provider or evaluator is selected
+SDK_MODULES = ('vertexai', 'google.cloud.aiplatform', 'langchain', 'langchain_google_vertexai', 'sentencepiece')
+
+
+def parse_importtime(stderr):
+    """
+    Returns a list of (module, self microseconds, cumulative microseconds) from the output of -X importtime
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(module='needlehaystack.run'):
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=package_dir, capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5, help='Number of fresh interpreters to time. Default is 5.')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list. Default is 10.')
+    args = parser.parse_args()
+
+    totals, imports = [], []
+    for _ in range(args.repeat):
+        imports = measure()
+        totals.append(sum(self_us for _, self_us, _ in imports))
+
+    print(f"import needlehaystack.run: median {statistics.median(totals) / 1000:.1f} ms "
+          f"(min {min(totals) / 1000:.1f} ms, {args.repeat} runs, {len(imports)} modules)")
+    print(f"Slowest imports (cumulative):")
+    for module, _, cumulative_us in sorted(imports, key=lambda i: -i[2])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    eager = sorted({module for module, _, _ in imports
+                    if any(module == sdk or module.startswith(sdk + '.') for sdk in SDK_MODULES)})
+    if eager:
+        print(f"Provider SDK modules imported at startup: {', '.join(eager)}")
+        sys.exit(1)
+    print("No provider SDK module is imported at startup.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,9 @@
 from .evaluator import Evaluator
-from .google import GoogleEvaluator
+
+
+def __getattr__(name):
+    # Evaluators pull in langchain on import, so only load them once they are asked for
+    if name == "GoogleEvaluator":
+        from .google import GoogleEvaluator
+        return GoogleEvaluator
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+
+class CellJournal:
+    """
+    An append-only write-ahead journal of the progress of each context length / depth combination (a cell).
+
+    Every cell moves through the states dispatched -> responded -> scored -> persisted, and each transition is
+    appended to the journal as one JSON line. Every record is flushed to the operating system as it is written,
+    so a crash of the process loses nothing. Records are fsynced in batches, at most `fsync_interval_seconds`
+    after they are written, so a crash of the machine loses at most the records of that interval. On restart the
+    journal is replayed, so that model responses which were already received can be re-scored without calling
+    the model again, and only cells that never got a response are dispatched again.
+    """
+
+    DISPATCHED = "dispatched"
+    RESPONDED = "responded"
+    SCORED = "scored"
+    PERSISTED = "persisted"
+
+    def __init__(self, path: str, fsync_every: int = 32, fsync_interval_seconds: float = 1.0):
+        """
+        :param path: The journal file. It is created if it does not exist and replayed if it does.
+        :param fsync_every: The number of records after which the journal is fsynced. Default is 32.
+        :param fsync_interval_seconds: The maximum time a record may wait before the journal is fsynced, whether or
+            not more records are written. Default is 1 second.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval_seconds = fsync_interval_seconds
+        self.cells = {}
+        self.replay()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.pending_records = 0
+        self.last_sync_time = time.time()
+        self.lock = threading.Lock()
+        self.sync_timer = None
+
+    @staticmethod
+    def cell_key(model_name, context_length, depth_percent, version) -> str:
+        return f"{model_name}|{int(context_length)}|{float(depth_percent)}|{version}"
+
+    def replay(self):
+        """
+        Rebuilds the latest state of every cell from the journal file.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write at the end of the journal from a crash mid-record
+                    continue
+                self.apply(record)
+
+    def apply(self, record: dict):
+        cell = self.cells.setdefault(record['key'], {'state': None, 'trials': {}})
+        cell['state'] = record['state']
+        if record['state'] == self.DISPATCHED:
+            cell['needle'] = record['needle']
+            cell['retrieval_question'] = record['retrieval_question']
+        elif record['state'] == self.RESPONDED:
+            cell['trials'].setdefault(record['trial'], {})['response'] = record['response']
+        elif record['state'] == self.SCORED:
+            cell['trials'].setdefault(record['trial'], {})['score'] = record['score']
+
+    def get(self, key: str) -> dict | None:
+        return self.cells.get(key)
+
+    def is_persisted(self, key: str) -> bool:
+        cell = self.cells.get(key)
+        return cell is not None and cell['state'] == self.PERSISTED
+
+    def record(self, key: str, state: str, **data):
+        """
+        Appends a state transition for a cell and flushes it. The journal is fsynced once the current batch is full,
+        or by a timer once its oldest record is `fsync_interval_seconds` old.
+        """
+        record = {'key': key, 'state': state, **data}
+        self.apply(record)
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            self.pending_records += 1
+            if self.pending_records >= self.fsync_every:
+                self._sync()
+            elif self.sync_timer is None:
+                self.sync_timer = threading.Timer(self.fsync_interval_seconds, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+
+    def sync(self):
+        with self.lock:
+            if not self.file.closed:
+                self._sync()
+
+    def _sync(self):
+        if self.sync_timer is not None:
+            self.sync_timer.cancel()
+            self.sync_timer = None
+        if self.pending_records:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending_records = 0
+        self.last_sync_time = time.time()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
@@ -8,6 +8,7 @@ import time
 import numpy as np
 
 from .evaluators import Evaluator
+from .journal import CellJournal
 from .providers import ModelProvider
 
 from asyncio import Semaphore
@@ -27,6 +28,29 @@ RANDOM_NEEDLE_CITIES = [
     'Damascus', 'Seattle', 'Los Angeles', 'Yerevan', 'Victoria', 'Tunis', 'Astana', 'Seoul',
     'Buenos Aires', 'Bangkok', 'Colombo', 'Brussels', 'Khartoum', 'Doha', 'San Francisco', 'Vienna', 'Jakarta']
 
+# Two-sided 95% quantiles of Student's t distribution for 1 to 30 degrees of freedom
+T_QUANTILES_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                  2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                  2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Fewest trials whose confidence interval is used to stop early, as the variance of two scores is too weak an estimate
+MIN_TRIALS_FOR_CI = 3
+
+# Default number of trials before a combination can stop early, so that two agreeing scores stop it
+DEFAULT_MIN_TRIALS = 2
+
+def t_quantile_95(degrees_of_freedom):
+    """
+    Returns the two-sided 95% quantile of Student's t distribution, tabulated up to 30 degrees of freedom
+    """
+    if degrees_of_freedom <= len(T_QUANTILES_95):
+        return T_QUANTILES_95[degrees_of_freedom - 1]
+    if degrees_of_freedom <= 60:
+        return 2.000
+    if degrees_of_freedom <= 120:
+        return 1.980
+    return 1.960
+
 class LLMNeedleHaystackTester:
     """
     This class is used to test the LLM Needle Haystack.
@@ -54,6 +78,10 @@ class LLMNeedleHaystackTester:
                  final_context_length_buffer = 200,
                  seconds_to_sleep_between_completions = None,
                  print_ongoing_status = True,
+                 num_trials = 1,
+                 min_trials = DEFAULT_MIN_TRIALS,
+                 trials_ci_half_width = 0.5,
+                 journal_path = None,
                  **kwargs):
         """
         :model_to_test: The model to test. Default is None.
@@ -77,6 +105,10 @@ class LLMNeedleHaystackTester:
         :param document_depth_percent_interval_type: The type of interval for the document depth percent. Must be either 'linear' or 'sigmoid'. Default is 'linear'.
         :param seconds_to_sleep_between_completions: The number of seconds to sleep between completions. Default is None.
         :param print_ongoing_status: Whether or not to print the ongoing status. Default is True.
+        :param num_trials: The maximum number of repetitions of each context length / depth combination, used to measure nondeterminism. Default is 1 (no repetition).
+        :param min_trials: The minimum number of repetitions to run before checking whether to stop early. A combination stops once that many trials agree, while the confidence interval is only checked from 3 trials on. Default is 2.
+        :param trials_ci_half_width: Stop repeating a combination once the half-width of the 95% confidence interval of its score is at most this value. Default is 0.5.
+        :param journal_path: Path of a write-ahead journal of each test's progress. If set, a restarted run reuses the model responses and scores that were journaled before it stopped and only calls the model for missing tests. Default is None (no journal).
         :param kwargs: Additional arguments.
         """
         if not model_to_test:
@@ -97,6 +129,13 @@ class LLMNeedleHaystackTester:
         self.print_ongoing_status = print_ongoing_status
         self.testing_results = []
 
+        if num_trials < 1 or min_trials < 1:
+            raise ValueError("num_trials and min_trials must be at least 1.")
+        self.num_trials = num_trials
+        self.min_trials = min(min_trials, num_trials)
+        self.trials_ci_half_width = trials_ci_half_width
+        self.journal = CellJournal(journal_path) if journal_path else None
+
         if context_lengths is None:
             if context_lengths_min is None or context_lengths_max is None or context_lengths_num_intervals is None:
                 raise ValueError("Either context_lengths_min, context_lengths_max, context_lengths_intervals need to be filled out OR the context_lengths_list needs to be supplied.")
@@ -156,11 +195,26 @@ class LLMNeedleHaystackTester:
                 tasks.append(task)
 
         # Wait for all tasks to complete
-        await asyncio.gather(*tasks)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if self.journal:
+                self.journal.close()
 
     async def evaluate_and_log(self, context_length, depth_percent, retrieval_question, needle):
-        self.retrieval_question = retrieval_question
-        self.needle = needle
+        cell_key = CellJournal.cell_key(self.model_name, context_length, depth_percent, self.results_version)
+        journaled_trials = {}
+        if self.journal:
+            if self.journal.is_persisted(cell_key):
+                print(f"Skipping {context_length} tokens, {depth_percent}% depth because result is already journaled.")
+                return
+            cell = self.journal.get(cell_key)
+            if cell:
+                # Resume with the needle the journaled responses were given, not a newly drawn one
+                needle = cell['needle']
+                retrieval_question = cell['retrieval_question']
+                journaled_trials = cell['trials']
+
         # Checks to see if you've already checked a length/percent/version.
         # This helps if the program stop running and you want to restart later
         if self.save_results:
@@ -168,26 +222,59 @@ class LLMNeedleHaystackTester:
                 print(f"Skipping {context_length} tokens, {depth_percent}% depth because result already exists.")
                 return
 
-        # Go generate the required length context and place your needle statement in
-        context = await self.generate_context(context_length, depth_percent)
+        if self.journal and not self.journal.get(cell_key):
+            self.journal.record(cell_key, CellJournal.DISPATCHED,
+                                needle=needle, retrieval_question=retrieval_question)
 
-        # Prepare your message to send to the model you're going to evaluate
-        prompt = self.model_to_test.generate_prompt(context, self.retrieval_question)
+        context = None
+        prompt = None
 
         test_start_time = time.time()
-        
-        try:
-            # Go see if the model can answer the question to pull out your random fact
-            response = await self.model_to_test.evaluate_model(prompt)
-            # Compare the reponse to the actual needle you placed
-            score = self.evaluation_model.evaluate_response(response, self.retrieval_question, self.needle)
-        except Exception as e:
-            print(f"Error evaluating model with {context_length} tokens, {depth_percent}% depth: {e}")
-            return
 
+        scores = []
+        responses = []
+        trial_error = None
+        while len(scores) < self.num_trials:
+            trial = len(scores)
+            journaled = journaled_trials.get(trial, {})
+            try:
+                if 'response' in journaled:
+                    # The model already answered this trial before the previous run stopped
+                    response = journaled['response']
+                else:
+                    if prompt is None:
+                        # Go generate the required length context and place your needle statement in
+                        context = await self.generate_context(context_length, depth_percent, needle)
+                        # Prepare your message to send to the model you're going to evaluate
+                        prompt = self.model_to_test.generate_prompt(context, retrieval_question)
+                    # Go see if the model can answer the question to pull out your random fact
+                    response = await self.model_to_test.evaluate_model(prompt)
+                    if self.journal:
+                        self.journal.record(cell_key, CellJournal.RESPONDED, trial=trial, response=response)
+
+                if 'score' in journaled:
+                    score = journaled['score']
+                else:
+                    # Compare the reponse to the actual needle you placed
+                    score = self.evaluation_model.evaluate_response(response, retrieval_question, needle)
+                    if self.journal:
+                        self.journal.record(cell_key, CellJournal.SCORED, trial=trial, score=score)
+            except Exception as e:
+                print(f"Error evaluating model with {context_length} tokens, {depth_percent}% depth: {e}")
+                if not scores:
+                    return
+                # Keep the trials that completed rather than throwing them away
+                trial_error = str(e)
+                break
+
+            scores.append(score)
+            responses.append(response)
+            if self.trials_converged(scores):
+                break
 
         test_end_time = time.time()
         test_elapsed_time = test_end_time - test_start_time
+        score, response = scores[-1], responses[-1]
 
         results = {
             # 'context' : context, # Uncomment this line if you'd like to save the context the model was asked to retrieve from. Warning: This will become very large.
@@ -195,13 +282,27 @@ class LLMNeedleHaystackTester:
             'context_length' : int(context_length),
             'depth_percent' : float(depth_percent),
             'version' : self.results_version,
-            'needle' : self.needle,
+            'needle' : needle,
             'model_response' : response,
             'score' : score,
             'test_duration_seconds' : test_elapsed_time,
             'test_timestamp_utc' : datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S%z')
         }
 
+        if self.num_trials > 1:
+            # Report the mean over all trials along with the spread of the individual scores
+            score = float(np.mean(scores))
+            results.update({
+                'score' : score,
+                'model_responses' : responses,
+                'trial_scores' : scores,
+                'num_trials' : len(scores),
+                'score_variance' : float(np.var(scores, ddof=1)) if len(scores) > 1 else 0.0,
+                'score_ci_half_width' : self.score_ci_half_width(scores),
+            })
+            if trial_error is not None:
+                results['trial_error'] = trial_error
+
         self.testing_results.append(results)
 
         if self.print_ongoing_status:
@@ -210,6 +311,8 @@ class LLMNeedleHaystackTester:
             print (f"Context: {context_length} tokens")
             print (f"Depth: {depth_percent}%")
             print (f"Score: {score}")
+            if self.num_trials > 1:
+                print (f"Trials: {len(scores)} (scores: {scores})")
             print (f"Needle: {needle}")
             print (f"Response: {response}\n")
 
@@ -218,6 +321,9 @@ class LLMNeedleHaystackTester:
         if self.save_contexts:
             results['file_name'] = context_file_location
 
+            if context is None:
+                context = await self.generate_context(context_length, depth_percent, needle)
+
             # Save the context to file for retesting
             if not os.path.exists('contexts'):
                 os.makedirs('contexts')
@@ -234,9 +340,36 @@ class LLMNeedleHaystackTester:
             with open(f'results/{context_file_location}_results.json', 'w') as f:
                 json.dump(results, f)
 
+        if self.journal:
+            self.journal.record(cell_key, CellJournal.PERSISTED)
+
         if self.seconds_to_sleep_between_completions:
             await asyncio.sleep(self.seconds_to_sleep_between_completions)
 
+    def score_ci_half_width(self, scores):
+        """
+        Returns the half-width of the Student's t 95% confidence interval of the mean score
+        """
+        if len(scores) < 2:
+            return float('inf')
+        return float(t_quantile_95(len(scores) - 1) * np.std(scores, ddof=1) / np.sqrt(len(scores)))
+
+    def trials_converged(self, scores):
+        """
+        Checks whether repeated trials of a single combination can stop early, either because
+        every trial agreed on the score or because the confidence interval is tight enough
+        """
+        if len(scores) >= self.num_trials:
+            return True
+        if len(scores) < self.min_trials:
+            return False
+        if len(set(scores)) == 1:
+            return True
+        # the interval needs a variance estimate from enough trials to be trusted
+        if len(scores) < MIN_TRIALS_FOR_CI:
+            return False
+        return self.score_ci_half_width(scores) <= self.trials_ci_half_width
+
     def result_exists(self, context_length, depth_percent):
         """
         Checks to see if a result has already been evaluated or not
@@ -258,7 +391,7 @@ class LLMNeedleHaystackTester:
                         return True
         return False
 
-    async def generate_context(self, context_length, depth_percent):
+    async def generate_context(self, context_length, depth_percent, needle=None):
         # Load up tiktoken so we navigate tokens more easily
 
         # Get your haystack dir files loaded into a string
@@ -268,12 +401,13 @@ class LLMNeedleHaystackTester:
         context = self.encode_and_trim(context, context_length)
 
         # Insert your random statement according to your depth percent
-        context = self.insert_needle(context, depth_percent, context_length)
+        context = self.insert_needle(context, depth_percent, context_length, needle)
 
         return context
     
-    def insert_needle(self, context, depth_percent, context_length):
-        tokens_needle = self.model_to_test.encode_text_to_tokens(self.needle)
+    def insert_needle(self, context, depth_percent, context_length, needle=None):
+        # The needle of the cell being evaluated, as self.needle may have been redrawn for another cell
+        tokens_needle = self.model_to_test.encode_text_to_tokens(needle if needle is not None else self.needle)
         tokens_context = self.model_to_test.encode_text_to_tokens(context)
 
         # Reducing the context length by 150 buffer. This is to account for system message, the user question, and response.
@@ -338,6 +472,8 @@ class LLMNeedleHaystackTester:
         print (f"- Model: {self.model_name}")
         print (f"- Context Lengths: {len(self.context_lengths)}, Min: {min(self.context_lengths)}, Max: {max(self.context_lengths)}")
         print (f"- Document Depths: {len(self.document_depth_percents)}, Min: {min(self.document_depth_percents)}%, Max: {max(self.document_depth_percents)}%")
+        if self.num_trials > 1:
+            print (f"- Trials: up to {self.num_trials} per combination, min {self.min_trials}, CI half-width {self.trials_ci_half_width}")
         print ("\n\n")
 
     def start_test(self):
@@ -1,2 +1,12 @@
-from .google import Google
-from .model import ModelProvider
\ No newline at end of file
+from .model import ModelProvider
+
+
+def __getattr__(name):
+    # Providers pull in their SDKs on import, so only load them once they are asked for
+    if name == "Google":
+        from .google import Google
+        return Google
+    if name == "GoogleMultiRegion":
+        from .google_multi_region import GoogleMultiRegion
+        return GoogleMultiRegion
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,5 @@
+import hashlib
 import os
-import pkg_resources
 import requests
 from typing import Optional
 
@@ -25,12 +25,16 @@ class Google(ModelProvider):
     DEFAULT_MODEL_KWARGS: dict = dict(max_output_tokens=300,
                                       temperature=0)
     VOCAB_FILE_URL = "https://raw.githubusercontent.com/google/gemma_pytorch/33b652c465537c6158f9a472ea5700e5e770ad3f/tokenizer/tokenizer.model"
+    TOKENIZER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "needlehaystack")
 
     def __init__(self,
                  project_id: str,
                  model_name: str = "gemini-1.5-pro",
                  model_kwargs: dict = DEFAULT_MODEL_KWARGS,
-                 vocab_file_url: str = VOCAB_FILE_URL):
+                 location: str = "us-central1",
+                 vocab_file_url: str = VOCAB_FILE_URL,
+                 vocab_file_sha256: Optional[str] = None,
+                 tokenizer_cache_dir: Optional[str] = None):
         """
         Initializes the Google model provider with a specific model.
 
@@ -38,32 +42,95 @@ class Google(ModelProvider):
             project_id (str): ID of the google cloud platform project to use
             model_name (str): The name of the Google model to use. Defaults to 'gemini-1.5-pro'.
             model_kwargs (dict): Model configuration. Defaults to {max_tokens: 300, temperature: 0}.
+            location (str): The Vertex AI region serving the model. Defaults to 'us-central1'.
             vocab_file_url (str): Sentencepiece model file that defines tokenization vocabulary. Deafults to gemma
                 tokenizer https://github.com/google/gemma_pytorch/blob/main/tokenizer/tokenizer.model
+            vocab_file_sha256 (Optional[str]): Expected SHA-256 of the vocab file. If not provided, the checksum of the
+                first download is recorded next to the cached file and verified on later runs.
+            tokenizer_cache_dir (Optional[str]): Directory where the vocab file is cached between runs. Defaults to
+                ~/.cache/needlehaystack
         """
 
         self.model_name = model_name
         self.model_kwargs = model_kwargs
-        vertexai.init(project=project_id, location="us-central1")
+        vertexai.init(project=project_id, location=location)
         self.model = GenerativeModel(self.model_name)
 
-        local_vocab_file = 'tokenizer.model'
-        if not os.path.exists(local_vocab_file):
-            response = requests.get(vocab_file_url)  # Download Tokenizer Vocab File (4MB)
-            response.raise_for_status()
-
-            with open(local_vocab_file, 'wb') as f:
-                for chunk in response.iter_content():
-                    f.write(chunk)
+        local_vocab_file = self.resolve_vocab_file(vocab_file_url,
+                                                   tokenizer_cache_dir or self.TOKENIZER_CACHE_DIR,
+                                                   vocab_file_sha256)
         self.tokenizer = sentencepiece.SentencePieceProcessor(local_vocab_file)
 
-        resource_path = pkg_resources.resource_filename('needlehaystack', 'providers/gemini_prompt.txt')
+        resource_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gemini_prompt.txt')
 
         # Generate the prompt structure for the model
         # Replace the following file with the appropriate prompt structure
         with open(resource_path, 'r') as file:
             self.prompt_structure = file.read()
 
+    @staticmethod
+    def resolve_vocab_file(vocab_file_url: str, cache_dir: str, sha256: Optional[str] = None) -> str:
+        """
+        Returns the path of a verified local copy of the tokenizer vocab file, downloading it only if the cached
+        copy is missing or does not match its checksum.
+
+        Args:
+            vocab_file_url (str): URL of the sentencepiece model file.
+            cache_dir (str): Directory holding cached vocab files, keyed by a hash of their URL.
+            sha256 (Optional[str]): Expected SHA-256 of the file. Defaults to the checksum recorded on first download.
+
+        Returns:
+            str: The path to the cached vocab file.
+        """
+        url_key = hashlib.sha256(vocab_file_url.encode("utf-8")).hexdigest()[:16]
+        local_vocab_file = os.path.join(cache_dir, f"{url_key}_{os.path.basename(vocab_file_url)}")
+        checksum_file = local_vocab_file + ".sha256"
+
+        expected = sha256
+        if expected is None and os.path.exists(checksum_file):
+            with open(checksum_file, 'r') as f:
+                expected = f.read().strip()
+
+        if os.path.exists(local_vocab_file):
+            actual = Google.file_sha256(local_vocab_file)
+            if expected is None or actual == expected:
+                if not os.path.exists(checksum_file):
+                    with open(checksum_file, 'w') as f:
+                        f.write(actual)
+                return local_vocab_file
+            print(f"Cached tokenizer {local_vocab_file} failed checksum verification, downloading it again.")
+
+        os.makedirs(cache_dir, exist_ok=True)
+        response = requests.get(vocab_file_url, stream=True)  # Download Tokenizer Vocab File (4MB)
+        response.raise_for_status()
+
+        # Write to a temporary file first so an interrupted download never leaves a partial file in the cache
+        tmp_file = f"{local_vocab_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+
+        # A download that doesn't match the recorded checksum means the file behind the URL changed, which
+        # must not silently replace the tokenizer earlier results were measured with
+        actual = Google.file_sha256(tmp_file)
+        if expected is not None and actual != expected:
+            os.remove(tmp_file)
+            source = "expected" if sha256 is not None else f"recorded in {checksum_file}"
+            raise ValueError(f"Checksum mismatch for {vocab_file_url}: {source} {expected}, got {actual}")
+
+        os.replace(tmp_file, local_vocab_file)
+        with open(checksum_file, 'w') as f:
+            f.write(actual)
+        return local_vocab_file
+
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
     async def evaluate_model(self, prompt: str) -> str:
         """
         Evaluates a given prompt using the Google model and retrieves the model's response.
@@ -74,7 +141,20 @@ class Google(ModelProvider):
         Returns:
             str: The content of the model's response to the prompt.
         """
-        response = await self.model.generate_content_async(
+        return await self.generate(self.model, prompt)
+
+    async def generate(self, model: GenerativeModel, prompt: str) -> str:
+        """
+        Sends a prompt to the given Gemini client with this provider's generation config and safety settings.
+
+        Args:
+            model (GenerativeModel): The client to send the prompt to.
+            prompt (str): The prompt to send to the model.
+
+        Returns:
+            str: The content of the model's response to the prompt.
+        """
+        response = await model.generate_content_async(
             prompt,
             generation_config=self.model_kwargs,
             safety_settings={
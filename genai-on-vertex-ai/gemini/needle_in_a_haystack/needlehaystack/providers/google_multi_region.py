@@ -0,0 +1,171 @@
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import vertexai
+from google.api_core import exceptions
+from vertexai.generative_models import GenerativeModel
+
+from .google import Google
+
+
+# 429 and 5xx responses are specific to the endpoint that returned them, so the request is retried elsewhere
+RETRYABLE_ERRORS = (exceptions.TooManyRequests, exceptions.ServerError)
+
+
+@dataclass
+class RegionEndpoint:
+    """
+    A Gemini client bound to a single project and location, along with its load and health counters.
+    """
+    project_id: str
+    location: str
+    model: GenerativeModel
+    in_flight: int = 0
+    requests: int = 0
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    cooldown_until: float = 0.0
+    total_latency_seconds: float = 0.0
+    started_at: float = field(default_factory=time.time)
+
+    @property
+    def name(self) -> str:
+        return f"{self.project_id}/{self.location}"
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def stats(self) -> dict:
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        return {
+            'endpoint': self.name,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'healthy': self.is_healthy(time.time()),
+            'avg_latency_seconds': self.total_latency_seconds / self.successes if self.successes else None,
+            'throughput_per_minute': 60 * self.successes / elapsed,
+        }
+
+
+class GoogleMultiRegion(Google):
+    """
+    A Google model provider that spreads requests over a pool of Gemini clients in several projects and locations,
+    so that the throughput of a sweep is bounded by the combined quota of all endpoints rather than a single region.
+
+    Each request goes to the healthy endpoint with the fewest requests in flight. Endpoints answering with 429 or
+    5xx errors are put in an exponentially growing cooldown and the request fails over to another endpoint.
+    """
+
+    DEFAULT_LOCATIONS = ["us-central1", "us-east4", "us-west1", "europe-west4", "asia-northeast1"]
+
+    def __init__(self,
+                 project_ids: list[str],
+                 locations: Optional[list[str]] = None,
+                 model_name: str = "gemini-1.5-pro",
+                 model_kwargs: dict = Google.DEFAULT_MODEL_KWARGS,
+                 base_cooldown_seconds: float = 5.0,
+                 max_cooldown_seconds: float = 120.0,
+                 **kwargs):
+        """
+        Initializes a pool of Gemini clients, one per combination of project and location.
+
+        Args:
+            project_ids (list[str]): IDs of the google cloud platform projects to send requests to.
+            locations (Optional[list[str]]): Vertex AI regions to send requests to. Defaults to DEFAULT_LOCATIONS.
+            model_name (str): The name of the Google model to use. Defaults to 'gemini-1.5-pro'.
+            model_kwargs (dict): Model configuration. Defaults to {max_tokens: 300, temperature: 0}.
+            base_cooldown_seconds (float): How long an endpoint is skipped after its first retryable error.
+                Doubles with each consecutive error.
+            max_cooldown_seconds (float): Upper bound on the cooldown of an endpoint.
+            kwargs: Additional arguments passed on to the Google provider, e.g. the tokenizer settings.
+        """
+        if not project_ids:
+            raise ValueError("At least one project ID must be provided.")
+        locations = locations or self.DEFAULT_LOCATIONS
+
+        super().__init__(project_id=project_ids[0],
+                         model_name=model_name,
+                         model_kwargs=model_kwargs,
+                         location=locations[0],
+                         **kwargs)
+
+        self.base_cooldown_seconds = base_cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.endpoints = []
+        for project_id in project_ids:
+            for location in locations:
+                # GenerativeModel binds to the project and location that are configured when it is created
+                vertexai.init(project=project_id, location=location)
+                self.endpoints.append(RegionEndpoint(project_id=project_id,
+                                                     location=location,
+                                                     model=GenerativeModel(self.model_name)))
+        vertexai.init(project=project_ids[0], location=locations[0])
+
+    def select_endpoint(self, exclude: Optional[set] = None) -> RegionEndpoint:
+        """
+        Picks the least loaded healthy endpoint. If every endpoint is cooling down, picks the one that recovers first.
+
+        Args:
+            exclude (Optional[set]): Names of endpoints that already failed for the current request.
+
+        Returns:
+            RegionEndpoint: The endpoint to send the next request to.
+        """
+        now = time.time()
+        candidates = [e for e in self.endpoints if not exclude or e.name not in exclude] or self.endpoints
+        healthy = [e for e in candidates if e.is_healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda e: e.cooldown_until)
+        least_loaded = min(e.in_flight for e in healthy)
+        return random.choice([e for e in healthy if e.in_flight == least_loaded])
+
+    async def evaluate_model(self, prompt: str) -> str:
+        """
+        Evaluates a given prompt on the least loaded endpoint, failing over to the other endpoints on 429/5xx errors.
+
+        Args:
+            prompt (str): The prompt to send to the model.
+
+        Returns:
+            str: The content of the model's response to the prompt.
+        """
+        tried = set()
+        while True:
+            endpoint = self.select_endpoint(exclude=tried)
+            tried.add(endpoint.name)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            start_time = time.time()
+            try:
+                response = await self.generate(endpoint.model, prompt)
+            except RETRYABLE_ERRORS as e:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                cooldown = min(self.base_cooldown_seconds * 2 ** (endpoint.consecutive_failures - 1),
+                               self.max_cooldown_seconds)
+                endpoint.cooldown_until = time.time() + cooldown
+                if len(tried) >= len(self.endpoints):
+                    raise
+                print(f"Endpoint {endpoint.name} failed ({e.code}), failing over.")
+                continue
+            except Exception:
+                endpoint.failures += 1
+                raise
+            finally:
+                endpoint.in_flight -= 1
+
+            endpoint.successes += 1
+            endpoint.consecutive_failures = 0
+            endpoint.total_latency_seconds += time.time() - start_time
+            return response
+
+    def get_endpoint_stats(self) -> list[dict]:
+        """
+        Returns the load, health and throughput of every endpoint in the pool.
+        """
+        return [endpoint.stats() for endpoint in self.endpoints]
@@ -0,0 +1,161 @@
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from jsonargparse import CLI
+
+RESULT_COLUMNS = ['model', 'context_length', 'depth_percent', 'version', 'score']
+
+
+@dataclass
+class ReportArgs():
+    results_dirs: Optional[list[str]] = None
+    output_dir: Optional[str] = "reports"
+    compare_by: Optional[str] = "model"
+    models: Optional[list[str]] = None
+    versions: Optional[list[int]] = None
+    num_workers: Optional[int] = 32
+    render_heatmaps: Optional[bool] = True
+
+
+def _read_result_file(path: str) -> list[tuple]:
+    """
+    Reads the fields needed for reporting from a single .json result or a .jsonl file of results.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.jsonl'):
+        records = [json.loads(line) for line in data.splitlines() if line.strip()]
+    else:
+        records = [json.loads(data)]
+    return [(r.get('model'), r.get('context_length'), r.get('depth_percent'), r.get('version', 1), r.get('score'))
+            for r in records if 'score' in r]
+
+
+def load_results(results_dirs: list[str], num_workers: int = 32) -> pd.DataFrame:
+    """
+    Loads every result in the given directories into a single DataFrame in one pass.
+
+    Args:
+        results_dirs (list[str]): Directories containing .json results (one per test) and/or .jsonl result stores.
+        num_workers (int): Number of threads used to read files. Reading many small files is I/O bound.
+
+    Returns:
+        pd.DataFrame: One row per test with the columns model, context_length, depth_percent, version and score.
+    """
+    paths = []
+    for results_dir in results_dirs:
+        if not os.path.isdir(results_dir):
+            raise ValueError(f"Results directory not found: {results_dir}")
+        with os.scandir(results_dir) as entries:
+            paths.extend(entry.path for entry in entries
+                         if entry.is_file() and entry.name.endswith(('.json', '.jsonl')))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        rows = [row for file_rows in executor.map(_read_result_file, paths) for row in file_rows]
+
+    df = pd.DataFrame.from_records(rows, columns=RESULT_COLUMNS)
+    df['context_length'] = df['context_length'].astype(int)
+    df['depth_percent'] = df['depth_percent'].astype(float)
+    df['version'] = df['version'].astype(int)
+    df['score'] = pd.to_numeric(df['score'], errors='coerce')
+    return df
+
+
+def build_score_matrix(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pivots results into the depth-by-length score matrix behind the heatmap. Repeated tests of a cell are averaged.
+    """
+    return df.pivot_table(index='depth_percent', columns='context_length', values='score', aggfunc='mean')
+
+
+def build_aggregates(df: pd.DataFrame, compare_by: str) -> dict[str, pd.DataFrame]:
+    """
+    Computes per-length and per-depth score aggregates, with one column group per model or version.
+    """
+    aggregates = {}
+    for dimension in ['context_length', 'depth_percent']:
+        aggregates[dimension] = (df.groupby([dimension, compare_by])['score']
+                                 .agg(['mean', 'std', 'count'])
+                                 .unstack(compare_by))
+    aggregates['overall'] = df.groupby(compare_by)['score'].agg(['mean', 'std', 'count'])
+    return aggregates
+
+
+def render_heatmaps(matrices: dict, output_path: str):
+    """
+    Renders one heatmap per model or version side by side, sharing the colour scale of the scores.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+
+    cmap = LinearSegmentedColormap.from_list("needle", ["#F0496E", "#EBB839", "#0CD79F"])
+    fig, axes = plt.subplots(1, len(matrices), figsize=(8 * len(matrices), 6), squeeze=False)
+    for ax, (label, matrix) in zip(axes[0], matrices.items()):
+        image = ax.imshow(matrix.to_numpy(dtype=float), cmap=cmap, vmin=1, vmax=10, aspect='auto')
+        ax.set_xticks(np.arange(matrix.shape[1]), labels=matrix.columns, rotation=45, ha='right')
+        ax.set_yticks(np.arange(matrix.shape[0]), labels=[f"{depth:g}" for depth in matrix.index])
+        ax.set_xlabel("Token Limit")
+        ax.set_ylabel("Depth Percent")
+        ax.set_title(f"Pressure Testing {label}")
+        fig.colorbar(image, ax=ax, label="Score")
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=150)
+    plt.close(fig)
+
+
+def generate_report(args: ReportArgs) -> dict:
+    """
+    Loads results, builds score matrices and aggregates, and writes them to the output directory.
+
+    Returns:
+        dict: The score matrix per model or version, and the aggregate tables.
+    """
+    if args.compare_by not in ['model', 'version']:
+        raise ValueError(f"Invalid compare_by: {args.compare_by}. Must be either 'model' or 'version'.")
+
+    df = load_results(args.results_dirs or ['results'], args.num_workers)
+    if args.models:
+        df = df[df['model'].isin(args.models)]
+    if args.versions:
+        df = df[df['version'].isin(args.versions)]
+    if df.empty:
+        raise ValueError("No results found to report on.")
+
+    matrices = {label: build_score_matrix(group) for label, group in df.groupby(args.compare_by)}
+    aggregates = build_aggregates(df, args.compare_by)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for label, matrix in matrices.items():
+        file_label = str(label).replace(".", "_").replace("/", "_")
+        matrix.to_csv(os.path.join(args.output_dir, f"{args.compare_by}_{file_label}_score_matrix.csv"))
+    for name, aggregate in aggregates.items():
+        aggregate.to_csv(os.path.join(args.output_dir, f"by_{name}.csv"))
+    if args.render_heatmaps:
+        render_heatmaps(matrices, os.path.join(args.output_dir, "heatmap.png"))
+
+    return {'matrices': matrices, 'aggregates': aggregates}
+
+
+def main():
+    """
+    Builds depth-by-length heatmaps and score aggregates from saved test results.
+    """
+    args = CLI(ReportArgs, as_positional=False)
+    report = generate_report(args)
+
+    print(f"Results by {args.compare_by}:")
+    print(report['aggregates']['overall'].to_string())
+    print(f"\nReport written to {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
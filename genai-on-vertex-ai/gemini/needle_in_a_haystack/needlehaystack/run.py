@@ -4,12 +4,14 @@ from typing import Optional
 from jsonargparse import CLI
 
 from . import LLMNeedleHaystackTester
-from .evaluators import Evaluator, GoogleEvaluator
-from .providers import ModelProvider, Google
+from .evaluators import Evaluator
+from .providers import ModelProvider
 
 @dataclass
 class CommandArgs():
     gcp_project_id: str
+    gcp_project_ids: Optional[list[str]] = None
+    locations: Optional[list[str]] = None
     provider: str = "google"
     evaluator: str = "google"
     model_name: str = "gemini-1.5-pro"
@@ -34,12 +36,18 @@ class CommandArgs():
     final_context_length_buffer: Optional[int] = 200
     seconds_to_sleep_between_completions: Optional[float] = None
     print_ongoing_status: Optional[bool] = True
+    tokenizer_cache_dir: Optional[str] = None
+    num_trials: Optional[int] = 1
+    min_trials: Optional[int] = 2
+    trials_ci_half_width: Optional[float] = 0.5
+    journal_path: Optional[str] = None
 
 
 
 def get_model_to_test(args: CommandArgs) -> ModelProvider:
     """
     Determines and returns the appropriate model provider based on the provided command arguments.
+    The provider module is only imported once it has been selected.
     
     Args:
         args (CommandArgs): The command line arguments parsed into a CommandArgs dataclass instance.
@@ -52,13 +60,23 @@ def get_model_to_test(args: CommandArgs) -> ModelProvider:
     """
     match args.provider.lower():
         case "google":
-            return Google(model_name=args.model_name, project_id=args.gcp_project_id)
+            from .providers.google import Google
+            return Google(model_name=args.model_name,
+                          project_id=args.gcp_project_id,
+                          tokenizer_cache_dir=args.tokenizer_cache_dir)
+        case "google_multi_region":
+            from .providers.google_multi_region import GoogleMultiRegion
+            return GoogleMultiRegion(model_name=args.model_name,
+                                     project_ids=args.gcp_project_ids or [args.gcp_project_id],
+                                     locations=args.locations,
+                                     tokenizer_cache_dir=args.tokenizer_cache_dir)
         case _:
             raise ValueError(f"Invalid provider: {args.provider}")
 
 def get_evaluator(args: CommandArgs) -> Evaluator:
     """
     Selects and returns the appropriate evaluator based on the provided command arguments.
+    The evaluator module is only imported once it has been selected.
     
     Args:
         args (CommandArgs): The command line arguments parsed into a CommandArgs dataclass instance.
@@ -71,6 +89,7 @@ def get_evaluator(args: CommandArgs) -> Evaluator:
     """
     match args.evaluator.lower():
         case "google":
+            from .evaluators.google import GoogleEvaluator
             return GoogleEvaluator(project_id=args.gcp_project_id,
                                    model_name=args.evaluator_model_name)
         case _:
@@ -90,5 +109,11 @@ def main():
     tester = LLMNeedleHaystackTester(**args.__dict__)
     tester.start_test()
 
+    if args.print_ongoing_status and hasattr(args.model_to_test, "get_endpoint_stats"):
+        print("-- Endpoint Summary --")
+        for stats in args.model_to_test.get_endpoint_stats():
+            print(f"{stats['endpoint']}: {stats['successes']}/{stats['requests']} succeeded, "
+                  f"{stats['throughput_per_minute']:.1f} requests/min")
+
 if __name__ == "__main__":
     main()
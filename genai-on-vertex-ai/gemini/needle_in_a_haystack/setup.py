@@ -19,6 +19,7 @@ setup(
     entry_points={
         'console_scripts': [
             'needlehaystack.run_test = needlehaystack.run:main',
+            'needlehaystack.report = needlehaystack.report:main',
         ],
     },
 )
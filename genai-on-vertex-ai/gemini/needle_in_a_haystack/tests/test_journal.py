@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from needlehaystack.journal import CellJournal
+
+from test_trials import FakeModel, ScriptedEvaluator, LLMNeedleHaystackTester
+
+
+def test_replay_restores_the_latest_state_of_each_cell(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = CellJournal(str(path))
+    journal.record("a", CellJournal.DISPATCHED, needle="n", retrieval_question="q")
+    journal.record("a", CellJournal.RESPONDED, trial=0, response="r")
+    journal.record("a", CellJournal.SCORED, trial=0, score=10)
+    journal.record("b", CellJournal.DISPATCHED, needle="n", retrieval_question="q")
+    journal.record("b", CellJournal.PERSISTED)
+    journal.close()
+    # a record torn by a crash mid-write is ignored
+    with open(path, "a") as f:
+        f.write('{"key": "c", "sta')
+
+    replayed = CellJournal(str(path))
+    assert replayed.get("a")["trials"] == {0: {"response": "r", "score": 10}}
+    assert replayed.get("a")["needle"] == "n"
+    assert replayed.is_persisted("b") and not replayed.is_persisted("a")
+    assert replayed.get("c") is None
+    replayed.close()
+
+
+def test_records_are_flushed_and_synced_by_the_timer(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = CellJournal(str(path), fsync_every=100, fsync_interval_seconds=0.05)
+    journal.record("a", CellJournal.DISPATCHED, needle="n", retrieval_question="q")
+    # flushed as it is written, before any fsync
+    assert path.read_text().count("\n") == 1
+    deadline = time.time() + 2
+    while journal.pending_records and time.time() < deadline:
+        time.sleep(0.01)
+    assert journal.pending_records == 0
+    journal.close()
+
+
+def make_tester(journal_path, scores, model):
+    return LLMNeedleHaystackTester(
+        model_to_test=model, evaluator=ScriptedEvaluator(scores), dynamic_needle=False,
+        needle="The magic number is 7.", retrieval_question="What is the magic number?",
+        context_lengths=[500], document_depth_percents=[50], save_results=False, save_contexts=False,
+        print_ongoing_status=False, num_trials=2, journal_path=str(journal_path))
+
+
+def test_restart_reuses_journaled_responses(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    model = FakeModel()
+    key = CellJournal.cell_key(model.model_name, 500, 50, 1)
+    journal = CellJournal(str(path))
+    journal.record(key, CellJournal.DISPATCHED, needle="The magic number is 7.", retrieval_question="q")
+    journal.record(key, CellJournal.RESPONDED, trial=0, response="journaled answer")
+    journal.close()
+
+    tester = make_tester(path, [10, 10], model)
+    asyncio.run(tester.run_test())
+    assert model.calls == 1
+    assert tester.get_results()[0]["model_responses"] == ["journaled answer", "answer 1"]
+
+    # the cell is persisted, so a second restart doesn't evaluate it again
+    model = FakeModel()
+    tester = make_tester(path, [], model)
+    asyncio.run(tester.run_test())
+    assert model.calls == 0 and tester.get_results() == []
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported once a provider or evaluator is selected
+SDK_MODULES = ('vertexai', 'google.cloud.aiplatform', 'langchain', 'langchain_google_vertexai', 'sentencepiece')
+
+
+def test_cli_import_loads_no_provider_sdk():
+    code = ("import sys, needlehaystack.run; "
+            f"print('\\n'.join(m for m in sys.modules if m.startswith({SDK_MODULES!r})))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=PACKAGE_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
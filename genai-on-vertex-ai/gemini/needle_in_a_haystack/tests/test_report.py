@@ -0,0 +1,17 @@
+import json
+
+from needlehaystack.report import build_score_matrix, load_results
+
+
+def test_load_results_reads_json_and_jsonl(tmp_path):
+    results = [dict(model="m", context_length=1000, depth_percent=d, version=1, score=s)
+               for d, s in ((0.0, 10), (50.0, 5), (100.0, 1))]
+    (tmp_path / "a_results.json").write_text(json.dumps(results[0]))
+    (tmp_path / "store.jsonl").write_text("\n".join(json.dumps(r) for r in results[1:]) + "\n")
+    (tmp_path / "notes.txt").write_text("not a result")
+
+    df = load_results([str(tmp_path)], num_workers=2)
+    assert sorted(df["score"]) == [1, 5, 10]
+
+    matrix = build_score_matrix(df)
+    assert matrix.loc[50.0, 1000] == 5
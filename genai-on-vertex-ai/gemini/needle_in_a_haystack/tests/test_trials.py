@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from needlehaystack.evaluators import Evaluator
+from needlehaystack.llm_needle_haystack_tester import LLMNeedleHaystackTester
+from needlehaystack.providers import ModelProvider
+
+
+class FakeModel(ModelProvider):
+    """Answers every prompt, encoding text one character per token."""
+
+    model_name = "fake-model"
+
+    def __init__(self, fail_on_call=None):
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+
+    async def evaluate_model(self, prompt):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("model unavailable")
+        return f"answer {self.calls}"
+
+    def generate_prompt(self, context, retrieval_question):
+        return f"{context}\n{retrieval_question}"
+
+    def encode_text_to_tokens(self, text):
+        return [ord(c) for c in text]
+
+    def decode_tokens(self, tokens, context_length=None):
+        return "".join(chr(t) for t in tokens[:context_length])
+
+
+class ScriptedEvaluator(Evaluator):
+    """Returns the given scores in order."""
+
+    def __init__(self, scores):
+        self.scores = list(scores)
+
+    def evaluate_response(self, response, question_asked, true_answer):
+        return self.scores.pop(0)
+
+
+def run_cell(scores, fail_on_call=None, **kwargs):
+    model = FakeModel(fail_on_call)
+    tester = LLMNeedleHaystackTester(
+        model_to_test=model, evaluator=ScriptedEvaluator(scores), dynamic_needle=False,
+        needle="The magic number is 7.", retrieval_question="What is the magic number?",
+        context_lengths=[500], document_depth_percents=[50], save_results=False, save_contexts=False,
+        print_ongoing_status=False, **kwargs)
+    asyncio.run(tester.run_test())
+    return model, tester.get_results()
+
+
+def test_agreeing_trials_stop_after_min_trials():
+    model, results = run_cell([10] * 5, num_trials=5)
+    assert model.calls == 2
+    assert results[0]["trial_scores"] == [10, 10]
+    assert results[0]["score_variance"] == 0.0
+
+
+def test_min_trials_of_one_is_honored():
+    model, results = run_cell([10] * 5, num_trials=5, min_trials=1)
+    assert model.calls == 1
+    assert results[0]["num_trials"] == 1
+
+
+def test_confidence_interval_needs_three_trials():
+    # two close but different scores have a finite interval, which isn't trusted yet
+    model, results = run_cell([5, 6, 5, 6, 5], num_trials=5, trials_ci_half_width=10)
+    assert model.calls == 3
+    assert results[0]["score_ci_half_width"] <= 10
+
+
+def test_disagreeing_trials_run_to_num_trials():
+    model, results = run_cell([1, 10, 1, 10], num_trials=4)
+    assert model.calls == 4
+    assert results[0]["score"] == pytest.approx(5.5)
+
+
+def test_completed_trials_are_kept_on_error():
+    model, results = run_cell([1, 10, 1], fail_on_call=3, num_trials=4)
+    assert results[0]["trial_scores"] == [1, 10]
+    assert results[0]["trial_error"] == "model unavailable"